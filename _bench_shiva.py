@@ -0,0 +1,98 @@
+# =======================
+# Solex - _bench_shiva.py
+# =======================
+
+# Usage: python _bench_shiva.py [repeats]
+# Times the Shiva compiler against the old line splitting, 'eval' based
+# one on every body under data/bodies, and checks both give the same
+# recipes.
+
+# System imports.
+import os
+import sys
+from time import perf_counter
+
+# Local imports.
+from etc.settings import _path
+from etc.shiva import Shiva_Compiler as SC, BODY_QUALS, TERRAIN_QUALS, BODY_COLS, BODY_TEMPLATES
+
+REPEATS = 50
+
+
+def legacy_compile_body_recipe(shiva_str):
+    # The body compiler as it was before the Shiva parser.
+    lines = shiva_str.split("\n")
+    recipe = {'terrains':[]}
+    current_block = recipe
+    _ignore = False
+    _prev_indent = 0
+    for line in lines:
+        strip_line = line.strip()
+        if not strip_line: continue
+        if strip_line.startswith("/"):
+            if strip_line.startswith("/*"):
+                _ignore = True
+            continue
+        if strip_line.endswith("*/"):
+            _ignore = False
+            continue
+        if _ignore:
+            continue
+        indent = len(line) - len(line.lstrip())
+        tokens = strip_line.split(" ")
+        if indent < _prev_indent:
+            current_block = recipe
+            if indent == 0:
+                current_block = None
+        if tokens[-1].endswith(":"):
+            if tokens[0] in BODY_QUALS:
+                recipe['name'] = tokens[-1][:-1].lower()
+                recipe['zone'] = tokens[0]
+                if len(tokens) == 4:
+                    recipe['class'] = "{}_{}".format(tokens[1], tokens[2])
+                else:
+                    recipe['class'] = tokens[-2]
+                recipe['colour'] = BODY_COLS[tokens[-2]]
+                recipe.update(BODY_TEMPLATES[recipe['class']])
+            elif tokens[0] in TERRAIN_QUALS:
+                current_block = {'name':tokens[-1][:-1].lower()}
+                recipe['terrains'].append(current_block)
+        elif tokens[0].startswith("$"):
+            if current_block:
+                toks = []
+                for t in tokens[1:]:
+                    if "->" in t:
+                        t1, t2 = t.split("->")
+                        t = "({}, {})".format(t1, t2)
+                    toks.append(t.strip())
+                current_block[tokens[0][1:]] = eval(" ".join(toks))
+        _prev_indent = indent
+    return recipe
+
+def time_compile(compile_fn, sources, repeats):
+    start = perf_counter()
+    for i in range(repeats):
+        for shiva_str in sources.values():
+            compile_fn(shiva_str)
+    return (perf_counter()-start) / repeats
+
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else REPEATS
+    sources = {}
+    for body_name in sorted(os.listdir(_path.BODIES)):
+        shv_path = "{}/{}/{}.shv".format(_path.BODIES, body_name, body_name)
+        if os.path.exists(shv_path):
+            with open(shv_path) as shv_file:
+                sources[body_name] = shv_file.read()
+
+    mismatched = [name for name, shiva_str in sources.items()
+                  if SC.compile_body_recipe(shiva_str) != legacy_compile_body_recipe(shiva_str)]
+    for name in mismatched:
+        print("Recipes differ for '{}'.".format(name))
+
+    old_t = time_compile(legacy_compile_body_recipe, sources, repeats)
+    new_t = time_compile(SC.compile_body_recipe, sources, repeats)
+    print("{} bodies, {} repeats".format(len(sources), repeats))
+    print("  eval compiler    {:8.3f} ms per pass".format(old_t*1000))
+    print("  Shiva parser     {:8.3f} ms per pass  ({:.2f}x)".format(new_t*1000, old_t/new_t))
@@ -0,0 +1,206 @@
+# ===========================
+# Solex - _bench_simulator.py
+# ===========================
+
+# Usage: python _bench_simulator.py [out.json] [size ...]
+# Headless (no window) benchmark of the simulator on synthetic systems
+# of 'size' bodies (default 10, 100, 1000, 10000) and on sol.shv. Every
+# engine is run for real through 'Simulator.start', unthrottled, so each
+# tick is one step with its state writes, ring publish and events; the
+# ticks are timed in the worker. 'get_state' is timed separately against
+# a normally throttled simulator, and one Barnes-Hut force pass alone
+# (time and peak memory) on systems of ACCEL_SIZES bodies against the
+# frame budget of one step. Results go to 'out.json' (default
+# 'data/bench/bench_<commit>.json') for comparing across commits.
+
+# System imports.
+import sys
+import json
+import platform
+import subprocess
+import tracemalloc
+from os import makedirs
+from time import perf_counter, sleep
+
+# Third party imports.
+import numpy as np
+
+# Local imports.
+from etc.settings import _path, _sim, _phys
+from etc.shiva import Shiva_Compiler as SC
+from solex.simulator import Simulator
+from solex.kepler import Kepler_Orbits
+from solex.physics import Sys_Arrays
+from solex.octree import barnes_hut_accel
+from solex.ephemeris import segment_lengths, build_ephemeris, save_ephemeris
+
+SIZES = [10, 100, 1000, 10000]
+ACCEL_SIZES = [10000, 20000, 50000]
+ENGINES = (("python", "python", None),      # (label, mode, gravity)
+           ("hierarchical", "numpy", "hierarchical"),
+           ("pairwise", "numpy", "pairwise"),
+           ("barnes_hut", "numpy", "barnes_hut"),
+           ("kepler", "kepler", None),
+           ("ephemeris", "ephemeris", None))
+BENCH_DIR = "{}/data/bench".format(_path.SOLEX)
+BENCH_SECS = 2.0            # Running time per system and engine.
+WARM_UP_TICKS = 5           # First ticks left out of the timing.
+EPHEM_SECS = 3600.0         # Sim time covered by the bench ephemerides.
+STATE_CALLS = 500           # 'get_state' calls per system.
+ACCEL_CALLS = 10            # Barnes-Hut force passes per system.
+MAX_PAIRWISE = 1000         # Larger systems skip the O(N^2) model.
+MAX_PYTHON = 1000           # Larger systems skip the per body Python engine.
+PERCENTILES = (50, 90, 99)
+
+
+def synth_system(n, seed=0):
+    # A star with about sqrt(n) planets and the rest of the bodies
+    # shared out among them as moons.
+    rng = np.random.default_rng(seed)
+    n_planets = max(1, min(n-1, int(round(np.sqrt(n)))))
+    n_moons = n - 1 - n_planets
+    moons_per = np.bincount(rng.integers(0, n_planets, n_moons), minlength=n_planets)
+
+    def body(name, mass, radius, sm_axis, ecc, far_horizon, sats):
+        return {'name':name, 'type':"planet", 'mass':mass, 'radius':radius,
+                'sm_axis':sm_axis, 'aphelion':sm_axis*(1+ecc),
+                'inclination':float(rng.uniform(0, 8)), 'spin':float(rng.uniform(5, 40)),
+                'tilt':float(rng.uniform(0, 30)), 'tilt_rasc':0,
+                'far_horizon':far_horizon, 'sats':sats}
+
+    planets = []
+    for p, n_sats in enumerate(moons_per):
+        p_radius = float(rng.uniform(2e3, 7e4))
+        moons = [body("p{}_m{}".format(p, m), float(10**rng.uniform(19, 22)), float(rng.uniform(10, 2e3)),
+                      p_radius*float(rng.uniform(3, 60)), float(rng.uniform(0, .05)), 4800, [])
+                 for m in range(n_sats)]
+        planets.append(body("p{}".format(p), float(10**rng.uniform(23, 27)), p_radius,
+                            float(10**rng.uniform(7.7, 9.6)), float(rng.uniform(0, .1)), 4800, moons))
+    star = body("synth_{}".format(n), 2e30, 7e5, 0, 0, 10000, planets)
+    star['aphelion'] = star['sm_axis'] = star['inclination'] = 0
+    return star
+
+def latency_stats(times):
+    times = np.asarray(times) * 1000.0
+    stats = {"p{}_ms".format(p):float(np.percentile(times, p)) for p in PERCENTILES}
+    stats['mean_ms'] = float(times.mean())
+    stats['max_ms'] = float(times.max())
+    return stats
+
+def bench_ephemeris(label, sys_recipe):
+    # A short ephemeris of the system, covering the bench run.
+    arrs = Sys_Arrays(sys_recipe)
+    orbits = Kepler_Orbits(arrs)
+    table, coeffs = build_ephemeris(arrs, orbits.relative, segment_lengths(orbits), 0.0, EPHEM_SECS)
+    ephem_path = "{}/{}.eph".format(BENCH_DIR, label)
+    save_ephemeris(ephem_path, table, coeffs, 0.0, EPHEM_SECS, arrs.NAMES)
+    return ephem_path
+
+def bench_engine(sim, sys_recipe, mode, gravity, ephem_path):
+    # Per step time of the engine running flat out.
+    sim.init_system(sys_recipe)
+    if mode == "ephemeris":
+        sim.load_ephemeris(ephem_path)
+    sim.start(mode, gravity or _sim.GRAVITY, throttle=False)
+    sleep(BENCH_SECS)
+    sim.stop()
+    times = sim.run_stats['tick_times'][WARM_UP_TICKS:]
+    if not times:
+        raise ValueError("Engine '{}' ran no timed steps.".format(mode))
+    result = latency_stats(times)
+    result['steps'] = len(times)
+    result['steps_per_sec'] = len(times) / sum(times)
+    result['realtime_ratio'] = result['steps_per_sec'] / _sim.HZ
+    return result
+
+def bench_get_state(sim, sys_recipe):
+    # 'get_state' and 'get_state_changes' against a live (throttled)
+    # simulator, with the observer at the first planet.
+    sim.init_system(sys_recipe)
+    sim.start("numpy")
+    try:
+        sleep(.5)
+        obs = sim.get_object_state(sys_recipe['sats'][0]['name'], ["sys_pos"])['sys_pos']
+        results = {}
+        for name, call in (("get_state", lambda: sim.get_state(obs)),
+                           ("get_state_changes", lambda: sim.get_state_changes(obs, 0))):
+            times = []
+            for i in range(STATE_CALLS):
+                t = perf_counter()
+                call()
+                times.append(perf_counter()-t)
+            results[name] = latency_stats(times)
+        return results
+    finally:
+        sim.stop()
+
+def bench_accel(n):
+    # One Barnes-Hut force pass over every body of a synthetic system,
+    # against the time one step has at HZ.
+    arrs = Sys_Arrays(synth_system(n))
+    pos, mass = arrs.POS[:arrs.count].copy(), arrs.MASS[:arrs.count].copy()
+    acc = np.zeros_like(pos)
+    tracemalloc.start()
+    barnes_hut_accel(pos, mass, _phys.G, acc, _sim.BH_THETA)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times = []
+    for i in range(ACCEL_CALLS):
+        t = perf_counter()
+        barnes_hut_accel(pos, mass, _phys.G, acc, _sim.BH_THETA)
+        times.append(perf_counter()-t)
+    result = latency_stats(times)
+    result['peak_mb'] = peak / 2**20
+    result['frame_ms'] = 1000.0 / _sim.HZ
+    result['in_frame'] = result['p50_ms'] <= result['frame_ms']
+    print("  {:>6} bodies  p50 {:.1f} ms  ({:.1f} frames)  peak {:.0f} MB".format(
+          n, result['p50_ms'], result['p50_ms']/result['frame_ms'], result['peak_mb']))
+    return result
+
+def bench_system(label, sys_recipe):
+    n = Sys_Arrays(sys_recipe).count
+    print("{} ({} bodies)".format(label, n))
+    ephem_path = bench_ephemeris(label, sys_recipe)
+    sim = Simulator(n+16)
+    engines = {}
+    try:
+        for name, mode, gravity in ENGINES:
+            if name == "pairwise" and n > MAX_PAIRWISE: continue
+            if name == "python" and n > MAX_PYTHON: continue
+            engines[name] = result = bench_engine(sim, sys_recipe, mode, gravity, ephem_path)
+            print("  {:<13} {:>10.1f} steps/s  p50 {:.3f} ms  p90 {:.3f} ms  p99 {:.3f} ms".format(
+                  name, result['steps_per_sec'], result['p50_ms'], result['p90_ms'], result['p99_ms']))
+        state = bench_get_state(sim, sys_recipe)
+        print("  get_state     p50 {:.3f} ms  p99 {:.3f} ms".format(state['get_state']['p50_ms'], state['get_state']['p99_ms']))
+    finally:
+        sim.shutdown()
+    return {'bodies':n, 'engines':engines, 'state':state}
+
+def commit_id():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=_path.SOLEX,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    out_path = args.pop(0) if args and args[0].endswith(".json") else None
+    sizes = [int(arg) for arg in args] or SIZES
+    commit = commit_id()
+    results = {'commit':commit, 'python':platform.python_version(),
+               'numpy':np.__version__, 'machine':platform.machine(),
+               'hz':_sim.HZ, 'sub_steps':_sim.SUB_STEPS, 'block_steps':_sim.BLOCK_STEPS,
+               'systems':{}}
+    makedirs(BENCH_DIR, exist_ok=True)
+    systems = [("synth_{}".format(n), synth_system(n)) for n in sizes]
+    systems.append(("sol", SC.compile_sys_recipe("{}/sol.shv".format(_path.SYSTEMS))))
+    for label, sys_recipe in systems:
+        results['systems'][label] = bench_system(label, sys_recipe)
+    print("barnes_hut force pass")
+    results['accel'] = {n:bench_accel(n) for n in ACCEL_SIZES}
+    out_path = out_path or "{}/bench_{}.json".format(BENCH_DIR, commit)
+    with open(out_path, "w") as out_file:
+        json.dump(results, out_file, indent=2)
+    print("Results written to '{}'.".format(out_path))
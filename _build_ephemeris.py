@@ -0,0 +1,38 @@
+# ===========================
+# Solex - _build_ephemeris.py
+# ===========================
+
+# Usage: python _build_ephemeris.py <system> [<system> ...] [years]
+# Writes '<system>.eph' to _path.EPHEMERIDES covering sim time 0 to 'years'.
+
+# System imports.
+import sys
+from os import makedirs
+
+# Local imports.
+from etc.settings import _path, _phys
+from etc.util import TimeIt
+from etc.shiva import Shiva_Compiler as SC
+from solex.physics import Sys_Arrays
+from solex.kepler import Kepler_Orbits
+from solex.ephemeris import segment_lengths, build_ephemeris, save_ephemeris
+
+YEAR = 365.25*24*3600 * _phys.TIME_SCALE    # Sim seconds.
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    years = 1.0
+    if args and args[-1].replace(".", "", 1).isdigit():
+        years = float(args.pop())
+    makedirs(_path.EPHEMERIDES, exist_ok=True)
+    for sys_name in args:
+        with TimeIt(sys_name) as tt:
+            sys_path = "{}/{}.shv".format(_path.SYSTEMS, sys_name)
+            arrs = Sys_Arrays(SC.compile_sys_recipe(sys_path))
+            orbits = Kepler_Orbits(arrs)
+            t1 = years * YEAR
+            table, coeffs = build_ephemeris(arrs, orbits.relative, segment_lengths(orbits), 0.0, t1)
+            save_ephemeris("{}/{}.eph".format(_path.EPHEMERIDES, sys_name),
+                           table, coeffs, 0.0, t1, arrs.NAMES)
+            tt.segments = len(coeffs)
+            tt.megabytes = round(coeffs.nbytes/2**20, 2)
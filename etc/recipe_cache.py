@@ -0,0 +1,130 @@
+# =======================
+# Solex - recipe_cache.py
+# =======================
+
+# System imports.
+import os
+import pickle
+import hashlib
+from threading import RLock
+
+# Panda3d imports.
+from panda3d.core import Filename
+
+# Local imports.
+from .settings import _path
+from . import shiva, shiva_parser
+from .shiva import Shiva_Compiler as SC
+
+CACHE_VERSION = 1
+
+
+# Compiled Shiva recipes kept on disk as pickled dicts. An entry is valid
+# while its key, a hash over the contents of the source file, every body
+# file it includes and the compiler itself, is unchanged. Contents are
+# only re-read (and re-hashed) for files whose mtime or size differ from
+# the stat recorded with the entry, so a warm start just stats each file.
+# Bodies are cached in their own right, so a body shared by several
+# systems is compiled once. Safe to share between threads.
+class Recipe_Cache:
+
+    # Public.
+    def sys_recipe(self, sys_path):
+        with self.__lock:
+            return self.__get_Recipe(sys_path, "sys")
+    def body_recipe(self, body_path):
+        with self.__lock:
+            return self.__get_Recipe(body_path, "body")
+    def cached_recipe(self, shv_path, kind="sys"):
+        # The recipe if its entry is still valid, else None (no compiling).
+        with self.__lock:
+            return self.__get_Recipe(shv_path, kind, compile=False)
+    def clear(self):
+        self.__memo = {}
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".pkl"):
+                os.remove(os.path.join(self.cache_dir, file_name))
+
+    # Setup.
+    def __init__(self, cache_dir=_path.RECIPE_CACHE):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.__lock = RLock()
+        self.hits = 0
+        self.misses = 0
+        self.__stats = {}       # os path -> (mtime_ns, size, digest).
+        self.__memo = {}        # os path -> entry, for this process.
+        self.__compiler = [os.path.abspath(shiva.__file__), os.path.abspath(shiva_parser.__file__)]
+
+    def __get_Recipe(self, shv_path, kind, compile=True):
+        os_path = Filename(shv_path).toOsLongName()
+        entry = self.__memo.get(os_path) or self.__load_Entry(os_path, kind)
+        if entry and self.__key(entry['deps']) == entry['key']:
+            self.hits += 1
+        elif not compile:
+            return None
+        else:
+            self.misses += 1
+            entry = self.__compile(shv_path, os_path, kind)
+        self.__memo[os_path] = entry
+        # Each caller gets its own copy of the recipe.
+        return pickle.loads(entry['data'])
+
+    def __compile(self, shv_path, os_path, kind):
+        deps = [os_path] + self.__compiler
+        if kind == "body":
+            recipe = SC.compile_body_recipe(shv_path)
+        else:
+            def load_body(body_path):
+                deps.append(Filename(body_path).toOsLongName())
+                return self.body_recipe(body_path)
+            recipe = SC.compile_sys_recipe(shv_path, load_body)
+        key = self.__key(deps)
+        entry = {'version':CACHE_VERSION, 'path':os_path, 'key':key,
+                 'deps':{dep:self.__stats[dep] for dep in deps},
+                 'data':pickle.dumps(recipe, pickle.HIGHEST_PROTOCOL)}
+        entry_path = self.__entry_Path(os_path, kind)
+        tmp_path = "{}.{}.tmp".format(entry_path, os.getpid())
+        with open(tmp_path, "wb") as entry_file:
+            pickle.dump(entry, entry_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, entry_path)
+        return entry
+
+    def __load_Entry(self, os_path, kind):
+        # A missing, stale format or unreadable entry is just a miss.
+        try:
+            with open(self.__entry_Path(os_path, kind), "rb") as entry_file:
+                entry = pickle.load(entry_file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+            return None
+        if type(entry) != dict or entry.get('version') != CACHE_VERSION or entry.get('path') != os_path:
+            return None
+        return entry
+
+    def __entry_Path(self, os_path, kind):
+        name = hashlib.sha1(os_path.encode("utf-8")).hexdigest()[:20]
+        return os.path.join(self.cache_dir, "{}_{}.pkl".format(kind, name))
+
+    def __key(self, deps):
+        # 'deps' is a list of paths or a dict of path -> recorded stat.
+        key = hashlib.sha1(str(CACHE_VERSION).encode())
+        for dep in sorted(deps):
+            known = deps.get(dep) if type(deps) == dict else None
+            try:
+                digest = self.__digest(dep, known)
+            except OSError:
+                return None
+            key.update(dep.encode("utf-8"))
+            key.update(digest.encode())
+        return key.hexdigest()
+
+    def __digest(self, os_path, known):
+        st = os.stat(os_path)
+        cached = self.__stats.get(os_path) or known
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            self.__stats[os_path] = tuple(cached)
+            return cached[2]
+        with open(os_path, "rb") as dep_file:
+            digest = hashlib.sha1(dep_file.read()).hexdigest()
+        self.__stats[os_path] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
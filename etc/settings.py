@@ -8,6 +8,9 @@ from os import path
 class _sys:
     SCREEN_W = 1920
     SCREEN_H = 1080
+    COMPILE_WORKERS = 0                 # Shiva compile processes (0: one per core).
+    PARALLEL_COMPILE_MIN = 32           # Fewer systems than this are read serially.
+    WATCH_HZ = 4                        # Polls of the live system's Shiva sources per second (0: off).
 
 # File system.
 class _path:
@@ -18,6 +21,9 @@ class _path:
     SYSTEMS = "{}/data/systems".format(SOLEX)
     SHADERS = "{}/gpu/shaders".format(SOLEX)
     PLANET_GEN = "{}/planet_gen/saved".format(SOLEX)
+    CHECKPOINTS = "{}/data/checkpoints".format(SOLEX)
+    EPHEMERIDES = "{}/data/ephemerides".format(SOLEX)
+    RECIPE_CACHE = "{}/data/cache/recipes".format(SOLEX)
 
 # Physical constants.
 class _phys:
@@ -35,7 +41,29 @@ class _env:
 # Simulator.
 class _sim:
     MAX_LOCAL_BODIES = 1000
-    HZ = 600
+    HZ = 120                            # Fixed physics steps per second.
+    SUB_STEPS = 1                       # Integrator sub-steps per physics step.
+    MAX_CATCH_UP = 5                    # Most steps run in one tick after an overrun.
+    GRAVITY = "hierarchical"            # "hierarchical", "pairwise" or "barnes_hut" (numpy mode).
+    BH_THETA = .5                       # Barnes-Hut opening angle.
+    BLOCK_STEPS = False                 # Per body power of two steps (hierarchical gravity).
+    BLOCK_DRIFT = 1e-4                  # Most block step drift of any orbit (km per sim sec).
+    MAX_RUNG = 20                       # Longest block step is 2**MAX_RUNG base steps.
+    RING_SLOTS = 32                     # Published snapshots kept for interpolation.
+    EVENT_SLOTS = 4096                  # Prox and collision events queued for readers.
+    EVENT_HZ = 30                       # Prox and collision checks per sim second.
+    INTERP_DELAY = 1/60                 # Render this far (sim secs) behind the newest snapshot.
+    CHECKPOINT_SECS = 60                # Period of background state checkpoints.
+    FAR_HORIZON = 4800                  # Default prox multiplier for added bodies.
+    DIRTY_DIST = 1.0                    # Movement (km) that marks a body changed.
+    DIRTY_ANGLE = .01                   # Rotation (deg) that marks a body changed.
+    BATCH_SHARDS = 0                    # Server shard processes (0: one per core).
+    EPHEM_DEGREE = 10                   # Chebyshev degree of ephemeris segments.
+    EPHEM_SEGMENTS = 4                  # Ephemeris segments per (circular) orbit.
+                                        # Target: under 1 km (DIRTY_DIST) max error; Sol
+                                        # is 0.46 km at 9.6 MB per sim year.
+    PREDICT_WORKERS = 0                 # Path prediction processes (0: one per core).
+    PREDICT_ORBIT_STEPS = 2000          # Fewest steps per orbit for predicted paths.
 
 # Camera.
 class _cam:
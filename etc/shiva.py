@@ -7,6 +7,7 @@ from panda3d.core import Filename
 
 # Local imports.
 from .settings import _path
+from .shiva_parser import parse, Shiva_Error
 
 
 # ===================
@@ -67,171 +68,129 @@ BODY_COLS = {
     'jovian':(.5,0,0,1),
     'asteroid':(.7,.7,.7,1)
 }
+
+
+# Compiles Shiva source (a path ending in '.shv' or the text itself) into
+# recipe dicts. The source is parsed once into an AST by 'shiva_parser'
+# (values are evaluated there, never with 'eval') and then walked here;
+# errors are 'Shiva_Error's naming the file and line.
 class Shiva_Compiler:
     
     @classmethod
     def compile_body_recipe(cls, shiva_str):
         return cls.__compile_Body_Recipe(shiva_str)
     @classmethod
-    def compile_sys_recipe(cls, shiva_str):
-        return cls.__compile_Sys_Recipe(shiva_str)
+    def compile_sys_recipe(cls, shiva_str, load_body=None):
+        # 'load_body(body_path)' supplies each body's recipe (default:
+        # compile it here).
+        return cls.__compile_Sys_Recipe(shiva_str, load_body or cls.compile_body_recipe)
+    @classmethod
+    def scan_sys_header(cls, shiva_str):
+        # Name, body totals and body names of a system without compiling
+        # its bodies.
+        return cls.__scan_Sys_Header(shiva_str)
+    @classmethod
+    def body_path(cls, body_name):
+        return "{}/{}/{}.shv".format(_path.BODIES, body_name, body_name)
     
 
-    def __compile_Body_Recipe(shiva_str):
+    def __parse(shiva_str):
         if shiva_str.endswith(".shv"):
             with open(Filename(shiva_str).toOsLongName()) as shiva_file:
-                lines = list(shiva_file.readlines())
-        else:
-            lines = shiva_str.split("\n")
+                return parse(shiva_file.read(), shiva_str)
+        return parse(shiva_str)
+
+    def __compile_Body_Recipe(shiva_str):
+        doc = Shiva_Compiler.__parse(shiva_str)
         recipe = {'terrains':[]}
-        current_block = recipe
-        _ignore = False
-        _prev_indent = 0
         
-        for line in lines:
-            strip_line = line.strip()
-            if not strip_line: continue
+        for block in doc.blocks:
+            quals = block.quals
+            if not quals or quals[0] not in BODY_QUALS:
+                raise Shiva_Error(doc.source, block.line, "Unknown body qualifier in '{}'.".format(block.name))
+            if quals[-1] not in BODY_COLS:
+                raise Shiva_Error(doc.source, block.line, "Unknown body class '{}'.".format(quals[-1]))
             
-            # Ignore single line and multi_line comments.
-            if strip_line.startswith("/"):
-                if strip_line.startswith("/*"):
-                    _ignore = True
-                continue
-            if strip_line.endswith("*/"):
-                _ignore = False
-                continue
-            if _ignore:
-                continue
+            # Body definition.
+            recipe['name'] = block.name.lower()
+            recipe['zone'] = quals[0]
+            if len(quals) == 3:
+                recipe['class'] = "{}_{}".format(quals[1], quals[2])
+            else:
+                recipe['class'] = quals[-1]
+            if recipe['class'] not in BODY_TEMPLATES:
+                raise Shiva_Error(doc.source, block.line, "Unknown body class '{}'.".format(recipe['class']))
+            recipe['colour'] = BODY_COLS[quals[-1]]
+            recipe.update(BODY_TEMPLATES[recipe['class']])
             
-            # Handle code blocks.
-            indent = len(line) - len(line.lstrip())
-            tokens = strip_line.split(" ")
-            
-            # End block.
-            if indent < _prev_indent:
-                current_block = recipe
-                if indent == 0:
-                    current_block = None
-                
-            # New block.
-            if tokens[-1].endswith(":"):
-                
-                # Body definition.
-                if tokens[0] in BODY_QUALS:
-                    recipe['name'] = tokens[-1][:-1].lower()
-                    recipe['zone'] = tokens[0]
-                    if len(tokens) == 4:
-                        recipe['class'] = "{}_{}".format(tokens[1], tokens[2])
-                    else:
-                        recipe['class'] = tokens[-2]
-                    recipe['colour'] = BODY_COLS[tokens[-2]]
-                    recipe.update(BODY_TEMPLATES[recipe['class']])
-                    
-                # Terrain definition.
-                elif tokens[0] in TERRAIN_QUALS:
-                    current_block = {'name':tokens[-1][:-1].lower()}
-                    recipe['terrains'].append(current_block)
-                    
             # Body property definitions.
-            elif tokens[0].startswith("$"):
-                if current_block:
-                    property_name = tokens[0][1:]
-                    # Convert shiva expressions to python expresions.
-                    toks = []
-                    for t in tokens[1:]:
-                        # Range expression becomes tuple.
-                        if "->" in t:
-                            t1, t2 = t.split("->")
-                            t = "({}, {})".format(t1, t2)
-                        toks.append(t.strip())
-                    tok_str = " ".join(toks)
-                    current_block[property_name] = eval(tok_str)
-            _prev_indent = indent
+            for prop in block.props:
+                recipe[prop.name] = prop.value
+                
+            # Terrain definitions.
+            for sub_block in block.blocks:
+                if not sub_block.quals or sub_block.quals[0] not in TERRAIN_QUALS:
+                    raise Shiva_Error(doc.source, sub_block.line, "Unknown terrain qualifier in '{}'.".format(sub_block.name))
+                terrain = {'name':sub_block.name.lower()}
+                for prop in sub_block.props:
+                    terrain[prop.name] = prop.value
+                recipe['terrains'].append(terrain)
         return recipe
 
-    def __compile_Sys_Recipe(shiva_str):
-        if shiva_str.endswith(".shv"):
-            with open(Filename(shiva_str).toOsLongName()) as shiva_file:
-                lines = list(shiva_file.readlines())
-        else:
-            lines = shiva_str.split("\n")
-        block_stack = []
-        _ignore = False
-        _prev_indent = 0
+    def __scan_Sys_Header(shiva_str):
+        doc = Shiva_Compiler.__parse(shiva_str)
+        if not doc.blocks:
+            raise Shiva_Error(doc.source, 1, "No system defined.")
+        header = {'name':doc.blocks[0].name.lower(), 'bodies':[],
+                  '_stars':0,'_planets':0,'_moons':0,'_total':0}
+        blocks = [doc.blocks[0]]
+        while blocks:
+            block = blocks.pop()
+            if len(block.quals) != 1 or block.quals[0] not in SYS_QUALS:
+                raise Shiva_Error(doc.source, block.line, "Unknown system qualifier in '{}'.".format(block.name))
+            total_key = "_{}s".format(block.quals[0])
+            header[total_key] = header.get(total_key, 0) + 1
+            header['_total'] += 1
+            if block.quals[0] in ("planet", "moon"):
+                header['bodies'].append(block.name.lower())
+            blocks.extend(block.blocks)
+        return header
+
+    def __compile_Sys_Recipe(shiva_str, load_body):
+        doc = Shiva_Compiler.__parse(shiva_str)
+        if not doc.blocks:
+            raise Shiva_Error(doc.source, 1, "No system defined.")
         _totals = {'_stars':0,'_planets':0,'_moons':0,'_total':0}
         
-        for line in lines:
-            strip_line = line.strip()
-            if not strip_line: continue
-            
-            # Ignore single line and multi_line comments.
-            if strip_line.startswith("/"):
-                if strip_line.startswith("/*"):
-                    _ignore = True
-                continue
-            if strip_line.endswith("*/"):
-                _ignore = False
-                continue
-            if _ignore:
-                continue
+        def compile_block(block):
+            kind = block.quals[0] if len(block.quals) == 1 else None
+            if kind not in SYS_QUALS:
+                raise Shiva_Error(doc.source, block.line, "Unknown system qualifier in '{}'.".format(block.name))
+            new_block = {'name':block.name.lower(),
+                         'body_type':kind,
+                         'sats':[]}
             
-            # Handle code blocks.
-            indent = len(line) - len(line.lstrip())
-            tokens = strip_line.split(" ")
+            # Star.
+            if kind == "star":
+                if block.arg not in STAR_SPECS_DICT:
+                    raise Shiva_Error(doc.source, block.line, "Unknown star class '{}'.".format(block.arg))
+                new_block.update(STAR_SPECS_DICT[block.arg])
+                new_block['type'] = "star"
+                new_block['far_horizon'] = 10000
+            elif kind == "planet" or kind == "moon":
+                new_block.update(load_body(Shiva_Compiler.body_path(new_block['name'])))
+                new_block['type'] = "planet"
+            total_key = "_{}s".format(kind)
+            _totals[total_key] = _totals.get(total_key, 0) + 1
+            _totals['_total'] += 1
             
-            # End block.
-            if indent < _prev_indent:
-                for tabs in range(int((_prev_indent-indent) / 4)):
-                    block_stack.pop(-1)
-                                    
-            # New block.
-            if tokens[-1].endswith(":"):
-                if tokens[0] in SYS_QUALS:
-                    new_block = {'name':tokens[-1][:-1].lower(),
-                                 'body_type':tokens[0],
-                                 'sats':[]}
-                    
-                    # Update the tip's 'sats' with this body and then
-                    # append it to the stack (making it the tip).
-                    if block_stack:
-                        block_stack[-1]['sats'].append(new_block)
-                    block_stack.append(new_block)
-                    
-                    # Star.
-                    if tokens[0] == "star":
-                        star_name, cls_str = tokens[1].split("(")
-                        star_cls = cls_str.replace("):", "")
-                        new_block.update(STAR_SPECS_DICT[star_cls])
-                        new_block['name'] = star_name.lower()
-                        new_block['type'] = "star"
-                        new_block['far_horizon'] = 10000
-                    elif tokens[0] == "planet" or tokens[0] == "moon":
-                        body_name = tokens[1].split("(")[0].replace(":", "")
-                        body_path = "{}/{}/{}.shv".format(_path.BODIES, body_name, body_name)
-                        body_recipe = Shiva_Compiler.compile_body_recipe(body_path)
-                        new_block.update(body_recipe)
-                        new_block['type'] = "planet"
-                    _totals["_"+tokens[0]+"s"] +=1
-                    _totals['_total'] += 1
-            
-            # Body sys property definitions.
-            elif tokens[0].startswith("$"):
-                property_name = tokens[0][1:]
-                # Convert shiva expressions to python expresions.
-                toks = []
-                for t in tokens[1:]:
-                    # Range expression becomes tuple.
-                    if "->" in t:
-                        t1, t2 = t.split("->")
-                        t = "({}, {})".format(t1, t2)
-                    toks.append(t.strip())
-                tok_str = " ".join(toks)
-                block_stack[-1][property_name] = eval(tok_str)
-            _prev_indent = indent
+            # Body sys property definitions, then satellites.
+            for prop in block.props:
+                new_block[prop.name] = prop.value
+            for sub_block in block.blocks:
+                new_block['sats'].append(compile_block(sub_block))
+            return new_block
         
-        recipe = block_stack[0]
+        recipe = compile_block(doc.blocks[0])
         recipe.update(_totals)
         return recipe
-
-
-
@@ -0,0 +1,154 @@
+# ======================
+# Solex - shiva_batch.py
+# ======================
+
+# System imports.
+from os import cpu_count
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Local imports.
+from .settings import _sys
+from .shiva import Shiva_Compiler as SC
+from .recipe_cache import Recipe_Cache
+
+
+# Worker side: one 'Recipe_Cache' per process over the shared cache dir,
+# so bodies compiled by any worker are loaded (not recompiled) by the
+# others when they compile the systems that include them.
+_worker_cache = None
+
+def _cache(cache_dir):
+    global _worker_cache
+    if _worker_cache is None or _worker_cache.cache_dir != cache_dir:
+        _worker_cache = Recipe_Cache(cache_dir)
+    return _worker_cache
+
+# Jobs take a chunk of paths each and return (path, result, error) per
+# path, so many small files cost one round trip.
+CHUNK = 16
+
+def _run(fn, paths):
+    results = []
+    for path in paths:
+        try:
+            results.append((path, fn(path), None))
+        except Exception as error:
+            results.append((path, None, error))
+    return results
+
+def _scan_job(sys_paths):
+    return _run(SC.scan_sys_header, sys_paths)
+
+def _body_job(cache_dir, body_paths):
+    # Bodies land in the cache; only errors come back.
+    results = _run(_cache(cache_dir).body_recipe, body_paths)
+    return [(path, None, error) for path, recipe, error in results]
+
+def _sys_job(cache_dir, sys_paths):
+    return _run(_cache(cache_dir).sys_recipe, sys_paths)
+
+def _chunks(paths):
+    paths = list(paths)
+    return [paths[i:i+CHUNK] for i in range(0, len(paths), CHUNK)]
+
+
+# Compiles large catalogs of systems in a process pool and streams the
+# results back as they finish. Systems still valid in the recipe cache
+# come back first without touching the pool. The rest are scanned for
+# their bodies; every distinct body is compiled once however many systems
+# share it, and each system is compiled as soon as its last body is ready.
+class Batch_Compiler:
+
+    # Public.
+    def headers(self, sys_paths):
+        # Yields (sys_path, header, error) as each system is scanned.
+        return self.__headers(list(sys_paths))
+    def recipes(self, sys_paths):
+        # Yields (sys_path, recipe, error) as each system is compiled.
+        return self.__recipes(list(sys_paths))
+    def shutdown(self):
+        if self.__pool:
+            self.__pool.shutdown(cancel_futures=True)
+            self.__pool = None
+
+    # Setup.
+    def __init__(self, cache=None, workers=_sys.COMPILE_WORKERS):
+        self.cache = cache or Recipe_Cache()
+        self.workers = workers or cpu_count() or 1
+        self.__pool = None
+
+    def __get_Pool(self):
+        if self.__pool is None:
+            self.__pool = ProcessPoolExecutor(self.workers)
+        return self.__pool
+
+    def __headers(self, sys_paths):
+        pool = self.__get_Pool()
+        jobs = {pool.submit(_scan_job, chunk) for chunk in _chunks(sys_paths)}
+        while jobs:
+            done, jobs = wait(jobs, return_when=FIRST_COMPLETED)
+            for job in done:
+                yield from job.result()
+
+    def __recipes(self, sys_paths):
+        cache_dir = self.cache.cache_dir
+        todo = []
+        for sys_path in sys_paths:
+            recipe = self.cache.cached_recipe(sys_path)
+            if recipe is None:
+                todo.append(sys_path)
+            else:
+                yield sys_path, recipe, None
+        if not todo: return
+        pool = self.__get_Pool()
+
+        # Every outstanding future maps to its kind: "scan", "body" or "sys".
+        jobs = {pool.submit(_scan_job, chunk):"scan" for chunk in _chunks(todo)}
+        waiting = {}            # sys path -> body paths not ready yet.
+        users = {}              # body path -> sys paths waiting on it.
+        ready = set()
+        while jobs:
+            done, not_done = wait(jobs, return_when=FIRST_COMPLETED)
+            new_bodies = []
+            ready_sys = []
+            for job in done:
+                kind = jobs.pop(job)
+                for path, result, error in job.result():
+
+                    if kind == "sys":
+                        yield path, result, error
+
+                    elif kind == "scan":
+                        if error:
+                            yield path, None, error
+                            continue
+                        body_paths = {SC.body_path(name) for name in result['bodies']} - ready
+                        waiting[path] = body_paths
+                        for body_path in body_paths:
+                            if body_path not in users:
+                                users[body_path] = []
+                                new_bodies.append(body_path)
+                            users[body_path].append(path)
+                        if not body_paths:
+                            ready_sys.append(path)
+
+                    else:
+                        for sys_path in users.pop(path):
+                            if sys_path not in waiting: continue
+                            if error:
+                                # The system can't compile without this body.
+                                waiting.pop(sys_path)
+                                yield sys_path, None, error
+                                continue
+                            waiting[sys_path].discard(path)
+                            if not waiting[sys_path]:
+                                ready_sys.append(sys_path)
+                        if not error:
+                            ready.add(path)
+
+            for chunk in _chunks(new_bodies):
+                jobs[pool.submit(_body_job, cache_dir, chunk)] = "body"
+            for sys_path in ready_sys:
+                waiting.pop(sys_path)
+            for chunk in _chunks(ready_sys):
+                jobs[pool.submit(_sys_job, cache_dir, chunk)] = "sys"
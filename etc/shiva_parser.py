@@ -0,0 +1,303 @@
+# =======================
+# Solex - shiva_parser.py
+# =======================
+
+# System imports.
+import re
+
+
+# Shiva source is read line by line. Comments are '//' to the end of the
+# line and '/* ... */', which may span lines. The common '$name literal'
+# line is split with string methods; anything else (headers, expressions)
+# goes through the token regex.
+_TOKEN_RE = re.compile(r"""
+    [ \t\r]*(?:
+      (?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<prop>\$[A-Za-z_]\w*)
+    | (?P<name>[A-Za-z_]\w*)
+    | (?P<str>"[^"\n]*"|'[^'\n]*')
+    | (?P<op>->|\*\*|[-+*/(),\[\]:])
+    | (?P<bad>\S)
+    )""", re.VERBOSE)
+_LINE_RE = re.compile(r"""
+    ([ \t]*)(?:
+      (\$[A-Za-z_]\w*)[ \t]+(?:
+        ((?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)(?:\*10\*\*(-?\d{1,3}))?
+      | ("[^"\n]*"|'[^'\n]*'))
+      [ \t\r]*(?://.*)?$
+    | ([A-Za-z_]\w*(?:[ \t]+[A-Za-z_]\w*)*)(?:\(([A-Za-z_]\w*)\))?:[ \t\r]*(?://.*)?$
+    | (.*))""", re.VERBOSE)
+_BCOMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+_CONSTS = {'True':True, 'False':False, 'None':None}
+MAX_EXPONENT = 4096         # Guards uploads against '10**10**10'.
+MAX_INT_BITS = 1 << 15      # And against '(10**4096)**4096': the largest int result.
+TAB_WIDTH = 4
+
+
+class Shiva_Error(ValueError):
+    def __init__(self, source, line, msg):
+        self.source = source
+        self.line = line
+        self.msg = msg
+        super().__init__("{} line {}: {}".format(source, line, msg))
+    def __reduce__(self):
+        return (Shiva_Error, (self.source, self.line, self.msg))
+
+
+# AST. Property values are folded to Python constants while parsing, so a
+# 'Prop' holds the finished value (number, str, tuple or list).
+class Prop:
+    __slots__ = ("name", "value", "line")
+    def __init__(self, name, value, line):
+        self.name = name
+        self.value = value
+        self.line = line
+    def __repr__(self):
+        return "Prop({!r}, {!r})".format(self.name, self.value)
+
+class Block:
+    # 'quals' are the words before the name ("cold sub jovian Saturn:")
+    # and 'arg' is an optional class in brackets ("star Sol(G2V):").
+    __slots__ = ("quals", "name", "arg", "props", "blocks", "line")
+    def __init__(self, quals, name, arg, line):
+        self.quals = quals
+        self.name = name
+        self.arg = arg
+        self.props = []
+        self.blocks = []
+        self.line = line
+    def __repr__(self):
+        return "Block({!r}, {!r}, {!r})".format(self.quals, self.name, self.arg)
+
+class Document:
+    __slots__ = ("source", "props", "blocks")
+    def __init__(self, source):
+        self.source = source
+        self.props = []
+        self.blocks = []
+
+
+def _tokens(text, line, source):
+    toks = []
+    for m in _TOKEN_RE.finditer(text):
+        kind = m.lastgroup
+        if kind == "bad":
+            raise Shiva_Error(source, line, "Unexpected character {!r}.".format(m.group(kind)))
+        toks.append((kind, m.group(kind), line))
+    return toks
+
+def _strip_Comment(text):
+    # Cut a '//' comment that isn't inside a string.
+    i = text.find("//")
+    while i >= 0:
+        if (text.count('"', 0, i) % 2 == 0) and (text.count("'", 0, i) % 2 == 0):
+            return text[:i]
+        i = text.find("//", i+2)
+    return text
+
+def tokenize(text, source="<string>"):
+    # Logical lines of (indent, line number, [(kind, value, line), ...]).
+    # Token kinds are num, str, name, prop and op, plus lit (a finished
+    # value) and header (quals, name, arg) from the common line forms.
+    if "/*" in text:
+        # Block comments become blank lines so line numbers still hold.
+        text = _BCOMMENT_RE.sub(lambda m: "\n"*m.group().count("\n"), text)
+        if "/*" in text:
+            line = text.count("\n", 0, text.index("/*")) + 1
+            raise Shiva_Error(source, line, "Unterminated '/*' comment.")
+    lines = []
+    for line, raw in enumerate(text.split("\n"), 1):
+        lead, prop, num, exp, string, words, arg, rest = _LINE_RE.match(raw).groups()
+        indent = len(lead.expandtabs(TAB_WIDTH)) if "\t" in lead else len(lead)
+        if prop:
+            # '$name literal' and '$name m*10**e': the value is read here.
+            if num:
+                value = int(num) if num.isdigit() else float(num)
+                if exp:
+                    value = value * 10**int(exp)
+            else:
+                value = string[1:-1]
+            lines.append((indent, line, [("prop", prop, line), ("lit", value, line)]))
+            continue
+        if words:
+            words = words.split()
+            lines.append((indent, line, [("header", (tuple(words[:-1]), words[-1], arg), line)]))
+            continue
+        if "/" in rest:
+            rest = _strip_Comment(rest)
+        rest = rest.strip()
+        if rest:
+            lines.append((indent, line, _tokens(rest, line, source)))
+    return lines
+
+
+# Binary operator precedence; '**' is right associative and binds tighter
+# than a unary sign on its left, as in Python ('-2**2' is -4).
+_BINARY = {'+':1, '-':1, '*':2, '/':2, '**':4}
+_UNARY = 3
+
+
+class _Value_Parser:
+    # One property's tokens to a value:
+    #   value  := range (',' range)* [',']          -> tuple if any commas
+    #   range  := expr ['->' expr]                  -> (lo, hi)
+    #   expr   := arithmetic on atoms, by precedence climbing
+    #   atom   := num | str | True | False | None | '(' [value] ')' | '[' [value] ']'
+
+    def __init__(self, toks, source, line):
+        self.toks = toks + [("end", None, line)]
+        self.end = len(toks)
+        self.pos = 0
+        self.source = source
+
+    def error(self, msg):
+        raise Shiva_Error(self.source, self.toks[self.pos][2], msg)
+
+    def parse(self):
+        if not self.end:
+            self.error("Missing property value.")
+        items, comma = self.items(())
+        if self.pos < self.end:
+            self.error("Unexpected {!r}.".format(self.toks[self.pos][1]))
+        return tuple(items) if comma else items[0]
+
+    def items(self, closers):
+        # Comma separated ranges, and whether there was a comma.
+        toks = self.toks
+        items = [self.range()]
+        comma = False
+        while toks[self.pos][1] == ",":
+            self.pos += 1
+            comma = True
+            if self.pos == self.end or toks[self.pos][1] in closers: break
+            items.append(self.range())
+        return items, comma
+
+    def range(self):
+        lo = self.expr(0)
+        if self.toks[self.pos][1] == "->":
+            self.pos += 1
+            return (lo, self.expr(0))
+        return lo
+
+    def expr(self, min_prec):
+        toks = self.toks
+        op = toks[self.pos][1]
+        if op == "-" or op == "+":
+            self.pos += 1
+            val = self.number(self.expr(_UNARY))
+            if op == "-": val = -val
+        else:
+            val = self.atom()
+        while True:
+            op = toks[self.pos][1]
+            prec = _BINARY.get(op)
+            if prec is None or prec < min_prec: return val
+            self.pos += 1
+            rhs = self.number(self.expr(_UNARY if op == "**" else prec+1))
+            val = self.binary(op, self.number(val), rhs)
+
+    def binary(self, op, lhs, rhs):
+        if op == "*":
+            if type(lhs) == int and type(rhs) == int:
+                self.int_size(lhs.bit_length() + rhs.bit_length())
+            return lhs * rhs
+        if op == "+": return lhs + rhs
+        if op == "-": return lhs - rhs
+        if op == "/":
+            if rhs == 0:
+                self.error("Division by zero.")
+            return lhs / rhs
+        if abs(rhs) > MAX_EXPONENT:
+            self.error("Exponent {} is too large.".format(rhs))
+        if lhs == 0 and rhs < 0:
+            self.error("Division by zero.")
+        if type(lhs) == int and type(rhs) == int and rhs > 0:
+            # Sized before computing, as big int powers are slow.
+            self.int_size((lhs.bit_length()-1) * rhs)
+        try:
+            val = lhs ** rhs
+        except OverflowError:
+            self.error("{} ** {} is out of range.".format(lhs, rhs))
+        if type(val) == complex:
+            self.error("{} ** {} is not a real number.".format(lhs, rhs))
+        return val
+
+    def int_size(self, bits):
+        if bits > MAX_INT_BITS:
+            self.error("Integer result of about {} bits is too large.".format(bits))
+
+    def atom(self):
+        if self.pos == self.end:
+            self.error("Unexpected end of value.")
+        kind, val, line = self.toks[self.pos]
+        self.pos += 1
+        if kind == "num":
+            return _number(val)
+        if kind == "str":
+            return val[1:-1]
+        if kind == "name" and val in _CONSTS:
+            return _CONSTS[val]
+        if val == "(" or val == "[":
+            closer = ")" if val == "(" else "]"
+            if self.toks[self.pos][1] == closer:
+                self.pos += 1
+                return () if val == "(" else []
+            items, comma = self.items((closer,))
+            if self.toks[self.pos][1] != closer:
+                self.error("Expected {!r}.".format(closer))
+            self.pos += 1
+            if val == "[":
+                return items
+            return tuple(items) if comma else items[0]
+        self.pos -= 1
+        self.error("Unexpected {!r}.".format(val))
+
+    def number(self, val):
+        if type(val) not in (int, float):
+            self.error("Expected a number, not {!r}.".format(val))
+        return val
+
+
+def _number(val):
+    return int(val) if val.isdigit() else float(val)
+
+def parse(text, source="<string>"):
+    # Shiva text -> 'Document'. Blocks nest by indentation; a property
+    # belongs to the innermost block it is indented under.
+    doc = Document(source)
+    stack = [(-1, doc)]
+    for indent, line, toks in tokenize(text, source):
+        while indent <= stack[-1][0]:
+            stack.pop()
+        parent = stack[-1][1]
+        kind, val = toks[0][0], toks[0][1]
+
+        # Property.
+        if kind == "prop":
+            if len(toks) == 2 and toks[1][0] == "lit":
+                value = toks[1][1]
+            else:
+                value = _Value_Parser(toks[1:], source, line).parse()
+            parent.props.append(Prop(val[1:], value, line))
+
+        # Block header: qualifiers, name, optional '(arg)' and ':'.
+        elif kind == "header":
+            block = Block(val[0], val[1], val[2], line)
+            parent.blocks.append(block)
+            stack.append((indent, block))
+        elif toks[-1][1] == ":":
+            words = toks[:-1]
+            arg = None
+            if len(words) >= 4 and words[-1][1] == ")" and words[-3][1] == "(":
+                arg = words[-2][1]
+                words = words[:-3]
+            if not words or any(w[0] != "name" for w in words):
+                raise Shiva_Error(source, line, "Malformed block header.")
+            block = Block(tuple(w[1] for w in words[:-1]), words[-1][1], arg, line)
+            parent.blocks.append(block)
+            stack.append((indent, block))
+        else:
+            raise Shiva_Error(source, line, "Expected a '$property' or a block header, not {!r}.".format(val))
+    return doc
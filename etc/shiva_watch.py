@@ -0,0 +1,190 @@
+# ======================
+# Solex - shiva_watch.py
+# ======================
+
+# System imports.
+import os
+
+# Panda3d imports.
+from panda3d.core import Filename
+
+# Local imports.
+from .shiva import Shiva_Compiler as SC
+from .recipe_cache import Recipe_Cache
+
+
+class Recipe_Change:
+    # 'kind' is "sys" or "body"; 'files' are the os paths that changed.
+    # 'recipe' is None when the new source failed, with 'error' set.
+    __slots__ = ("kind", "name", "path", "recipe", "files", "error")
+    def __init__(self, kind, name, path, recipe, files, error=None):
+        self.kind = kind
+        self.name = name
+        self.path = path
+        self.recipe = recipe
+        self.files = files
+        self.error = error
+    def __repr__(self):
+        return "Recipe_Change({!r}, {!r}, {} files)".format(self.kind, self.name, len(self.files))
+
+
+# Watches the Shiva sources behind a set of systems for edits by polling
+# a stat cache: each 'poll' stats just the files in the dependency graph
+# (system -> its bodies -> each body's maps dir and map files) and only
+# compares mtime and size. Changed bodies and the systems that include
+# them are recompiled through the recipe cache, which reuses everything
+# else. A map edit leaves the recipe as it is but still reports the body,
+# so its textures can be reloaded.
+class Recipe_Watcher:
+
+    # Public.
+    def watch_system(self, sys_path):
+        self.__watch_System(sys_path)
+    def unwatch_system(self, sys_path):
+        self.__unwatch_System(sys_path)
+    def unwatch_all(self):
+        for sys_path in list(self.__systems):
+            self.__unwatch_System(sys_path)
+    def poll(self):
+        # A list of 'Recipe_Change', bodies first; each listener is also
+        # called with every change.
+        changes = self.__poll()
+        for change in changes:
+            for listener in self.__listeners:
+                listener(change)
+        return changes
+    def listen(self, listener):
+        self.__listeners.append(listener)
+
+    # Setup.
+    def __init__(self, cache=None):
+        self.cache = cache or Recipe_Cache()
+        self.__stats = {}       # os path -> (mtime_ns, size) or None if missing.
+        self.__systems = {}     # sys path -> body paths it includes.
+        self.__users = {}       # body path -> sys paths including it.
+        self.__maps = {}        # body path -> map file os paths.
+        self.__listeners = []
+
+    def __stat(self, os_path):
+        try:
+            st = os.stat(os_path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def __changed(self, os_path):
+        # Records the file's stat; True if it differs from the last one.
+        stat = self.__stat(os_path)
+        if self.__stats.get(os_path, stat) == stat:
+            self.__stats[os_path] = stat
+            return False
+        self.__stats[os_path] = stat
+        return True
+
+    def __watch_System(self, sys_path):
+        if sys_path in self.__systems: return
+        self.__changed(Filename(sys_path).toOsLongName())
+        self.__systems[sys_path] = set()
+        self.__link_Bodies(sys_path)
+
+    def __unwatch_System(self, sys_path):
+        for body_path in self.__systems.pop(sys_path, ()):
+            self.__unlink_Body(sys_path, body_path)
+        self.__stats.pop(Filename(sys_path).toOsLongName(), None)
+
+    def __link_Bodies(self, sys_path):
+        # Re-reads the system's body list; a bad header keeps the old one.
+        try:
+            header = SC.scan_sys_header(sys_path)
+        except (ValueError, OSError):
+            return
+        body_paths = {SC.body_path(name) for name in header['bodies']}
+        old_paths = self.__systems[sys_path]
+        for body_path in old_paths - body_paths:
+            self.__unlink_Body(sys_path, body_path)
+        for body_path in body_paths - old_paths:
+            if body_path not in self.__users:
+                self.__users[body_path] = set()
+                self.__changed(Filename(body_path).toOsLongName())
+                self.__maps[body_path] = self.__list_Maps(body_path)
+            self.__users[body_path].add(sys_path)
+        self.__systems[sys_path] = body_paths
+
+    def __unlink_Body(self, sys_path, body_path):
+        users = self.__users.get(body_path)
+        if users is None: return
+        users.discard(sys_path)
+        if users: return
+        self.__users.pop(body_path)
+        self.__stats.pop(Filename(body_path).toOsLongName(), None)
+        self.__stats.pop(self.__maps_Dir(body_path), None)
+        for map_path in self.__maps.pop(body_path):
+            self.__stats.pop(map_path, None)
+
+    def __maps_Dir(self, body_path):
+        return os.path.join(os.path.dirname(Filename(body_path).toOsLongName()), "maps")
+
+    def __list_Maps(self, body_path):
+        # Stats the maps dir and its files; a missing dir is just empty.
+        maps_dir = self.__maps_Dir(body_path)
+        self.__changed(maps_dir)
+        try:
+            map_paths = {os.path.join(maps_dir, name) for name in os.listdir(maps_dir)}
+        except OSError:
+            map_paths = set()
+        for map_path in map_paths:
+            self.__changed(map_path)
+        return map_paths
+
+    def __poll_Maps(self, body_path):
+        # Changed map files; an added or removed file changes the dir's
+        # mtime, so the listing is only re-read then.
+        map_paths = self.__maps[body_path]
+        changed = []
+        if self.__changed(self.__maps_Dir(body_path)):
+            old_paths = map_paths
+            map_paths = self.__list_Maps(body_path)
+            changed.extend(sorted(old_paths ^ map_paths))
+            for map_path in old_paths - map_paths:
+                self.__stats.pop(map_path, None)
+            self.__maps[body_path] = map_paths
+        for map_path in map_paths:
+            if map_path not in changed and self.__changed(map_path):
+                changed.append(map_path)
+        return changed
+
+    def __poll(self):
+        changed_sys = {}        # sys path -> changed files.
+        for sys_path in list(self.__systems):
+            os_path = Filename(sys_path).toOsLongName()
+            if self.__changed(os_path):
+                changed_sys[sys_path] = [os_path]
+                self.__link_Bodies(sys_path)
+
+        changes = []
+        for body_path in list(self.__users):
+            os_path = Filename(body_path).toOsLongName()
+            shv_changed = self.__changed(os_path)
+            files = ([os_path] if shv_changed else []) + self.__poll_Maps(body_path)
+            if not files: continue
+            name = os.path.basename(os.path.dirname(os_path))
+            changes.append(self.__compile("body", name, body_path, files))
+            if shv_changed:
+                # A map edit doesn't change the system's recipe.
+                for sys_path in self.__users[body_path]:
+                    changed_sys.setdefault(sys_path, []).append(os_path)
+
+        for sys_path, files in changed_sys.items():
+            name = os.path.splitext(os.path.basename(sys_path))[0]
+            changes.append(self.__compile("sys", name, sys_path, files))
+        return changes
+
+    def __compile(self, kind, name, shv_path, files):
+        try:
+            if kind == "body":
+                recipe = self.cache.body_recipe(shv_path)
+            else:
+                recipe = self.cache.sys_recipe(shv_path)
+        except (ValueError, OSError) as error:
+            return Recipe_Change(kind, name, shv_path, None, files, error)
+        return Recipe_Change(kind, name, shv_path, recipe, files)
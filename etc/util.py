@@ -36,28 +36,142 @@ class TimeIt:
                 if attr.startswith("_"): continue
                 print("  {}:  {}".format(attr, self.__dict__[attr]))
 
-# Loop throttle.
-class Throttle:
+# Tick scheduler with absolute deadlines. Each deadline is the previous one
+# plus the period, so sleep overshoot never accumulates as drift. After an
+# overrun the late tick starts at once; policy "catch_up" then also runs the
+# ticks whose slots were missed back to back (at most 'max_catch_up' before
+# resyncing) while policy "drop" skips them. Only a tick that starts in
+# time and ends past its deadline counts as an overrun; catch up ticks
+# don't. Waits are plain sleeps, with 'spin' secs of busy waiting before
+# each deadline opt in for tighter ticks at the cost of a core. Use it as
+# a context manager around a blocking loop's body, or call 'due()' from a
+# frame driven task to learn how many ticks to run without blocking.
+class Tick_Scheduler:
     
-    def __init__(self, hz):
+    # Histogram bin upper edges, as fractions of the tick period.
+    HIST_EDGES = (.25, .5, .75, 1.0, 1.5, 2.0, 4.0, float("inf"))
+    
+    # Public.
+    def due(self):
+        now = self.clock.getRealTime()
+        if self.__next is None:
+            self.__start(now)
+            self.ticks += 1
+            return 1
+        if now < self.__next:
+            return 0
+        late = int((now-self.__next) / self.period)
+        self.__next += (late+1) * self.period
+        count = 1
+        if late:
+            self.overruns += 1
+            if self.policy == "catch_up":
+                count = min(late+1, self.max_catch_up)
+            self.dropped += late+1 - count
+        self.ticks += count
+        return count
+    def stats(self):
+        elapsed = self.clock.getRealTime() - self.__start_dt if self.__start_dt is not None else 0
+        return {'hz':self.hz,
+                'achieved_hz':self.ticks/elapsed if elapsed > 0 else 0.0,
+                'ticks':self.ticks,
+                'overruns':self.overruns,
+                'dropped':self.dropped,
+                'histogram':list(zip(self.HIST_EDGES, self.histogram))}
+    def reset_stats(self):
+        self.ticks = self.overruns = self.dropped = 0
+        self.histogram = [0]*len(self.HIST_EDGES)
+        self.__start_dt = None if self.__next is None else self.clock.getRealTime()
+    
+    # Setup.
+    def __init__(self, hz, policy="drop", max_catch_up=5, spin=0.0):
         if hz < 1: hz = 1.0
+        if policy not in ("drop", "catch_up"):
+            raise ValueError("Unknown tick policy '{}'.".format(policy))
         self.clock = ClockObject()
-        self.max_dur = 1.0/float(hz)
+        self.hz = hz
+        self.period = 1.0/float(hz)
+        self.policy = policy
+        self.max_catch_up = max_catch_up
+        self.spin = spin
+        self.__next = None
+        self.__behind = 0
+        self.reset_stats()
     
     def __enter__(self):
         self.start_dt = self.clock.getRealTime()
+        if self.__next is None:
+            self.__start(self.start_dt)
         return self
 
     def __exit__(self, *e_info):
-        e_dt = self.clock.getRealTime()
-        dur = e_dt-self.start_dt
-        pause = self.max_dur-dur
-        while pause > 0.0:
+        now = self.clock.getRealTime()
+        self.__record(now-self.start_dt)
+        nxt = self.__next
+        if now < nxt:
+            self.__wait(nxt)
+            self.__next = nxt + self.period
+            self.__behind = 0
+            return
+        
+        # Overrun: the next tick starts now.
+        if self.start_dt < nxt:
+            self.overruns += 1
+        late = int((now-nxt) / self.period)
+        if self.policy == "catch_up" and self.__behind+late < self.max_catch_up:
+            self.__behind += 1
+            self.__next = nxt + self.period
+        elif self.policy == "catch_up":
+            self.dropped += late
+            self.__behind = 0
+            self.__next = now + self.period
+        else:
+            self.dropped += late
+            self.__next = nxt + (late+1)*self.period
+    
+    def __start(self, now):
+        self.__next = now + self.period
+        if self.__start_dt is None:
+            self.__start_dt = now
+    
+    def __record(self, dur):
+        self.ticks += 1
+        frac = dur / self.period
+        for i, edge in enumerate(self.HIST_EDGES):
+            if frac <= edge:
+                self.histogram[i] += 1
+                break
+    
+    def __wait(self, until):
+        # Sleep (again if woken early) to the deadline, less any spin.
+        clock = self.clock
+        pause = until - clock.getRealTime() - self.spin
+        while pause > 0:
             sleep(pause)
-            dt = self.clock.getRealTime()
-            pause -= dt-e_dt
-            e_dt = dt
-            
+            pause = until - clock.getRealTime() - self.spin
+        while clock.getRealTime() < until:
+            pass
+
+# Stand in for 'Tick_Scheduler' that never waits: ticks run back to back
+# and each one's duration is kept, for timing a loop flat out.
+class Tick_Timer:
+
+    # Public.
+    def stats(self):
+        return {'ticks':len(self.TIMES), 'tick_times':self.TIMES}
+
+    # Setup.
+    def __init__(self):
+        self.clock = ClockObject()
+        self.TIMES = []
+
+    def __enter__(self):
+        self.start_dt = self.clock.getRealTime()
+        return self
+
+    def __exit__(self, *e_info):
+        self.TIMES.append(self.clock.getRealTime()-self.start_dt)
+
 class Geom_Builder:
     
     field_types = {
@@ -64,7 +64,7 @@ class Menu_Table(gui.Button):
         for i, row_list in enumerate(self.row_list):
             attrs = {'place':       {'anchor':"n",'top':i*self.row_height},
                      'children':    row_list,
-                     '_sys_recipe': self.CTRL.client.sys_recipes[self.row_list[i][0].lower()]}
+                     '_sys_header': self.CTRL.client.sys_index.get(str(self.row_list[i][0]).lower())}
             row = self.__class__.Table_Row(self, **attrs)
             self.Children.append(row)
         self.Window.mouse_event_widgets.extend(self.Children)
@@ -79,6 +79,9 @@ class Menu_Table(gui.Button):
         def _on_mouse1_up(self, ue):
             if self._is_pressed:
                 self.Master.Master._row_clk(self)
+        def _on_mouse_in(self, ue):
+            gui.Button._on_mouse_in(self, ue)
+            self.Master.Master._row_over(self)
     
         # Setup.
         def __children__(self):
@@ -136,6 +139,8 @@ class _Menu_(gui.Dialog):
     # Events.
     def _row_clk(self, row):
         pass
+    def _row_over(self, row):
+        pass
         
     # Children.
     class Header_Button(gui.Button):
@@ -176,20 +181,29 @@ class Local_Menu(_Menu_):
     
     # Public.
     def open(self):
-        self._sys_list = []
-        for sys_name, sr in self.CTRL.client.sys_recipes.items():
-            sys_row = [sys_name, sr['_stars'], sr['_planets'], sr['_moons'], sr['_total']]
-            self._sys_list.append(sys_row)
-        self.refresh(self._sys_list)
+        self.__fill_Table()
         _Menu_.open(self)
     def close(self):
         _Menu_.close(self)
         self.Table.destroy()
+    def reload(self):
+        # Rebuild the rows in place (e.g. as the system index fills in).
+        self.Table.destroy()
+        self.__fill_Table()
         
     # Events.
     def _row_clk(self, row):
         sys_name = row.Children[0].text
         self.CTRL.to_pre_view(sys_name)
+    def _row_over(self, row):
+        self.CTRL.client.prefetch_sys_recipe(row.Children[0].text)
+        
+    def __fill_Table(self):
+        self._sys_list = []
+        for sys_name, sr in self.CTRL.client.sys_index.items():
+            sys_row = [sys_name, sr['_stars'], sr['_planets'], sr['_moons'], sr['_total']]
+            self._sys_list.append(sys_row)
+        self.refresh(self._sys_list)
         
 class Net_Menu(_Menu_):
     name = "Net"
@@ -6,19 +6,26 @@
 from sys import exit
 from glob import glob
 from os import path as os_path
+from threading import Thread
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
 
 # Panda3d.
 from direct.showbase.ShowBase import ShowBase
-from panda3d.core import ClockObject, Filename
+from panda3d.core import ClockObject, Filename, TexturePool
 
 # Local.
-from etc.settings import _path, _sim, _net
+from etc.settings import _path, _sim, _net, _sys
 from etc.shiva import Shiva_Compiler as SC
-from etc.util import Throttle
+from etc.recipe_cache import Recipe_Cache
+from etc.shiva_batch import Batch_Compiler
+from etc.shiva_watch import Recipe_Watcher
+from etc.util import Tick_Scheduler
 from gui.ueh import Default_UEH
 from solex.environments import *
 from solex.bodies import *
 from solex.simulator import Simulator
+from solex.physics import SIM_KEYS
 
 
 class Client(ShowBase):
@@ -27,22 +34,34 @@ class Client(ShowBase):
     def init_system(self, sys_name):
         if self.SYS and self.SYS.name == sys_name: return
         self.SIM.stop()
-        sys_recipe = self.sys_recipes[sys_name]
+        sys_recipe = self.get_sys_recipe(sys_name)
         self.SIM.init_system(sys_recipe)
+        self.state_version = 0
         self.SYS = self.__init_Sys(sys_recipe)
         self.PRE_VIEW.on_sys_init(self.SYS)
         self.ENV.on_sys_init(self.SYS)
         self.SIM.start()
+        self.WATCHER.unwatch_all()
+        self.WATCHER.watch_system(self.sys_index[sys_name]['path'])
+    def reload_system(self):
+        self.__reload_System()
     def switch_display(self, display):
         self.__switch_Display(display)
     def refresh_servers(self):
         self.servers = self.__refresh_Servers()
     def refresh_sys_recipes(self):
-        self.sys_recipes = self.__refresh_Sys_Recipes()
+        self.sys_index = self.__refresh_Sys_Index()
+        self.sys_recipes = {}
+    def get_sys_recipe(self, sys_name):
+        return self.__get_Sys_Recipe(sys_name)
+    def prefetch_sys_recipe(self, sys_name):
+        self.__prefetch_Sys_Recipe(sys_name)
         
     # Protected.
     def _exit(self):
-        self.SIM.stop()
+        self.__recipe_pool.shutdown(cancel_futures=True)
+        self.BATCH.shutdown()
+        self.SIM.shutdown()
         exit()
     
     # Setup.
@@ -60,8 +79,14 @@ class Client(ShowBase):
         self.DISPLAY = self.LOBBY
         self.SYS = None
         self.SIM = Simulator(_sim.MAX_LOCAL_BODIES)
+        self.state_version = 0
         self.servers = []
-        self.sys_recipes = self.__refresh_Sys_Recipes()
+        self.RECIPES = Recipe_Cache()
+        self.BATCH = Batch_Compiler(self.RECIPES)
+        self.__recipe_pool = ThreadPoolExecutor(max_workers=1)
+        self.__recipe_jobs = {}
+        self.refresh_sys_recipes()
+        self.WATCHER = Recipe_Watcher(self.RECIPES)
         
         # Player and main objects.
         ## self.PLAYER = Player()  # <-
@@ -79,7 +104,11 @@ class Client(ShowBase):
 
         # Main loop.
         taskMgr.add(self._main_loop_, "main_loop", appendTask=True, sort=0)  # <-
-        taskMgr.doMethodLater(1/_net.BROADCAST_HZ, self._state_, "state_loop")
+        self.state_sched = Tick_Scheduler(_net.BROADCAST_HZ)
+        taskMgr.add(self._state_, "state_loop", appendTask=True, sort=1)
+        if _sys.WATCH_HZ:
+            self.watch_sched = Tick_Scheduler(_sys.WATCH_HZ)
+            taskMgr.add(self._watch_, "watch_loop", appendTask=True, sort=2)
         
     
     def _main_loop_(self, task):
@@ -89,6 +118,10 @@ class Client(ShowBase):
         ue = self.UEH._get_events_()  # <-
         self._handle_user_events_(ue, dt)  # <-
         
+        # Place live objects at their interpolated positions for this frame.
+        if self.SIM.alive.value and self.ENV.LIVE_OBJECTS:
+            self.__interpolate_Live_Objects()
+        
         # Main loops.
         self.DISPLAY._main_loop_(ue, dt)  # <-
         
@@ -98,18 +131,31 @@ class Client(ShowBase):
     def _handle_user_events_(self, ue, dt):
         pass
     def _state_(self, task):
+        # Prox and collision events go out every frame as "sim-enter",
+        # "sim-exit" and "sim-collide" messages with (body a, body b, time).
         if self.SIM.alive.value:
-            state = self.SIM.get_state(self.ENV.CAMERA.sys_pos)
+            for kind, a, b, sim_time in self.SIM.get_events():
+                messenger.send("sim-{}".format(kind), [a, b, sim_time])
+        if not self.state_sched.due(): return task.cont
+        if self.SIM.alive.value:
+            # Only bodies that moved since the last poll come with a state.
+            self.state_version, in_range, state = self.SIM.get_state_changes(
+                self.ENV.CAMERA.sys_pos, self.state_version)
             live_ids = set(self.ENV.live_object_ids)
-            for obj_id, obj_state in state.items():
-                obj = self.SYS.OBJECT_DICT[obj_id]
-                obj.sys_pos.set(*obj_state['sys_pos'])
-                obj.sys_vec.set(*obj_state['sys_vec'])
-                obj.sys_hpr.set(*obj_state['sys_hpr'])
-                obj.sys_rot.set(*obj_state['sys_rot'])
-                '''if obj_id == "io":
-                    print((obj.sys_pos-self.__prev_pos).length())
-                    self.__prev_pos = LVector3d(*obj.sys_pos)'''
+            # Bodies just come into range are read together.
+            new_ids = [obj_id for obj_id in in_range if obj_id not in state
+                       and obj_id not in live_ids and obj_id in self.SYS.OBJECT_DICT]
+            if new_ids:
+                state.update(zip(new_ids, self.SIM.get_object_states(new_ids)))
+            for obj_id in in_range:
+                obj = self.SYS.OBJECT_DICT.get(obj_id)
+                if obj is None: continue
+                obj_state = state.get(obj_id)
+                if obj_state is not None:
+                    obj.sys_pos.set(*obj_state['sys_pos'])
+                    obj.sys_vec.set(*obj_state['sys_vec'])
+                    obj.sys_hpr.set(*obj_state['sys_hpr'])
+                    obj.sys_rot.set(*obj_state['sys_rot'])
                 if obj_id not in live_ids:
                     self.ENV.add_object(obj_id, obj)
                 else:
@@ -120,17 +166,156 @@ class Client(ShowBase):
                 if obj not in self.SYS.STARS:
                     self.ENV.remove_object(obj_id, obj)
         live_ids = []  
-        return task.again
+        return task.cont
+    def _index_(self, sys_index, header_Q, task):
+        # Adds scanned system headers to the index and redraws the lobby's
+        # system list as they arrive; done once the scan is.
+        added = False
+        while True:
+            try:
+                result = header_Q.get_nowait()
+            except Empty:
+                break
+            if result is None:
+                if added: self.LOBBY.on_sys_index()
+                return task.done
+            sys_file, header, error = result
+            if error:
+                print("Skipping system '{}': {}".format(sys_file, error))
+            else:
+                self.__add_Sys_Header(sys_index, sys_file, header)
+                added = True
+        if added: self.LOBBY.on_sys_index()
+        return task.cont
+    def _watch_(self, task):
+        # Edits to the live system's Shiva sources (its .shv, its bodies'
+        # .shv and their maps) are recompiled and swapped in without a
+        # restart. Each goes out as a "recipe-changed" message with
+        # (kind, name, recipe).
+        if not self.watch_sched.due(): return task.cont
+        reload_ids = set()
+        for change in self.WATCHER.poll():
+            if change.error:
+                print("Recipe '{}' not reloaded: {}".format(change.name, change.error))
+                continue
+            if change.kind == "sys":
+                self.__swap_Sys_Recipe(change.name, change.recipe, reload_ids)
+            elif any(not file_path.endswith(".shv") for file_path in change.files):
+                # Recipe edits come with the system's change; map edits
+                # just need the body's models and textures reloaded.
+                TexturePool.releaseAllTextures()
+                reload_ids.add(change.name)
+            messenger.send("recipe-changed", [change.kind, change.name, change.recipe])
+        if self.SYS:
+            for obj_id in reload_ids:
+                obj = self.SYS.OBJECT_DICT.get(obj_id)
+                if obj: self.ENV.reload_object(obj_id, obj)
+        return task.cont
 
-    def __refresh_Sys_Recipes(self):
+    def __interpolate_Live_Objects(self):
+        obj_ids = list(self.ENV.LIVE_OBJECTS.keys())
+        sample = self.SIM.sample(obj_ids)
+        if sample is None: return
+        pos, vec = sample
+        hpr = self.SIM.sample_hpr(obj_ids)
+        for obj_id, p, v, r in zip(obj_ids, pos.tolist(), vec.tolist(), hpr.tolist()):
+            obj = self.ENV.LIVE_OBJECTS[obj_id]
+            obj.sys_pos.set(*p)
+            obj.sys_vec.set(*v)
+            obj.sys_hpr.set(*r)
+
+    def __refresh_Sys_Index(self):
+        # Just each system's header (name and totals) for the lobby; full
+        # recipes are compiled when a system is first wanted.
         sys_dir_path = Filename("{}/*.shv".format(_path.SYSTEMS))
         sys_files = glob(sys_dir_path.toOsLongName())
-        sys_recipes = {}
-        for sys_file in sys_files:
-            base_name = os_path.basename(sys_file)
-            sys_name = os_path.splitext(base_name)[0]
-            sys_recipes[sys_name] = SC.compile_sys_recipe(sys_file)
-        return sys_recipes
+        sys_index = {}
+        if len(sys_files) < _sys.PARALLEL_COMPILE_MIN:
+            for sys_file in sys_files:
+                self.__add_Sys_Header(sys_index, sys_file, SC.scan_sys_header(sys_file))
+        else:
+            # Large catalogs are scanned in a process pool and fill in
+            # while the lobby is already up. Headers come back through a
+            # queue so only the main thread touches 'sys_index'. Then
+            # every system is compiled into the recipe cache in the same
+            # pool, so whichever one is picked loads rather than compiles.
+            header_Q = Queue()
+            Thread(target=self.__scan_Sys_Headers, args=(header_Q, sys_files), daemon=True).start()
+            taskMgr.add(self._index_, "index_loop", extraArgs=[sys_index, header_Q], appendTask=True, sort=3)
+        return sys_index
+
+    def __scan_Sys_Headers(self, header_Q, sys_files):
+        for result in self.BATCH.headers(sys_files):
+            header_Q.put(result)
+        header_Q.put(None)
+        for sys_file, recipe, error in self.BATCH.recipes(sys_files):
+            if error:
+                print("System '{}' not precompiled: {}".format(sys_file, error))
+
+    def __add_Sys_Header(self, sys_index, sys_file, header):
+        base_name = os_path.basename(sys_file)
+        sys_name = os_path.splitext(base_name)[0]
+        header['path'] = sys_file
+        sys_index[sys_name] = header
+
+    def __get_Sys_Recipe(self, sys_name):
+        # Waits for a prefetch already under way rather than compiling twice.
+        if sys_name not in self.sys_recipes:
+            job = self.__recipe_jobs.pop(sys_name, None)
+            if job:
+                self.sys_recipes[sys_name] = job.result()
+            else:
+                self.sys_recipes[sys_name] = self.RECIPES.sys_recipe(self.sys_index[sys_name]['path'])
+        return self.sys_recipes[sys_name]
+
+    def __prefetch_Sys_Recipe(self, sys_name):
+        # Compile in the background (e.g. while a lobby row is hovered).
+        if sys_name in self.sys_recipes or sys_name in self.__recipe_jobs: return
+        if sys_name not in self.sys_index: return
+        self.__recipe_jobs[sys_name] = self.__recipe_pool.submit(
+            self.RECIPES.sys_recipe, self.sys_index[sys_name]['path'])
+
+    def __swap_Sys_Recipe(self, sys_name, sys_recipe, reload_ids):
+        old_recipe = self.sys_recipes.get(sys_name)
+        self.sys_recipes[sys_name] = sys_recipe
+        if sys_name in self.sys_index:
+            for key in ("_stars", "_planets", "_moons", "_total"):
+                self.sys_index[sys_name][key] = sys_recipe[key]
+        if not self.SYS or self.SYS.name != sys_name: return
+        if old_recipe is None:
+            self.__reload_System()
+            return
+        
+        # Bodies whose simulated values are unchanged just take the new
+        # recipe; anything else restarts the system.
+        body_recipes = {}
+        pairs = [(old_recipe, sys_recipe)]
+        while pairs:
+            old_body, new_body = pairs.pop()
+            if len(old_body['sats']) != len(new_body['sats']) \
+            or any(old_body.get(key) != new_body.get(key) for key in SIM_KEYS):
+                self.__reload_System()
+                return
+            new_vals = {key:val for key, val in new_body.items() if key != "sats"}
+            if any(old_body.get(key) != val for key, val in new_vals.items()) \
+            or len(old_body) != len(new_body):
+                body_recipes[new_body['name']] = new_vals
+            pairs.extend(zip(old_body['sats'], new_body['sats']))
+        for obj_id, body_vals in body_recipes.items():
+            self.SYS.OBJECT_DICT[obj_id].__dict__.update(body_vals)
+            reload_ids.add(obj_id)
+
+    def __reload_System(self):
+        # Restart the live system from its (possibly changed) recipe,
+        # keeping the camera's focus.
+        sys_name = self.SYS.name
+        focus = self.ENV.CAMERA.FOCUS
+        for obj_id, obj in list(self.ENV.LIVE_OBJECTS.items()):
+            self.ENV.remove_object(obj_id, obj)
+        self.SYS = None
+        self.init_system(sys_name)
+        if focus and focus.name in self.SYS.OBJECT_DICT and self.DISPLAY is self.ENV:
+            self.ENV.set_focus(focus.name)
 
     def __refresh_Servers(self):
         server_array = []
@@ -4,34 +4,43 @@
 
 # System.
 from sys import exit
+from os import makedirs, path as os_path
 
 # Panda3d.
 from direct.showbase.ShowBase import ShowBase
 
 # Local.
-from etc.settings import _path
-from etc.shiva import Shiva_Compiler as SC
-from solex.simulator import Simulator
+from etc.settings import _path, _sim
+from solex.batch import Batch_Host
 
 # Config.
-MAX_BODIES = 1000
+MAX_BODIES = 1000   # Per hosted system, recipe bodies included.
 
 
 class Server(ShowBase):
     
     # Public.
     def init_system(self, sys_recipe):
-        self.SIM.init_system(sys_recipe)
-        self.SIM.start()
+        # Resume from the system's last checkpoint when there is one.
+        makedirs(_path.CHECKPOINTS, exist_ok=True)
+        sys_name = sys_recipe['name']
+        ckpt_path = "{}/{}.ckpt".format(_path.CHECKPOINTS, sys_name)
+        checkpoint = ckpt_path if os_path.exists(ckpt_path) else None
+        self.HOST.host_system(sys_recipe, checkpoint, MAX_BODIES)
+        self.HOST.start_checkpoints(sys_name, ckpt_path, _sim.CHECKPOINT_SECS)
+        self.ckpt_paths[sys_name] = ckpt_path
     def exit(self):
         print("server.exit")
-        self.SIM.stop()
+        for sys_name, ckpt_path in self.ckpt_paths.items():
+            self.HOST.save_checkpoint(sys_name, ckpt_path)
+        self.HOST.shutdown()
         exit()
         
     # Setup.
     def __init__(self):
         ShowBase.__init__(self)
-        self.SIM = Simulator(MAX_BODIES)
+        self.HOST = Batch_Host()
+        self.ckpt_paths = {}
                 
         # Temp.
         self.accept("escape", self.exit)
@@ -6,12 +6,13 @@
 from sys import exit
 
 # Panda3d imports.
-from panda3d.core import ClockObject, RenderModeAttrib
+from panda3d.core import ClockObject, RenderModeAttrib, TexturePool
 from panda3d.core import LVector3f, LVector3d, LPoint3f
 
 # Local imports.
-from etc.settings import _path
-from etc.shiva import Shiva_Compiler as SI
+from etc.settings import _path, _sys
+from etc.shiva_watch import Recipe_Watcher
+from etc.util import Tick_Scheduler
 from gui.ueh import Default_UEH
 from solex.environment import Environment
 
@@ -24,9 +25,15 @@ class Planet_Gen:
         self._alive = True
         self.UEH = Default_UEH()
         self.ENV = Environment()
-        sys_recipe = SI.compile_sys_recipe("{}/_default.shv".format(_path.SYSTEMS))
+        self.focus_name = focus_name
+        sys_path = "{}/_default.shv".format(_path.SYSTEMS)
+        sys_recipe = self.WATCHER.cache.sys_recipe(sys_path)
         self.ENV.load_system(sys_recipe, focus_name)
+        self.WATCHER.watch_system(sys_path)
         taskMgr.add(self._main_loop_, "main_loop", appendTask=True, sort=0)
+        if _sys.WATCH_HZ:
+            self.watch_sched = Tick_Scheduler(_sys.WATCH_HZ)
+            taskMgr.add(self._watch_, "watch_loop", appendTask=True, sort=1)
         
     
     def __init__(self):
@@ -35,6 +42,7 @@ class Planet_Gen:
         self.ENV = None
         self._alive = False
         self._prev_t = 0
+        self.WATCHER = Recipe_Watcher()
         
         
     def _main_loop_(self, task):
@@ -56,6 +64,23 @@ class Planet_Gen:
         if self._alive: return task.cont
         else: exit()
 
+    def _watch_(self, task):
+        # Reload the system whenever the focus planet's .shv or maps (or
+        # the system's) are saved, rather than restarting Planet_Gen.
+        if not self.watch_sched.due(): return task.cont
+        sys_recipe = None
+        for change in self.WATCHER.poll():
+            if change.error:
+                print("Recipe '{}' not reloaded: {}".format(change.name, change.error))
+            elif change.kind == "sys":
+                sys_recipe = change.recipe
+            elif any(not file_path.endswith(".shv") for file_path in change.files):
+                TexturePool.releaseAllTextures()
+                sys_recipe = sys_recipe or self.WATCHER.cache.sys_recipe("{}/_default.shv".format(_path.SYSTEMS))
+        if sys_recipe:
+            self.ENV.load_system(sys_recipe, self.focus_name)
+        return task.cont
+
     def _handle_user_events_(self, ue):
         cmds = ue.get_cmds(self)
         if "exit" in cmds:
@@ -7,13 +7,16 @@
 ## loadPrcFileData("", "window-type offscreen" ) # Spawn an offscreen buffer
 
 # Local.
+from etc.settings import _path
+from etc.shiva import Shiva_Compiler as SC
 from net.server import Server
 
-SYS_NAME = "sol"
+SYS_NAMES = ["sol"]
 
 if __name__ == "__main__":
     server = Server()
-    sys_path = "{}/{}.shv".format(_path.SYSTEMS, SYS_NAME)
-    sys_recipe = SC.compile_sys_recipe(sys_path)
-    server.init_system("sol")
+    for sys_name in SYS_NAMES:
+        sys_path = "{}/{}.shv".format(_path.SYSTEMS, sys_name)
+        sys_recipe = SC.compile_sys_recipe(sys_path)
+        server.init_system(sys_recipe)
     server.run()
@@ -0,0 +1,378 @@
+# ================
+# Solex - batch.py
+# ================
+
+# System imports.
+from os import cpu_count
+from time import monotonic
+from multiprocessing import Process, Value, Pipe
+
+# Third party imports.
+import numpy as np
+
+# Local imports.
+from etc.settings import _sim, _phys
+from etc.util import Tick_Scheduler
+from solex.state import State_Block, Snapshot_Ring, Event_Ring, FIELD_SLICES, STATE_KEYS, PROX_COL
+from solex.events import Event_Detector, EVENT_NAMES
+from solex.checkpoint import Checkpointer, load_checkpoint
+from solex.spatial import Prox_Grid
+from solex.rotation import Spin_Model
+from solex.physics import Sys_Arrays, Step_Clock, leapfrog_step, hierarchical_accel
+
+
+# Many independent systems packed end to end into one set of arrays so a
+# single vectorized hierarchical step advances all of them. Each member's
+# root has no parent, so no force ever crosses from one system to another.
+# Exposes the same array names as 'Sys_Arrays' for 'Spin_Model'.
+class Sys_Batch:
+
+    # Public.
+    def add(self, name, sys_arrays):
+        self.__sync_Members()
+        self.__members[name] = sys_arrays
+        self.__pack()
+    def remove(self, name):
+        self.__sync_Members()
+        self.__members.pop(name)
+        self.__pack()
+    def add_body(self, name, idx, spec, pos, vec):
+        # Body added to member 'name' while running, in one of its free rows.
+        self.__sync_Members()
+        parent, mass, radius, far_horizon = spec
+        self.__members[name].add(idx, parent, mass, radius, far_horizon, pos, vec)
+        self.__pack()
+    def remove_body(self, name, idx):
+        self.__sync_Members()
+        self.__members[name].remove(idx)
+        self.__pack()
+    def rows(self, name):
+        # Slice of this member's rows in the packed arrays.
+        return self.__slices[name]
+    def get_accel(self):
+        return hierarchical_accel(self.POS, self.MASS, self.PARENT, self.LEVELS, _phys.G, self.ACC)
+
+    # Setup.
+    def __init__(self):
+        self.__members = {}
+        self.__slices = {}
+        self.__pack()
+
+    def __sync_Members(self):
+        # Members' own arrays are brought up to date before any change so
+        # nothing integrated so far is lost when the batch is rebuilt.
+        for name, sl in self.__slices.items():
+            if name in self.__members:
+                sa = self.__members[name]
+                sa.POS[:sa.count] = self.POS[sl]
+                sa.VEC[:sa.count] = self.VEC[sl]
+
+    def __pack(self):
+        members = list(self.__members.values())
+        offsets = np.cumsum([0]+[sa.count for sa in members])
+        self.count = self.recipe_count = int(offsets[-1])
+        self.__slices = {name:slice(int(a), int(b)) for name, a, b
+                         in zip(self.__members, offsets[:-1], offsets[1:])}
+
+        def cat(attr, dtype):
+            # List attributes only cover recipe bodies; added ones get zeros.
+            parts = []
+            for sa in members:
+                vals = np.asarray(getattr(sa, attr), dtype=dtype)[:sa.count]
+                parts.append(np.concatenate([vals, np.zeros(sa.count-len(vals), dtype=dtype)]))
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+        self.POS = np.concatenate([sa.POS[:sa.count] for sa in members]) if members else np.zeros((0,3))
+        self.VEC = np.concatenate([sa.VEC[:sa.count] for sa in members]) if members else np.zeros((0,3))
+        self.ACC = np.zeros_like(self.POS)
+        self.MASS = cat("MASS", np.float64)
+        self.RADIUS = cat("RADIUS", np.float64)
+        self.DEPTH = cat("DEPTH", np.int64)
+        self.ACTIVE = cat("ACTIVE", bool)
+        self.PARENT = np.concatenate([np.where(sa.PARENT[:sa.count] >= 0, sa.PARENT[:sa.count]+off, -1)
+                                      for sa, off in zip(members, offsets)]) if members else np.zeros(0, dtype=np.int64)
+        for attr in ("SPIN", "TILT", "TILT_RASC", "SM_AXIS"):
+            setattr(self, attr, cat(attr, np.float64))
+        # Removed bodies' rows stay until the member is repacked, in no level.
+        depth = np.where(self.ACTIVE, self.DEPTH, -1)
+        max_depth = depth.max() if self.count else 0
+        self.LEVELS = [np.flatnonzero(depth == d) for d in range(1, max_depth+1)]
+        self.SPIN_MODEL = Spin_Model(self)
+        if self.count:
+            self.get_accel()
+
+
+def _write_dynamic_row(data, idx, spec, pos, vec):
+    parent, mass, radius, far_horizon = spec
+    data[idx] = 0.0
+    data[idx, 0:3] = pos
+    data[idx, 3:6] = vec
+    data[idx, PROX_COL] = radius * far_horizon
+
+def _run_shard(alive, conn):
+    # A shard process's loop. All of its systems share one fixed step;
+    # each keeps its own sim time, counted from the step it joined the
+    # batch at. Module level (not a method) so starting a shard pickles
+    # nothing but its arguments under spawn.
+    sim_throttle = Tick_Scheduler(_sim.HZ)
+    step_clock = Step_Clock(_sim.HZ, _sim.MAX_CATCH_UP)
+    batch = Sys_Batch()
+    members = {}
+    h = step_clock.step / _sim.SUB_STEPS
+    row_time = np.zeros(0)
+
+    def add_member(sys_name, sys_recipe, state, ring, events, dynamic):
+        arrs = Sys_Arrays(sys_recipe, state.rows)
+        n = arrs.count
+        arrs.POS[:n] = state.DATA[:n, 0:3]
+        arrs.VEC[:n] = state.DATA[:n, 3:6]
+        for idx, (parent, b_mass, radius, far_horizon) in dynamic.items():
+            arrs.add(idx, parent, b_mass, radius, far_horizon, state.DATA[idx, 0:3], state.DATA[idx, 3:6])
+        batch.add(sys_name, arrs)
+        members[sys_name] = (state, ring, events, Event_Detector(), state.sim_time-step_clock.sim_time)
+
+    while alive.value:
+        with sim_throttle:
+            changed = False
+            while conn.poll():
+                msg = conn.recv()
+                if msg[0] == "add":
+                    add_member(*msg[1:])
+                elif msg[0] == "add_body":
+                    sys_name, idx, spec, b_pos, b_vec = msg[1:]
+                    batch.add_body(sys_name, idx, spec, b_pos, b_vec)
+                    with members[sys_name][0] as data:
+                        _write_dynamic_row(data, idx, spec, b_pos, b_vec)
+                elif msg[0] == "remove_body":
+                    sys_name, idx = msg[1:]
+                    batch.remove_body(sys_name, idx)
+                    with members[sys_name][0] as data:
+                        data[idx] = 0.0
+                else:
+                    batch.remove(msg[1])
+                    state, ring, events, detector, t_off = members.pop(msg[1])
+                    state.close()
+                    ring.close()
+                    events.close()
+                    conn.send("removed")
+                changed = True
+            if changed:
+                row_time = np.zeros(batch.count)
+            steps = step_clock(monotonic())
+            if not steps or not batch.count: continue
+            for i in range(steps*_sim.SUB_STEPS):
+                leapfrog_step(batch.POS, batch.VEC, batch.ACC, h, batch.get_accel)
+
+            # Orient every body of every member in one call.
+            for sys_name, (state, ring, events, detector, t_off) in members.items():
+                row_time[batch.rows(sys_name)] = step_clock.sim_time + t_off
+            hpr, rot = batch.SPIN_MODEL.evaluate(row_time)
+            for sys_name, (state, ring, events, detector, t_off) in members.items():
+                sl = batch.rows(sys_name)
+                n = sl.stop - sl.start
+                t = step_clock.sim_time + t_off
+                with state as data:
+                    data[:n, 0:3] = batch.POS[sl]
+                    data[:n, 3:6] = batch.VEC[sl]
+                    data[:n, 6:9] = hpr[sl]
+                    data[:n, 9:12] = rot[sl]
+                    state.TIME[0] = t
+                    state.mark_dirty(n, _sim.DIRTY_DIST, _sim.DIRTY_ANGLE)
+                ring.publish(t, batch.POS[sl], batch.VEC[sl])
+                for event in detector.detect(batch.POS[sl], state.DATA[:n, PROX_COL], batch.RADIUS[sl], t):
+                    events.push(*event)
+    conn.close()
+
+
+# Hosts any number of systems for the server on a fixed pool of shard
+# processes (one per core by default). Every hosted system keeps its own
+# state block, snapshot ring and event ring, so it is read exactly like a
+# 'Simulator', and takes added bodies up to 'max_bodies'; a shard steps
+# all of its systems together as one 'Sys_Batch'. Only the hierarchical
+# gravity model is batched, since it never couples systems; systems that
+# need another model, ephemeris or Kepler rails, or path prediction stay
+# on a 'Simulator'.
+class Batch_Host:
+
+    # Public.
+    def host_system(self, sys_recipe, checkpoint=None, max_bodies=None):
+        return self.__host_System(sys_recipe, checkpoint, max_bodies)
+    def drop_system(self, sys_name):
+        self.__drop_System(sys_name)
+    def add_body(self, sys_name, name, mass, radius, sys_pos, sys_vec, parent=None, far_horizon=_sim.FAR_HORIZON):
+        return self.__add_Body(self.SYSTEMS[sys_name], name, mass, radius, sys_pos, sys_vec, parent, far_horizon)
+    def remove_body(self, sys_name, name):
+        self.__remove_Body(self.SYSTEMS[sys_name], name)
+    def get_state_changes(self, sys_name, sys_pos, since=0):
+        return self.__get_State_Changes(self.SYSTEMS[sys_name], tuple(sys_pos), since)
+    def get_object_state(self, sys_name, obj_id, fields=[]):
+        return self.__get_Object_State(sys_name, obj_id, fields)
+    def get_events(self, sys_name):
+        return self.__get_Events(self.SYSTEMS[sys_name])
+    def save_checkpoint(self, sys_name, path):
+        system = self.SYSTEMS[sys_name]
+        Checkpointer(path, system['STATE'], system['NAMES'], 0, system['DYNAMIC']).save()
+    def start_checkpoints(self, sys_name, path, interval=_sim.CHECKPOINT_SECS):
+        system = self.SYSTEMS[sys_name]
+        if system['ckpt']:
+            system['ckpt'].stop()
+        system['ckpt'] = Checkpointer(path, system['STATE'], system['NAMES'], interval, system['DYNAMIC'])
+        system['ckpt'].start()
+    def shutdown(self):
+        self.__shutdown()
+
+    # Setup.
+    def __init__(self, shards=_sim.BATCH_SHARDS):
+        self.alive = Value("i", 1)
+        self.SYSTEMS = {}
+        self.__shards = []
+        for i in range(shards or cpu_count() or 1):
+            conn, shard_conn = Pipe()
+            proc = Process(target=_run_shard, args=(self.alive, shard_conn), daemon=True)
+            proc.start()
+            shard_conn.close()
+            self.__shards.append({'conn':conn, 'proc':proc, 'bodies':0})
+
+    def __host_System(self, sys_recipe, checkpoint, max_bodies):
+        sys_name = sys_recipe['name']
+        if sys_name in self.SYSTEMS:
+            raise ValueError("System '{}' is already hosted.".format(sys_name))
+        arrs = Sys_Arrays(sys_recipe)
+        n = arrs.count
+        max_bodies = max(max_bodies or n, n)
+        state = State_Block(max_bodies, count=n)
+        data = state.DATA
+        data[:n, 0:3] = arrs.POS
+        data[:n, 3:6] = arrs.VEC
+        data[:n, PROX_COL] = arrs.RADIUS * arrs.FAR_HORIZON
+        system = {'name':sys_name, 'BODIES':{name:idx for idx, name in enumerate(arrs.NAMES)},
+                  'NAMES':list(arrs.NAMES) + [None]*(max_bodies-n),
+                  'DYNAMIC':{}, 'free':list(range(max_bodies-1, n-1, -1)),
+                  'STATE':state, 'RING':Snapshot_Ring(_sim.RING_SLOTS, max_bodies),
+                  'EVENTS':Event_Ring(_sim.EVENT_SLOTS), 'event_cursor':0,
+                  'prox_index':None, 'shard':None, 'ckpt':None}
+        if checkpoint:
+            self.__restore_Checkpoint(system, checkpoint)
+
+        # Least loaded shard by body count.
+        shard = min(self.__shards, key=lambda s: s['bodies'])
+        shard['bodies'] += len(system['BODIES'])
+        shard['conn'].send(("add", sys_name, sys_recipe, state, system['RING'], system['EVENTS'], system['DYNAMIC']))
+        system['shard'] = shard
+        self.SYSTEMS[sys_name] = system
+        return sys_name
+
+    def __restore_Checkpoint(self, system, path):
+        # As 'Simulator': bodies are matched by name and added bodies are
+        # added again, parents before satellites.
+        sim_time, names, ckpt, dynamic = load_checkpoint(path)
+        bodies = system['BODIES']
+        while dynamic:
+            ready = [row for row, spec in dynamic.items() if spec[0] not in dynamic]
+            for row in ready:
+                p_row, mass, radius, far_horizon = dynamic.pop(row)
+                parent = names[p_row] if 0 <= p_row < len(names) else None
+                if names[row] in bodies or parent not in bodies: continue
+                self.__add_Body(system, names[row], mass, radius, ckpt[row, 0:3], ckpt[row, 3:6], parent, far_horizon)
+            if not ready: break
+        with system['STATE'] as data:
+            for row, name in enumerate(names):
+                idx = bodies.get(name)
+                if idx is not None:
+                    data[idx, :] = ckpt[row]
+            system['STATE'].TIME[0] = sim_time
+
+    def __drop_System(self, sys_name):
+        system = self.SYSTEMS.pop(sys_name)
+        if system['ckpt']:
+            system['ckpt'].stop()
+        shard = system['shard']
+        shard['conn'].send(("remove", sys_name))
+        shard['conn'].recv()
+        shard['bodies'] -= len(system['BODIES'])
+        system['STATE'].unlink()
+        system['RING'].unlink()
+        system['EVENTS'].unlink()
+
+    def __add_Body(self, system, name, mass, radius, sys_pos, sys_vec, parent, far_horizon):
+        bodies = system['BODIES']
+        if name in bodies:
+            raise ValueError("Body '{}' already exists.".format(name))
+        if not system['free']:
+            raise ValueError("No free body slots (max_bodies {}).".format(system['STATE'].rows))
+        p_idx = bodies[parent] if parent else 0
+        idx = system['free'].pop()
+        spec = (p_idx, mass, radius, far_horizon)
+        bodies[name] = idx
+        system['NAMES'][idx] = name
+        system['DYNAMIC'][idx] = spec
+        system['STATE'].count = max(system['STATE'].count, idx+1)
+        system['prox_index'] = None
+        shard = system['shard']
+        if shard:
+            shard['bodies'] += 1
+            shard['conn'].send(("add_body", system['name'], idx, spec, tuple(sys_pos), tuple(sys_vec)))
+        else:
+            with system['STATE'] as data:
+                _write_dynamic_row(data, idx, spec, sys_pos, sys_vec)
+        return idx
+
+    def __remove_Body(self, system, name):
+        idx = system['BODIES'][name]
+        if idx not in system['DYNAMIC']:
+            raise ValueError("'{}' is part of the system recipe; use drop_system.".format(name))
+        if any(spec[0] == idx for spec in system['DYNAMIC'].values()):
+            raise ValueError("'{}' still has satellites.".format(name))
+        system['BODIES'].pop(name)
+        system['NAMES'][idx] = None
+        system['DYNAMIC'].pop(idx)
+        system['free'].append(idx)
+        system['prox_index'] = None
+        system['shard']['bodies'] -= 1
+        system['shard']['conn'].send(("remove_body", system['name'], idx))
+
+    def __get_State_Changes(self, system, sys_pos, since):
+        # As 'Simulator.get_state_changes', for one hosted system.
+        snap, grid, version, row_versions = self.__get_Prox_Index(system)
+        hits = grid.query(sys_pos)
+        names = system['NAMES']
+        in_range = [names[idx] for idx in hits.tolist() if names[idx] is not None]
+        state = {}
+        for idx in hits[row_versions[hits] > since].tolist():
+            if names[idx] is None: continue
+            row = snap[idx].tolist()
+            state[names[idx]] = {'sys_pos':tuple(row[0:3]),
+                                 'sys_vec':tuple(row[3:6]),
+                                 'sys_hpr':tuple(row[6:9]),
+                                 'sys_rot':tuple(row[9:12])}
+        return version, in_range, state
+
+    def __get_Prox_Index(self, system):
+        # Rebuilt only when the shard has published a new step.
+        state = system['STATE']
+        sim_time = state.sim_time
+        if system['prox_index'] and system['prox_index'][0] == sim_time:
+            return system['prox_index'][1:]
+        version, snap, row_versions = state.read_versioned(slice(0, state.count))
+        grid = Prox_Grid(snap[:,:3], snap[:,PROX_COL])
+        system['prox_index'] = (sim_time, snap, grid, version, row_versions)
+        return snap, grid, version, row_versions
+
+    def __get_Object_State(self, sys_name, obj_id, fields):
+        system = self.SYSTEMS[sys_name]
+        row = system['STATE'].read_rows(system['BODIES'][obj_id])
+        if not fields: fields = STATE_KEYS
+        return {field:tuple(row[FIELD_SLICES[field]].tolist()) for field in fields}
+
+    def __get_Events(self, system):
+        # New (kind, body a, body b, sim time) events since the last call.
+        events, system['event_cursor'], lost = system['EVENTS'].read(system['event_cursor'])
+        names = system['NAMES']
+        return [(EVENT_NAMES[kind], names[a] or a, names[b] or b, t) for kind, a, b, t in events]
+
+    def __shutdown(self):
+        for sys_name in list(self.SYSTEMS):
+            self.__drop_System(sys_name)
+        self.alive.value = 0
+        for shard in self.__shards:
+            shard['proc'].join()
+        self.__shards = []
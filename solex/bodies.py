@@ -89,8 +89,9 @@ class _Body_:
             self._mode = "near"
                 
         # Update body state.
+        # 'sys_pos' and 'sys_hpr' are set each frame from the simulator.
         self.MODEL_NP.setPos(*body_pos)
-        self.sys_pos += (self.sys_vec*dt)
+        self.MODEL_NP.setHpr(*self.sys_hpr)
         self.render_pos = body_pos
         
         self._post_update_(dist_from_cam)
@@ -125,6 +126,8 @@ class Star(_Body_):
         return self.preview_model
     def load(self):
         self.MODEL_NP = self._gen_Sphere_Model()
+    def unload(self):
+        self.MODEL_NP.removeNode()
         
     def __init__(self, recipe):
         _Body_.__init__(self, recipe)
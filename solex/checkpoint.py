@@ -0,0 +1,117 @@
+# =====================
+# Solex - checkpoint.py
+# =====================
+
+# System imports.
+import os
+import struct
+from threading import Thread, Event
+
+# Third party imports.
+import numpy as np
+
+# Local imports.
+from solex.state import STATE_WIDTH
+
+
+# File layout (little endian):
+#   header   magic, version, rows, width, sim_time, names_len, added  (64 bytes)
+#   names    body names, utf-8, newline separated, padded to 64 bytes
+#   data     rows x width float64 state block rows
+#   specs    added x 5 float64: row, parent row, mass, radius, far_horizon
+# The data section is 64 byte aligned so it can be memory mapped directly.
+# Version 1 files have no 'added' count or specs section.
+MAGIC = b"SLXCKPT\0"
+VERSION = 2
+_HEADER = struct.Struct("<8sIIIdII")
+_HEADER_V1 = struct.Struct("<8sIIIdI")
+_HEADER_SIZE = 64
+
+
+def _pad(n):
+    return (n+63) & ~63
+
+def save_checkpoint(path, data, sim_time, names, dynamic={}):
+    # 'dynamic' is row -> (parent row, mass, radius, far_horizon) for
+    # bodies added while running, so they can be added again on restore.
+    names_bytes = "\n".join(names).encode("utf-8")
+    rows, width = data.shape
+    specs = np.array([(row,)+tuple(spec) for row, spec in sorted(dynamic.items())], dtype="<f8").reshape(-1, 5)
+    header = _HEADER.pack(MAGIC, VERSION, rows, width, sim_time, len(names_bytes), len(specs))
+
+    # Write beside the target and swap it in, so a crash mid write
+    # never leaves a truncated checkpoint behind.
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "wb") as ckpt_file:
+        ckpt_file.write(header.ljust(_HEADER_SIZE, b"\0"))
+        ckpt_file.write(names_bytes.ljust(_pad(len(names_bytes)), b"\0"))
+        ckpt_file.write(np.ascontiguousarray(data, dtype="<f8").tobytes())
+        ckpt_file.write(specs.tobytes())
+    os.replace(tmp_path, path)
+
+def load_checkpoint(path, mmap=True):
+    # Returns (sim_time, names, data, dynamic); 'data' is a read only
+    # memory map unless 'mmap' is False and 'dynamic' is as passed to
+    # 'save_checkpoint'.
+    with open(path, "rb") as ckpt_file:
+        head = ckpt_file.read(_HEADER_SIZE)
+        if len(head) < _HEADER_SIZE:
+            raise ValueError("Truncated checkpoint '{}'.".format(path))
+        magic, version = struct.unpack_from("<8sI", head)
+        if magic != MAGIC:
+            raise ValueError("'{}' is not a Solex checkpoint.".format(path))
+        if version == 1:
+            magic, version, rows, width, sim_time, names_len = _HEADER_V1.unpack_from(head)
+            added = 0
+        elif version == VERSION:
+            magic, version, rows, width, sim_time, names_len, added = _HEADER.unpack_from(head)
+        else:
+            raise ValueError("Unsupported checkpoint version {} in '{}'.".format(version, path))
+        if width != STATE_WIDTH:
+            raise ValueError("Checkpoint '{}' has {} state fields, expected {}.".format(path, width, STATE_WIDTH))
+        names = ckpt_file.read(names_len).decode("utf-8").split("\n") if names_len else []
+    offset = _HEADER_SIZE + _pad(names_len)
+    if mmap:
+        data = np.memmap(path, dtype="<f8", mode="r", offset=offset, shape=(rows, width))
+    else:
+        data = np.fromfile(path, dtype="<f8", count=rows*width, offset=offset).reshape(rows, width)
+    specs = np.fromfile(path, dtype="<f8", count=added*5, offset=offset+rows*width*8).reshape(added, 5)
+    dynamic = {int(row):(int(parent), mass, radius, far_horizon)
+               for row, parent, mass, radius, far_horizon in specs.tolist()}
+    return sim_time, names, data, dynamic
+
+
+# Background writer: copies a consistent snapshot out of the state block
+# every 'interval' seconds and writes it from its own thread, so the
+# physics process never waits on disk.
+class Checkpointer:
+
+    # Public.
+    def start(self):
+        self.__thread.start()
+    def stop(self):
+        self.__halt.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+    def save(self):
+        # Free slots are saved with an empty name.
+        state = self.__state
+        rows = state.count
+        names = [name or "" for name in self.__names[:rows]]
+        snap = state.read_rows(slice(0, rows))
+        dynamic = {row:spec for row, spec in list(self.__dynamic.items()) if row < rows}
+        save_checkpoint(self.path, snap, state.sim_time, names, dynamic)
+
+    # Setup.
+    def __init__(self, path, state, names, interval, dynamic={}):
+        self.path = path
+        self.interval = interval
+        self.__state = state
+        self.__names = names
+        self.__dynamic = dynamic
+        self.__halt = Event()
+        self.__thread = Thread(target=self._writer_, daemon=True)
+
+    def _writer_(self):
+        while not self.__halt.wait(self.interval):
+            self.save()
@@ -22,6 +22,10 @@ class Lobby:
     def to_pre_view(self, sys_name=""):
         if sys_name: self.client.init_system(sys_name)
         self.client.switch_display(self.client.PRE_VIEW)
+    def on_sys_index(self):
+        menu = self.GUI.c_dict["lobby_win.local_menu"]
+        if not menu.NP.isHidden():
+            menu.reload()
     
     # Setup.
     def __init__(self, client):
@@ -183,6 +187,11 @@ class Environment:
         self.live_object_ids.remove(obj_id)
         self.LIVE_OBJECTS.pop(obj_id)
         obj.unload()
+    def reload_object(self, obj_id, obj):
+        # Rebuild a live object's models (e.g. after its recipe changed).
+        if obj_id not in self.live_object_ids: return
+        self.remove_object(obj_id, obj)
+        self.add_object(obj_id, obj)
     
     # Setup.
     def __init__(self ,client):
@@ -0,0 +1,166 @@
+# ====================
+# Solex - ephemeris.py
+# ====================
+
+# System imports.
+import os
+import struct
+
+# Third party imports.
+import numpy as np
+
+# Local imports.
+from etc.settings import _sim
+
+
+# Piecewise Chebyshev ephemerides. Every body's motion relative to its
+# parent is cut into equal segments (several per orbit) and each
+# segment is fitted with one polynomial per axis, so a lookup is one
+# segment index and a short recurrence for all bodies at once. Absolute
+# positions are summed down the body tree as in 'Kepler_Orbits'.
+#
+# File layout (little endian, sections 64 byte aligned):
+#   header   magic, version, bodies, degree, segments, t0, t1, names_len
+#   names    body names, utf-8, newline separated
+#   table    bodies x 4 float64: parent, first segment, segment count, length
+#   coeffs   segments x 3 x (degree+1) float64
+MAGIC = b"SLXEPHM\0"
+VERSION = 1
+_HEADER = struct.Struct("<8sIIIIddI")
+_HEADER_SIZE = 64
+
+
+def _pad(n):
+    return (n+63) & ~63
+
+def segment_lengths(orbits, segments=_sim.EPHEM_SEGMENTS):
+    # 'segments' per orbit, shortened for eccentric orbits by the ratio of
+    # mean to periapsis angular speed so periapsis passes stay smooth.
+    seg_len = 2*np.pi/orbits.N / segments * (1-orbits.E)**1.5
+    seg_len[orbits.PARENT < 0] = np.inf
+    return seg_len
+
+def build_ephemeris(sys_arrays, sampler, seg_len, t0, t1, degree=_sim.EPHEM_DEGREE):
+    # 'sampler(t, idx)' gives (pos, vec) of bodies 'idx' relative to their
+    # parents at times 't' (one per body). Returns (table, coeffs) for
+    # 'save_ephemeris'.
+    n = sys_arrays.count
+    parent = sys_arrays.PARENT[:n]
+    span = t1 - t0
+    seg_len = np.where(parent >= 0, np.minimum(seg_len, span), span)
+    seg_count = np.ceil(span/seg_len).astype(np.int64)
+    seg_start = np.r_[0, np.cumsum(seg_count)[:-1]]
+    table = np.stack([parent, seg_start, seg_count, seg_len], axis=1).astype(np.float64)
+
+    # Sample every segment of every orbiting body at the Chebyshev nodes.
+    k = np.arange(degree+1)
+    nodes = np.cos(np.pi*(k+.5)/(degree+1))
+    coeffs = np.zeros((int(seg_count.sum()), 3, degree+1))
+    bodies = np.flatnonzero(parent >= 0)
+    seg_body = np.repeat(bodies, seg_count[bodies])
+    seg_idx = np.concatenate([seg_start[b] + np.arange(seg_count[b]) for b in bodies]) if len(bodies) else np.zeros(0, dtype=np.int64)
+    seg_num = seg_idx - seg_start[seg_body]
+    mid = t0 + (seg_num+.5)*seg_len[seg_body]
+    t = mid[:,None] + nodes[None,:]*(seg_len[seg_body]*.5)[:,None]
+    rel_pos, rel_vec = sampler(t.ravel(), np.repeat(seg_body, degree+1))
+    vals = rel_pos.reshape(len(seg_idx), degree+1, 3)
+
+    # Discrete Chebyshev transform over the nodes.
+    basis = np.cos(np.pi*np.outer(k, k+.5)/(degree+1)) * (2.0/(degree+1))
+    basis[0] *= .5
+    coeffs[seg_idx] = np.einsum("jk,skc->scj", basis, vals)
+    return table, coeffs
+
+def save_ephemeris(path, table, coeffs, t0, t1, names):
+    names_bytes = "\n".join(names).encode("utf-8")
+    segs, axes, terms = coeffs.shape
+    header = _HEADER.pack(MAGIC, VERSION, len(table), terms-1, segs, t0, t1, len(names_bytes))
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "wb") as ephem_file:
+        ephem_file.write(header.ljust(_HEADER_SIZE, b"\0"))
+        ephem_file.write(names_bytes.ljust(_pad(len(names_bytes)), b"\0"))
+        ephem_file.write(np.ascontiguousarray(table, dtype="<f8").tobytes())
+        ephem_file.write(np.ascontiguousarray(coeffs, dtype="<f8").tobytes())
+    os.replace(tmp_path, path)
+
+
+# Runtime lookup over a (memory mapped) ephemeris file. 'evaluate' has the
+# same form as 'Kepler_Orbits.evaluate' so either can drive the rails.
+class Ephemeris:
+
+    # Public.
+    def evaluate(self, t, pos_out=None, vec_out=None):
+        return self.__evaluate(float(t), pos_out, vec_out)
+    def covers(self, t):
+        return self.t0 <= t <= self.t1
+
+    # Setup.
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(path, "rb") as ephem_file:
+            head = ephem_file.read(_HEADER_SIZE)
+            if len(head) < _HEADER_SIZE:
+                raise ValueError("Truncated ephemeris '{}'.".format(path))
+            magic, version, bodies, degree, segs, t0, t1, names_len = _HEADER.unpack_from(head)
+            if magic != MAGIC:
+                raise ValueError("'{}' is not a Solex ephemeris.".format(path))
+            if version != VERSION:
+                raise ValueError("Unsupported ephemeris version {} in '{}'.".format(version, path))
+            self.NAMES = ephem_file.read(names_len).decode("utf-8").split("\n") if names_len else []
+        self.count = bodies
+        self.degree = degree
+        self.t0, self.t1 = t0, t1
+        off = _HEADER_SIZE + _pad(names_len)
+        table = np.fromfile(path, dtype="<f8", count=bodies*4, offset=off).reshape(bodies, 4)
+        off += bodies*4*8
+        shape = (segs, 3, degree+1)
+        if mmap:
+            self.COEFFS = np.memmap(path, dtype="<f8", mode="r", offset=off, shape=shape)
+        else:
+            self.COEFFS = np.fromfile(path, dtype="<f8", count=segs*3*(degree+1), offset=off).reshape(shape)
+
+        self.PARENT = table[:,0].astype(np.int64)
+        self.SEG_START = table[:,1].astype(np.int64)
+        self.SEG_COUNT = table[:,2].astype(np.int64)
+        self.SEG_LEN = table[:,3]
+        depth = np.zeros(bodies, dtype=np.int64)
+        for i in range(bodies):
+            if self.PARENT[i] >= 0:
+                depth[i] = depth[self.PARENT[i]]+1
+        self.LEVELS = [np.flatnonzero(depth == d) for d in range(1, depth.max()+1)] if bodies else []
+        self.__T = np.zeros((bodies, degree+1))
+        self.__dT = np.zeros((bodies, degree+1))
+        self.__pos = np.zeros((bodies, 3))
+        self.__vec = np.zeros((bodies, 3))
+
+    def __evaluate(self, t, pos_out, vec_out):
+        if not self.covers(t):
+            raise ValueError("Sim time {} is outside ephemeris '{}' ({} to {}).".format(t, self.path, self.t0, self.t1))
+        if pos_out is None: pos_out = self.__pos
+        if vec_out is None: vec_out = self.__vec
+
+        # Segment and local time in [-1, 1] for every body.
+        rel_t = t - self.t0
+        k = np.minimum((rel_t // self.SEG_LEN).astype(np.int64), self.SEG_COUNT-1)
+        x = 2*(rel_t - k*self.SEG_LEN)/self.SEG_LEN - 1
+        coeffs = self.COEFFS[self.SEG_START+k]
+
+        # T_j(x) and T_j'(x) by recurrence.
+        T, dT = self.__T, self.__dT
+        T[:,0], dT[:,0] = 1.0, 0.0
+        if self.degree:
+            T[:,1], dT[:,1] = x, 1.0
+        for j in range(2, self.degree+1):
+            T[:,j] = 2*x*T[:,j-1] - T[:,j-2]
+            dT[:,j] = 2*T[:,j-1] + 2*x*dT[:,j-1] - dT[:,j-2]
+        rel_pos = np.einsum("nj,ncj->nc", T, coeffs)
+        rel_vec = np.einsum("nj,ncj->nc", dT, coeffs) * (2/self.SEG_LEN)[:,None]
+
+        roots = self.PARENT < 0
+        pos_out[roots] = rel_pos[roots]
+        vec_out[roots] = rel_vec[roots]
+        for lvl in self.LEVELS:
+            par = self.PARENT[lvl]
+            pos_out[lvl] = pos_out[par] + rel_pos[lvl]
+            vec_out[lvl] = vec_out[par] + rel_vec[lvl]
+        return pos_out, vec_out
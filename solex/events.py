@@ -0,0 +1,121 @@
+# =================
+# Solex - events.py
+# =================
+
+# Third party imports.
+import numpy as np
+
+# Local imports.
+from etc.settings import _sim
+
+
+# Event kinds, as stored in an 'Event_Ring'.
+ENTER = 1           # Body 'a' moved inside body 'b's prox.
+EXIT = 2            # Body 'a' moved back out of body 'b's prox.
+COLLIDE = 3         # Bodies 'a' and 'b' touched during the step.
+EVENT_NAMES = {ENTER:"enter", EXIT:"exit", COLLIDE:"collide"}
+
+
+def sweep_and_prune(lo, hi):
+    # Index pairs (i < j) whose axis aligned boxes overlap. Boxes are
+    # sorted on x, so each box only meets the run of boxes that start
+    # before it ends; those candidates are then checked on y and z.
+    order = np.argsort(lo[:,0], kind="stable")
+    s_lo = lo[order,0]
+    ends = np.searchsorted(s_lo, hi[order,0], side="right")
+    k = np.maximum(ends - np.arange(len(order)) - 1, 0)
+    first = np.repeat(np.arange(len(order)), k)
+    second = first + 1 + (np.arange(k.sum()) - np.repeat(np.cumsum(k)-k, k))
+    a, b = order[first], order[second]
+    keep = np.all((lo[a,1:] <= hi[b,1:]) & (lo[b,1:] <= hi[a,1:]), axis=1)
+    a, b = a[keep], b[keep]
+    return np.minimum(a, b), np.maximum(a, b)
+
+def pair_keys(a, b):
+    # Sorted int64 keys for (distinct) row pairs, so pair sets diff as
+    # arrays.
+    keys = (a.astype(np.int64) << 32) | b
+    keys.sort()
+    return keys
+
+def missing_keys(keys, other):
+    # Sorted 'keys' not in sorted 'other'.
+    if not len(other): return keys
+    idx = np.minimum(np.searchsorted(other, keys), len(other)-1)
+    return keys[other[idx] != keys]
+
+def _key_Events(kind, keys, sim_time):
+    return [(kind, key >> 32, key & 0xFFFFFFFF, sim_time) for key in keys.tolist()]
+
+
+# Broad and narrow phase over the motion since the last check, which runs
+# at most every 'period' sim seconds however often it is called. Every body is bounded
+# by the box around its swept path grown by the larger of its prox and
+# its radius; overlapping boxes (sweep and prune) are then tested exactly:
+# a body is inside another's prox when its end position is, a collision
+# is a closest approach under the sum of the radii while both move in a
+# straight line since the last check. Only changes are reported, so a
+# body that stays inside a prox or in contact yields one event. Current
+# pairs are kept as sorted key arrays and diffed against the last check's.
+class Event_Detector:
+
+    # Public.
+    def detect(self, pos, prox, radius, sim_time):
+        if self.__last is not None and self.__last <= sim_time < self.__last + self.period:
+            return []
+        self.__last = sim_time
+        return self.__detect(pos, prox, radius, sim_time)
+    def reset(self):
+        self.__prev = None
+        self.__last = None
+        self.__inside = np.zeros(0, dtype=np.int64)
+        self.__touching = np.zeros(0, dtype=np.int64)
+
+    # Setup.
+    def __init__(self, period=1/_sim.EVENT_HZ):
+        # Shaved a little so float sim times don't skip a step.
+        self.period = period * .999
+        self.reset()
+
+    def __detect(self, pos, prox, radius, sim_time):
+        # 'pos' holds end of step positions for every row; rows with no
+        # prox are free slots and take no part.
+        n = len(pos)
+        prev = self.__prev
+        if prev is None or len(prev) != n:
+            prev = pos
+        live = np.flatnonzero(prox > 0)
+        p0, p1 = prev[live], pos[live]
+        live_prox, live_radius = prox[live], radius[live]
+        p_lo, p_hi = np.minimum(p0, p1), np.maximum(p0, p1)
+        self.__prev = pos.copy()
+
+        # Prox: each body's end position against the other's sphere, over
+        # pairs whose prox boxes meet. Distances stay squared.
+        reach = np.maximum(live_prox, live_radius)[:,None]
+        i, j = sweep_and_prune(p_lo-reach, p_hi+reach)
+        d_end = p1[i] - p1[j]
+        d_sq = np.einsum("ij,ij->i", d_end, d_end)
+        prox_sq = live_prox * live_prox
+        in_j, in_i = d_sq < prox_sq[j], d_sq < prox_sq[i]
+        inside = pair_keys(np.concatenate((live[i[in_j]], live[j[in_i]])),
+                           np.concatenate((live[j[in_j]], live[i[in_i]])))
+
+        # Collisions: closest approach of the relative straight line path,
+        # over the far fewer pairs whose swept body boxes meet.
+        reach = live_radius[:,None]
+        i, j = sweep_and_prune(p_lo-reach, p_hi+reach)
+        d0 = p0[i] - p0[j]
+        dd = (p1[i]-p1[j]) - d0
+        dd_sq = np.einsum("ij,ij->i", dd, dd)
+        s = np.clip(-np.einsum("ij,ij->i", d0, dd) / np.where(dd_sq > 0, dd_sq, 1.0), 0, 1)
+        closest = d0 + dd*s[:,None]
+        reach_sq = (live_radius[i] + live_radius[j])**2
+        hit = np.einsum("ij,ij->i", closest, closest) < reach_sq
+        touching = pair_keys(live[i[hit]], live[j[hit]])
+
+        events = _key_Events(ENTER, missing_keys(inside, self.__inside), sim_time)
+        events += _key_Events(EXIT, missing_keys(self.__inside, inside), sim_time)
+        events += _key_Events(COLLIDE, missing_keys(touching, self.__touching), sim_time)
+        self.__inside, self.__touching = inside, touching
+        return events
@@ -0,0 +1,98 @@
+# =================
+# Solex - kepler.py
+# =================
+
+# Third party imports.
+import numpy as np
+
+# Local imports.
+from etc.settings import _phys
+
+
+# Closed form ("on rails") two body orbits for every body of a system,
+# evaluated for all bodies at once. Elements are derived from the recipe
+# with the same conventions the integrators use for their initial state:
+# each body starts at aphelion on its parent's +x axis moving towards +y,
+# and '$inclination' tilts the orbit about the x axis.
+class Kepler_Orbits:
+
+    # Public.
+    def evaluate(self, t, pos_out=None, vec_out=None):
+        return self.__evaluate(np.float64(t), pos_out, vec_out)
+    def evaluate_body(self, idx, t):
+        # Only the chain from 'idx' up to the root is evaluated.
+        chain = []
+        while idx > 0:
+            chain.append(idx)
+            idx = self.PARENT[idx]
+        pos, vec = np.zeros(3), np.zeros(3)
+        if chain:
+            chain = np.array(chain)
+            rel_pos, rel_vec = self.__relative(np.float64(t), chain)
+            pos, vec = rel_pos.sum(axis=0), rel_vec.sum(axis=0)
+        return pos, vec
+    def period(self, idx):
+        return 2*np.pi / self.N[idx]
+    def relative(self, t, idx):
+        # Position and velocity of bodies 'idx' relative to their parents,
+        # at one time 't' or at one time per body.
+        return self.__relative(np.asarray(t, dtype=np.float64), np.asarray(idx))
+
+    # Setup.
+    def __init__(self, sys_arrays, G=_phys.G, iters=8):
+        sa = sys_arrays
+        # Only the recipe's bodies are on rails.
+        n = self.count = sa.recipe_count
+        self.PARENT = sa.PARENT[:n].copy()
+        self.LEVELS = [lvl[lvl < n] for lvl in sa.LEVELS]
+        self.__iters = iters
+
+        par = np.maximum(self.PARENT, 0)
+        apo = np.array(sa.APHELION, dtype=np.float64)
+        sma = np.array(sa.SM_AXIS, dtype=np.float64)
+        sma[0] = apo[0] = 1.0
+        self.A = sma
+        self.E = np.clip(apo/sma - 1, 0.0, .99)
+        mu = G * (sa.MASS[par]+sa.MASS[:n])
+        self.N = np.sqrt(mu / sma**3)
+        self.B = sma * np.sqrt(1-self.E**2)
+        self.M0 = np.full(self.count, np.pi)
+
+        # Perifocal basis: periapsis on -x, motion at periapsis towards -y,
+        # both tilted about x by inclination.
+        inc = np.radians(sa.INCLINATION)
+        self.P_HAT = np.zeros((self.count, 3))
+        self.P_HAT[:,0] = -1
+        self.Q_HAT = np.zeros((self.count, 3))
+        self.Q_HAT[:,1] = -np.cos(inc)
+        self.Q_HAT[:,2] = -np.sin(inc)
+
+        self.__pos = np.zeros((self.count, 3))
+        self.__vec = np.zeros((self.count, 3))
+
+    def __relative(self, t, idx):
+        # Position and velocity of bodies 'idx' relative to their parents.
+        e, a, b, n = self.E[idx], self.A[idx], self.B[idx], self.N[idx]
+        M = np.mod(self.M0[idx] + n*t, 2*np.pi)
+        E = np.where(e > .8, np.pi, M)
+        for i in range(self.__iters):
+            E = E - (E - e*np.sin(E) - M) / (1 - e*np.cos(E))
+        cos_E, sin_E = np.cos(E), np.sin(E)
+        x, y = a*(cos_E-e), b*sin_E
+        E_dot = n / (1 - e*cos_E)
+        vx, vy = -a*sin_E*E_dot, b*cos_E*E_dot
+        P, Q = self.P_HAT[idx], self.Q_HAT[idx]
+        pos = P*x[:,None] + Q*y[:,None]
+        vec = P*vx[:,None] + Q*vy[:,None]
+        return pos, vec
+
+    def __evaluate(self, t, pos_out, vec_out):
+        if pos_out is None: pos_out = self.__pos
+        if vec_out is None: vec_out = self.__vec
+        pos_out[0] = vec_out[0] = 0.0
+        for lvl in self.LEVELS:
+            par = self.PARENT[lvl]
+            rel_pos, rel_vec = self.__relative(t, lvl)
+            pos_out[lvl] = pos_out[par] + rel_pos
+            vec_out[lvl] = vec_out[par] + rel_vec
+        return pos_out, vec_out
@@ -0,0 +1,209 @@
+# =================
+# Solex - octree.py
+# =================
+
+# Third party imports.
+import numpy as np
+
+
+# Barnes-Hut gravity on an octree built from Morton (z-order) keys.
+# The tree is rebuilt on every call straight from the position array:
+# sorting the keys makes every octree node a contiguous run of bodies,
+# so node masses and centres of mass come from 'np.add.reduceat' one
+# level at a time. The walk is vectorized the same way, carrying an
+# array of (group, node) pairs down the tree level by level, a group
+# being a short run of target bodies cut from one small node; nodes
+# with few bodies are summed body by body rather than opened further.
+# The sums are done in chunks of at most CHUNK_PAIRS pairs, so memory
+# stays flat however many bodies there are.
+
+MAX_DEPTH = 16      # 3*16 bit keys fit in int64.
+LEAF_SIZE = 8       # Nodes this small are summed directly.
+GROUP_SIZE = 16     # Most bodies walked together.
+GROUP_CELL = 64     # Groups are cut from nodes of at most this many bodies.
+CHUNK_PAIRS = 1<<20 # Most (target, source) pairs summed at once.
+CHUNK_SPREAD = 1.25 # Most ratio of source counts among a chunk's groups.
+DIRECT_MAX = 256    # Below this many bodies plain O(N^2) summation is faster.
+
+
+def spread_bits(cells):
+    # Spreads the low 16 bits of each cell index out to every third bit.
+    x = cells & 0xffff
+    x = (x | (x << 16)) & 0x0000ff0000ff
+    x = (x | (x << 8)) & 0x00f00f00f00f
+    x = (x | (x << 4)) & 0x0c30c30c30c3
+    x = (x | (x << 2)) & 0x249249249249
+    return x
+
+
+class Octree:
+
+    # Setup.
+    def __init__(self, pos, mass, depth=MAX_DEPTH):
+        self.depth = depth
+        lo, hi = pos.min(axis=0), pos.max(axis=0)
+        self.size = float(max((hi-lo).max(), 1e-9)) * (1+1e-9)
+        self.origin = lo
+
+        codes = self.__morton(pos)
+        order = np.argsort(codes)
+        self.CODES = codes
+        self.ORDER = order
+        s_codes = codes[order]
+        s_mass = mass[order]
+        s_mpos = pos[order] * s_mass[:,None]
+
+        # Per level node arrays, down to the first level where every
+        # node holds a single body (or the finest one).
+        self.KEY, self.START, self.COUNT = [], [], []
+        self.MASS, self.COM, self.SIZE = [], [], []
+        n = len(pos)
+        for lvl in range(depth+1):
+            keys = s_codes >> (3*(depth-lvl))
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            node_mass = np.add.reduceat(s_mass, starts)
+            node_com = np.add.reduceat(s_mpos, starts, axis=0) / np.maximum(node_mass, 1e-300)[:,None]
+            self.KEY.append(keys[starts])
+            self.START.append(starts)
+            self.COUNT.append(np.diff(np.r_[starts, n]))
+            self.MASS.append(node_mass)
+            self.COM.append(node_com)
+            self.SIZE.append(self.size / 2**lvl)
+            if len(starts) == n: break
+        self.levels = len(self.KEY)
+
+        # Children of each node are a contiguous run of next level nodes.
+        self.CHILD_LO, self.CHILD_HI = [], []
+        for lvl in range(self.levels-1):
+            ends = self.START[lvl] + self.COUNT[lvl]
+            self.CHILD_LO.append(np.searchsorted(self.START[lvl+1], self.START[lvl]))
+            self.CHILD_HI.append(np.searchsorted(self.START[lvl+1], ends))
+
+    def groups(self, size, cell):
+        # Starts and counts (in key order) of runs of at most 'size'
+        # bodies: the largest nodes holding at most 'cell' bodies (or
+        # finest level nodes) each cut into even runs.
+        starts, counts = [], []
+        for lvl in range(self.levels):
+            count = self.COUNT[lvl]
+            small = count <= cell
+            if lvl:
+                par = np.searchsorted(self.START[lvl-1], self.START[lvl], side="right") - 1
+                small &= self.COUNT[lvl-1][par] > cell
+            if lvl == self.levels-1:
+                small |= count > cell
+            starts.append(self.START[lvl][small])
+            counts.append(count[small])
+        starts, counts = np.concatenate(starts), np.concatenate(counts)
+        k = -(-counts // size)
+        run = expand(np.zeros(len(k), dtype=np.int64), k)
+        starts = np.sort(np.repeat(starts, k) + run*np.repeat(counts, k)//np.repeat(k, k))
+        return starts, np.diff(np.r_[starts, len(self.ORDER)])
+
+    def __morton(self, pos):
+        cells = ((pos-self.origin) / self.size * (1 << self.depth)).astype(np.int64)
+        cells = np.clip(cells, 0, (1 << self.depth)-1)
+        return (spread_bits(cells[:,0]) << 2) | (spread_bits(cells[:,1]) << 1) | spread_bits(cells[:,2])
+
+
+def expand(lo, k):
+    # Index runs [lo, lo+k) laid end to end.
+    offs = np.arange(k.sum()) - np.repeat(np.cumsum(k)-k, k)
+    return np.repeat(lo, k) + offs
+
+
+def barnes_hut_accel(pos, mass, G, out, theta=.5, eps=0.0):
+    n = len(pos)
+    if n < DIRECT_MAX:
+        # The tree doesn't pay for itself on small systems.
+        from solex.physics import pairwise_accel
+        return pairwise_accel(pos, mass, G, out, eps)
+    tree = Octree(pos, mass)
+    last = tree.levels-1
+    order = tree.ORDER
+    # A node is only taken whole from outside its own bounding sphere,
+    # so it never holds a body it acts on.
+    open_sq = max(1/(theta*theta), 3.0)
+
+    # Targets are small nodes, each walked as one with the distance to the
+    # bounding box of its bodies.
+    g_start, g_count = tree.groups(GROUP_SIZE, GROUP_CELL)
+    n_groups = len(g_start)
+    s_pos = pos[order]
+    g_lo = np.minimum.reduceat(s_pos, g_start)
+    g_hi = np.maximum.reduceat(s_pos, g_start)
+
+    # Sources found for each group: whole nodes and single bodies.
+    GROUP, SRC_POS, SRC_MASS = [], [], []
+
+    # Frontier of (group, node) pairs, starting with every group at the root.
+    groups = np.arange(n_groups)
+    nodes = np.zeros(n_groups, dtype=np.int64)
+    for lvl in range(tree.levels):
+        if not len(groups): break
+        com = tree.COM[lvl][nodes]
+        gap = np.maximum(np.maximum(g_lo[groups]-com, com-g_hi[groups]), 0.0)
+        far = tree.SIZE[lvl]**2*open_sq < np.einsum("ij,ij->i", gap, gap)
+        GROUP.append(groups[far])
+        SRC_POS.append(com[far])
+        SRC_MASS.append(tree.MASS[lvl][nodes[far]])
+
+        # Small nodes (every node at the last level) give their bodies.
+        near = ~far
+        count = tree.COUNT[lvl][nodes]
+        direct = near if lvl == last else near & (count <= LEAF_SIZE)
+        k = count[direct]
+        bodies = order[expand(tree.START[lvl][nodes[direct]], k)]
+        GROUP.append(np.repeat(groups[direct], k))
+        SRC_POS.append(pos[bodies])
+        SRC_MASS.append(mass[bodies])
+        if lvl == last: break
+
+        # Open the rest.
+        opened = near & ~direct
+        groups, nodes = groups[opened], nodes[opened]
+        lo = tree.CHILD_LO[lvl][nodes]
+        k = tree.CHILD_HI[lvl][nodes] - lo
+        groups = np.repeat(groups, k)
+        nodes = expand(lo, k)
+
+    # Sort the sources by group and sum them densely over each group's
+    # bodies, in chunks of groups with like source counts (padded out
+    # with massless sources) of at most CHUNK_PAIRS pairs.
+    group = np.concatenate(GROUP)
+    sort = np.argsort(group, kind="stable")
+    all_pos = np.concatenate(SRC_POS)[sort]
+    all_mass = np.concatenate(SRC_MASS)[sort]
+    n_src = np.bincount(group, minlength=n_groups)
+    src_lo = np.cumsum(n_src) - n_src
+    by_src = np.argsort(n_src, kind="stable")
+    s_src = n_src[by_src]
+    if GROUP_SIZE*s_src.sum() >= n*n:
+        # Evenly spread bodies open most of the tree; pairs are cheaper.
+        from solex.physics import pairwise_accel
+        return pairwise_accel(pos, mass, G, out, eps)
+
+    # Target rows padded out to GROUP_SIZE with copies of the first.
+    slots = np.arange(GROUP_SIZE)
+    t_valid = slots < g_count[:,None]
+    t_idx = g_start[:,None] + np.where(t_valid, slots, 0)
+    acc = np.empty((n_groups, GROUP_SIZE, 3))
+    lo = 0
+    while lo < n_groups:
+        hi = int(np.searchsorted(s_src, s_src[lo]*CHUNK_SPREAD, side="right"))
+        width = max(int(s_src[hi-1]), 1)
+        hi = min(hi, lo + max(CHUNK_PAIRS // (GROUP_SIZE*width), 1))
+        chunk = by_src[lo:hi]
+        lo = hi
+        src_slots = np.arange(width)
+        valid = src_slots < n_src[chunk][:,None]
+        idx = np.where(valid, src_lo[chunk][:,None] + src_slots, 0)
+        src_mass = all_mass[idx] * valid
+        rel = all_pos[idx][:,None,:,:] - s_pos[t_idx[chunk]][:,:,None,:]
+        dist_sq = np.einsum("gijk,gijk->gij", rel, rel) + eps*eps
+        # A body listed among its own group's sources pulls on nothing.
+        dist_sq[dist_sq == 0] = np.inf
+        inv = src_mass[:,None,:] / (dist_sq*np.sqrt(dist_sq))
+        acc[chunk] = np.einsum("gij,gijk->gik", inv, rel)
+    out[order[t_idx[t_valid]]] = acc[t_valid] * G
+    return out
@@ -0,0 +1,331 @@
+# ==================
+# Solex - physics.py
+# ==================
+
+# System imports.
+from math import sqrt, sin, cos, radians
+
+# Third party imports.
+import numpy as np
+
+# Local imports.
+from etc.settings import _phys, _sim
+
+# Body recipe keys read into 'Sys_Arrays'; a change to any of them needs
+# the simulator restarted with the new recipe.
+SIM_KEYS = ("name", "mass", "radius", "far_horizon", "aphelion", "sm_axis",
+            "inclination", "spin", "tilt", "tilt_rasc")
+
+
+# Array form of a system recipe. Bodies are stored in the same depth first
+# order that 'Simulator' uses for its state block rows, so index 'i' here is
+# row 'i' there. Arrays are preallocated to 'capacity' rows; rows past the
+# recipe's bodies are free slots for bodies added while running.
+class Sys_Arrays:
+
+    # Public.
+    def add(self, idx, parent, mass, radius, far_horizon, pos, vec, name=None):
+        self.NAMES[idx] = name
+        self.PARENT[idx] = parent
+        self.DEPTH[idx] = self.DEPTH[parent]+1 if parent >= 0 else 0
+        self.MASS[idx] = mass
+        self.RADIUS[idx] = radius
+        self.FAR_HORIZON[idx] = far_horizon
+        self.POS[idx] = pos
+        self.VEC[idx] = vec
+        self.ACC[idx] = 0.0
+        self.ACTIVE[idx] = True
+        self.count = max(self.count, idx+1)
+        self.update_levels()
+    def remove(self, idx):
+        self.NAMES[idx] = None
+        self.ACTIVE[idx] = False
+        self.PARENT[idx] = -1
+        self.MASS[idx] = self.RADIUS[idx] = self.FAR_HORIZON[idx] = 0.0
+        self.POS[idx] = self.VEC[idx] = self.ACC[idx] = 0.0
+        self.update_levels()
+    def update_levels(self):
+        # Index arrays of each depth level below the root; parents
+        # always sit in an earlier level than their satellites.
+        depth = np.where(self.ACTIVE, self.DEPTH, -1)
+        self.ACTIVE_IDX = np.flatnonzero(self.ACTIVE)
+        self.LEVELS = [np.flatnonzero(depth == d) for d in range(1, depth.max()+1)]
+
+    # Setup.
+    def __init__(self, sys_recipe, capacity=None):
+        self.NAMES = []
+        parents, masses, radii, depths, horizons = [], [], [], [], []
+        self.APHELION, self.SM_AXIS, self.INCLINATION = [], [], []
+        self.SPIN, self.TILT, self.TILT_RASC = [], [], []
+        pos, vec = [], []
+
+        def add_body(body, p_idx=-1, p_mass=0, pv=(0,0), x=0, depth=0):
+            x += body['aphelion']
+            v = 0
+            if x:
+                v = sqrt((_phys.G*(p_mass+body['mass']))*(2/body['aphelion']-1/body['sm_axis']))
+            idx = len(self.NAMES)
+            self.NAMES.append(body['name'])
+            parents.append(p_idx)
+            masses.append(body['mass'])
+            radii.append(body['radius'])
+            horizons.append(body['far_horizon'])
+            depths.append(depth)
+            self.APHELION.append(body['aphelion'])
+            self.SM_AXIS.append(body['sm_axis'])
+            self.INCLINATION.append(body.get('inclination', 0))
+            self.SPIN.append(body.get('spin', 0))
+            self.TILT.append(body.get('tilt', 0))
+            self.TILT_RASC.append(body.get('tilt_rasc', 0))
+            # Orbital velocity at aphelion, tilted about x by inclination.
+            inc = radians(body.get('inclination', 0))
+            vy, vz = v*cos(inc)+pv[0], v*sin(inc)+pv[1]
+            pos.append((x,0,0))
+            vec.append((0,vy,vz))
+            for sat in body['sats']:
+                add_body(sat, idx, body['mass'], (vy,vz), x, depth+1)
+
+        add_body(sys_recipe)
+        self.count = self.recipe_count = n = len(self.NAMES)
+        if capacity is None:
+            capacity = n
+        self.capacity = capacity
+        self.NAMES += [None] * (capacity-n)
+        
+        def alloc(vals, dtype, width=None):
+            shape = (capacity, width) if width else (capacity,)
+            arr = np.zeros(shape, dtype=dtype)
+            arr[:n] = vals
+            return arr
+        self.PARENT = alloc(parents, np.int64)
+        self.PARENT[n:] = -1
+        self.DEPTH = alloc(depths, np.int64)
+        self.MASS = alloc(masses, np.float64)
+        self.RADIUS = alloc(radii, np.float64)
+        self.FAR_HORIZON = alloc(horizons, np.float64)
+        self.POS = alloc(pos, np.float64, 3)
+        self.VEC = alloc(vec, np.float64, 3)
+        self.ACC = np.zeros_like(self.POS)
+        self.ACTIVE = alloc(True, bool)
+        self.update_levels()
+
+
+# Acceleration functions. Each fills and returns 'out' (N x 3).
+
+def hierarchical_accel(pos, mass, parent, levels, G, out):
+    # Each body feels only its parent's pull (two body form, G*(M+m)/r^2)
+    # and is carried along with its parent's own acceleration.
+    out[:] = 0.0
+    for lvl in levels:
+        par = parent[lvl]
+        rel = pos[lvl] - pos[par]
+        dist = np.sqrt(np.einsum("ij,ij->i", rel, rel))
+        mu = G * (mass[par]+mass[lvl])
+        out[lvl] = -rel * (mu/dist**3)[:,None] + out[par]
+    return out
+
+def pairwise_accel(pos, mass, G, out, eps=0.0):
+    # Full O(N^2) mutual gravity.
+    rel = pos[None,:,:] - pos[:,None,:]
+    dist_sq = np.einsum("ijk,ijk->ij", rel, rel) + eps*eps
+    np.fill_diagonal(dist_sq, 1.0)
+    inv = mass[None,:] / (dist_sq*np.sqrt(dist_sq))
+    np.fill_diagonal(inv, 0.0)
+    np.einsum("ij,ijk->ik", inv, rel, out=out)
+    out *= G
+    return out
+
+
+def field_accel(pos, src_pos, src_mass, G, out):
+    # Pull of the 'src' bodies on bodies at 'pos' (which exert none back).
+    rel = src_pos[None,:,:] - pos[:,None,:]
+    dist_sq = np.einsum("ijk,ijk->ij", rel, rel)
+    dist_sq[dist_sq == 0] = np.inf
+    inv = src_mass[None,:] / (dist_sq*np.sqrt(dist_sq))
+    np.einsum("ij,ijk->ik", inv, rel, out=out)
+    out *= G
+    return out
+
+
+# Integration.
+
+def leapfrog_step(pos, vec, acc, h, get_accel):
+    # Kick-drift-kick leapfrog; 'acc' must hold the accelerations at 'pos'
+    # on entry and holds those at the new 'pos' on return.
+    vec += acc * (h*.5)
+    pos += vec * h
+    get_accel()
+    vec += acc * (h*.5)
+
+class Block_Stepper:
+
+    # Block (power of two) timesteps for the hierarchical gravity model.
+    # There each body only feels its parent, so its motion relative to the
+    # parent is an independent two body orbit; every orbit is integrated
+    # with kick-drift-kick leapfrog in parent relative coordinates, with a
+    # step of 2**r base steps 'h', the longest that keeps the orbit's
+    # leapfrog drift under 'drift' km per sim second. Inner moons
+    # take short steps and outer planets very long ones, and only bodies
+    # ending a step need an acceleration. Absolute positions come from
+    # summing relative ones down the tree at any base step, with bodies
+    # part way through a step predicted from its start.
+    
+    # Public.
+    def step(self, count):
+        self.__step(count)
+    def sync(self):
+        # Write absolute positions and velocities at the current base
+        # step into the 'Sys_Arrays' the stepper was built on.
+        self.__sync()
+    def resync(self):
+        # Restart every step from the arrays' current absolute state and
+        # reassign rungs (after bodies are added or removed).
+        self.__resync()
+
+    # Setup.
+    def __init__(self, sys_arrays, h, G=_phys.G, drift=_sim.BLOCK_DRIFT, max_rung=_sim.MAX_RUNG, orbit_steps=0):
+        # 'orbit_steps', when given, also caps each step to that many per
+        # orbit.
+        self.arrs = sys_arrays
+        self.h = h
+        self.G = G
+        self.drift = drift
+        self.orbit_steps = orbit_steps
+        self.max_rung = max_rung
+        self.evals = 0
+        self.X0 = np.zeros_like(sys_arrays.POS)
+        self.V0 = np.zeros_like(sys_arrays.VEC)
+        self.A0 = np.zeros_like(sys_arrays.ACC)
+        self.__resync()
+
+    def __own_Accel(self, idx, rel):
+        # Two body pull of each body's parent; roots feel none.
+        sa = self.arrs
+        par = sa.PARENT[idx]
+        dist = np.sqrt(np.einsum("ij,ij->i", rel, rel))
+        mu = np.where(par >= 0, self.G*(sa.MASS[par]+sa.MASS[idx]), 0.0)
+        dist = np.where(dist > 0, dist, np.inf)
+        self.evals += len(idx)
+        return -rel * (mu/dist**3)[:,None]
+
+    def __assign_Rungs(self):
+        # Longest power of two step whose leapfrog drift stays under the
+        # target. Leapfrog's position on a circular orbit of radius r and
+        # angular speed w drifts off by about r*w*(w*H)**2/3 per unit time
+        # (steps are sized for /2, for a margin); with r and w taken at
+        # periapsis of the current (osculating) orbit about the parent
+        # this bounds eccentric orbits too.
+        sa = self.arrs
+        rung = np.full(sa.capacity, self.max_rung, dtype=np.int64)
+        for lvl in sa.LEVELS:
+            par = sa.PARENT[lvl]
+            x, v = self.X0[lvl], self.V0[lvl]
+            mu = self.G*(sa.MASS[par]+sa.MASS[lvl])
+            r = np.sqrt(np.einsum("ij,ij->i", x, x))
+            semi_lr = np.einsum("ij,ij->i", *[np.cross(x, v)]*2) / mu
+            ecc = np.sqrt(np.maximum(1 - semi_lr*(2/r - np.einsum("ij,ij->i", v, v)/mu), 0.0))
+            r_p = np.maximum(semi_lr/(1+ecc), 1e-9)
+            w = np.sqrt(mu/r_p**3)
+            H = np.sqrt(2*self.drift / (r_p*w**3))
+            if self.orbit_steps:
+                H = np.minimum(H, 2*np.pi/w/self.orbit_steps)
+            fit = np.floor(np.log2(np.maximum(H/self.h, 1.0))).astype(np.int64)
+            rung[lvl] = np.minimum(fit, self.max_rung)
+        self.RUNG = rung
+        self.SPAN = np.left_shift(1, rung)
+        self.H = self.SPAN * self.h
+
+        # Active bodies by rung: the bodies ending a step at base step 't'
+        # are those with rung <= the trailing zero bits of 't', a prefix.
+        act = sa.ACTIVE_IDX
+        self.BY_RUNG = act[np.argsort(rung[act], kind="stable")]
+        self.RUNG_END = np.searchsorted(rung[self.BY_RUNG], np.arange(self.max_rung+1), side="right")
+        self.min_span = int(self.SPAN[self.BY_RUNG[0]]) if len(act) else 0
+
+    def __step(self, count):
+        # Jump from one step boundary to the next; base steps where no
+        # body ends a step cost nothing.
+        end = self.tick + count
+        span = self.min_span
+        nxt = (self.tick//span + 1) * span if span else end+1
+        while nxt <= end:
+            self.tick = nxt
+            idx = self.BY_RUNG[:self.RUNG_END[min((nxt & -nxt).bit_length()-1, self.max_rung)]]
+            nxt += span
+            H = self.H[idx][:,None]
+            x0, v0, a0 = self.X0[idx], self.V0[idx], self.A0[idx]
+            v_half = v0 + a0*(H*.5)
+            x1 = x0 + v_half*H
+            a1 = self.__own_Accel(idx, x1)
+            self.X0[idx], self.V0[idx], self.A0[idx] = x1, v_half + a1*(H*.5), a1
+        self.tick = end
+
+    def __sync(self):
+        # Relative states first, then parents' absolute ones added level
+        # by level.
+        sa = self.arrs
+        act = sa.ACTIVE_IDX
+        e = ((self.tick % self.SPAN[act]) * self.h)[:,None]
+        v0 = self.V0[act]
+        v1 = v0 + self.A0[act]*e
+        sa.POS[act] = self.X0[act] + (v0+v1)*(e*.5)
+        sa.VEC[act] = v1
+        for lvl in sa.LEVELS:
+            par = sa.PARENT[lvl]
+            sa.POS[lvl] += sa.POS[par]
+            sa.VEC[lvl] += sa.VEC[par]
+
+    def __resync(self):
+        sa = self.arrs
+        act = sa.ACTIVE_IDX
+        par = sa.PARENT[act]
+        has_par = (par >= 0)[:,None]
+        self.X0[:] = self.V0[:] = self.A0[:] = 0.0
+        self.X0[act] = sa.POS[act] - np.where(has_par, sa.POS[np.maximum(par, 0)], 0.0)
+        self.V0[act] = sa.VEC[act] - np.where(has_par, sa.VEC[np.maximum(par, 0)], 0.0)
+        self.A0[act] = self.__own_Accel(act, self.X0[act])
+        self.tick = 0
+        self.__assign_Rungs()
+
+
+class Step_Clock:
+    
+    # Turns elapsed wall clock time into a whole number of fixed steps so
+    # integration never depends on scheduler jitter. At most 'max_steps'
+    # are run to catch up after an overrun, any remaining backlog is dropped
+    # rather than integrated as one large step.
+    def __init__(self, hz, max_steps, start_time=0.0):
+        self.step = 1.0/float(hz)
+        self.start_time = start_time
+        self.max_steps = max_steps
+        self.step_count = 0
+        self.dropped = 0
+        self.__backlog = 0.0
+        self.__p_time = None
+    
+    def __call__(self, c_time):
+        if self.__p_time is None:
+            self.__p_time = c_time
+        self.__backlog += c_time - self.__p_time
+        self.__p_time = c_time
+        steps = int(self.__backlog / self.step)
+        if steps > self.max_steps:
+            self.dropped += steps - self.max_steps
+            self.__backlog -= (steps-self.max_steps) * self.step
+            steps = self.max_steps
+        self.__backlog -= steps * self.step
+        self.step_count += steps
+        return steps
+
+    @property
+    def sim_time(self):
+        return self.start_time + self.step_count*self.step
+
+
+class Free_Step_Clock(Step_Clock):
+
+    # One step per call whatever the wall clock says, for running an
+    # engine flat out.
+    def __call__(self, c_time):
+        self.step_count += 1
+        return 1
@@ -0,0 +1,71 @@
+# ==================
+# Solex - predict.py
+# ==================
+
+# Third party imports.
+import numpy as np
+
+# Local imports.
+from etc.settings import _sim, _phys
+from solex.physics import Block_Stepper
+
+
+# Just the arrays 'Block_Stepper' works on, for the bodies of one
+# prediction (the requested bodies and their ancestors).
+class _Path_Arrays:
+
+    def __init__(self, parent, mass, pos, vec):
+        self.count = self.capacity = n = len(parent)
+        self.PARENT = parent
+        self.MASS = mass
+        self.POS = pos.copy()
+        self.VEC = vec.copy()
+        self.ACC = np.zeros_like(self.POS)
+        self.ACTIVE = np.ones(n, dtype=bool)
+        self.ACTIVE_IDX = np.arange(n)
+        depth = np.zeros(n, dtype=np.int64)
+        for i in range(n):
+            p = parent[i]
+            while p >= 0:
+                depth[i] += 1
+                p = parent[p]
+        self.LEVELS = [np.flatnonzero(depth == d) for d in range(1, depth.max()+1)]
+
+
+def predict_paths(parent, mass, state, rows, horizon, samples,
+                  G=_phys.G, orbit_steps=_sim.PREDICT_ORBIT_STEPS):
+    # Future paths of state block 'rows' under the hierarchical model, from
+    # 'state' (rows x 6: pos, vec) over 'horizon' sim seconds. Returns
+    # float32 (len(rows), samples, 3) offsets from each body's parent at
+    # the same sample time (zeros for a root), ready for line geometry.
+    need = []
+    for row in rows:
+        while row >= 0 and row not in need:
+            need.append(row)
+            row = parent[row]
+    need = np.array(sorted(need), dtype=np.int64)
+    local = {row:i for i, row in enumerate(need)}
+    l_parent = np.array([local.get(parent[row], -1) for row in need], dtype=np.int64)
+    arrs = _Path_Arrays(l_parent, mass[need], state[need, 0:3], state[need, 3:6])
+
+    # Base step: a power of two fraction of the sample interval fine
+    # enough for the fastest orbit among these bodies.
+    sample_dt = horizon / max(samples-1, 1)
+    sats = l_parent >= 0
+    split = 0
+    if sats.any():
+        rel = arrs.POS[sats] - arrs.POS[l_parent[sats]]
+        r = np.sqrt(np.einsum("ij,ij->i", rel, rel))
+        period = 2*np.pi * np.sqrt(r**3 / (G*(arrs.MASS[sats]+arrs.MASS[l_parent[sats]])))
+        split = int(np.clip(np.ceil(np.log2(sample_dt*orbit_steps/period.min())), 0, 30))
+    stepper = Block_Stepper(arrs, sample_dt/2**split, G, np.inf, split, orbit_steps)
+
+    out_rows = np.array([local[row] for row in rows], dtype=np.int64)
+    out_par = l_parent[out_rows]
+    paths = np.zeros((len(rows), samples, 3), dtype=np.float32)
+    for i in range(samples):
+        if i:
+            stepper.step(2**split)
+            stepper.sync()
+        paths[:, i] = np.where((out_par >= 0)[:,None], arrs.POS[out_rows] - arrs.POS[np.maximum(out_par, 0)], 0.0)
+    return paths
@@ -0,0 +1,75 @@
+# ===================
+# Solex - rotation.py
+# ===================
+
+# Third party imports.
+import numpy as np
+
+# Local imports.
+from etc.settings import _phys
+
+
+# Analytic spin and axial tilt for every body at once. A body's spin axis
+# is its local z axis tilted by '$tilt' about x and then turned by
+# '$tilt_rasc' about the system's z axis; the body turns about that axis
+# once per '$spin' hours (scaled by TIME_SCALE). A '$spin' of -1 marks a
+# tidally locked body, which turns once per orbit; 0 or no '$spin' means
+# the body does not turn. Orientation is returned as Panda3D HPR degrees
+# (heading about z, pitch about x, roll about y) and the angular velocity
+# as a system frame vector in degrees per sim second.
+class Spin_Model:
+
+    # Public.
+    def evaluate(self, t, hpr_out=None, rot_out=None):
+        return self.__evaluate(t, hpr_out, rot_out)
+
+    # Setup.
+    def __init__(self, sys_arrays, G=_phys.G):
+        sa = sys_arrays
+        n = self.count = sa.recipe_count
+        spin = np.array(sa.SPIN, dtype=np.float64)
+        period = np.abs(spin) * 3600 * _phys.TIME_SCALE
+
+        # Tidally locked bodies take their parent orbit's period.
+        locked = spin < 0
+        if locked.any():
+            par = np.maximum(sa.PARENT[:n], 0)
+            sma = np.maximum(np.array(sa.SM_AXIS, dtype=np.float64), 1.0)
+            mean_motion = np.sqrt(G*(sa.MASS[par]+sa.MASS[:n]) / sma**3)
+            period[locked] = 2*np.pi / mean_motion[locked]
+        self.RATE = np.where(period > 0, 360.0/np.where(period > 0, period, 1), 0.0)
+
+        # Fixed part of the rotation: Rz(tilt_rasc) . Rx(tilt).
+        tilt = np.radians(np.array(sa.TILT, dtype=np.float64))
+        rasc = np.radians(np.array(sa.TILT_RASC, dtype=np.float64))
+        self.AXIS_MAT = np.einsum("nij,njk->nik", _rot_z(rasc), _rot_x(tilt))
+        self.AXIS = self.AXIS_MAT[:,:,2]
+
+        self.__hpr = np.zeros((n, 3))
+        self.__rot = np.zeros((n, 3))
+
+    def __evaluate(self, t, hpr_out, rot_out):
+        if hpr_out is None: hpr_out = self.__hpr
+        if rot_out is None: rot_out = self.__rot
+        spin = np.radians(np.mod(self.RATE*t, 360.0))
+        mat = np.einsum("nij,njk->nik", self.AXIS_MAT, _rot_z(spin))
+
+        # Decompose mat = Rz(h) . Rx(p) . Ry(r).
+        hpr_out[:,0] = np.degrees(np.arctan2(-mat[:,0,1], mat[:,1,1]))
+        hpr_out[:,1] = np.degrees(np.arcsin(np.clip(mat[:,2,1], -1, 1)))
+        hpr_out[:,2] = np.degrees(np.arctan2(-mat[:,2,0], mat[:,2,2]))
+        rot_out[:] = self.AXIS * self.RATE[:,None]
+        return hpr_out, rot_out
+
+
+def _rot_z(a):
+    c, s = np.cos(a), np.sin(a)
+    mat = np.zeros((len(a), 3, 3))
+    mat[:,0,0], mat[:,0,1], mat[:,1,0], mat[:,1,1], mat[:,2,2] = c, -s, s, c, 1
+    return mat
+
+def _rot_x(a):
+    c, s = np.cos(a), np.sin(a)
+    mat = np.zeros((len(a), 3, 3))
+    mat[:,0,0], mat[:,1,1], mat[:,1,2], mat[:,2,1], mat[:,2,2] = 1, c, -s, s, c
+    return mat
@@ -3,177 +3,750 @@
 # ====================
 
 # System imports.
-from multiprocessing import Process, Value 
-from math import sqrt
+from multiprocessing import Process, Value, Queue, Pipe
+from queue import Empty
+from concurrent.futures import ProcessPoolExecutor, wait as wait_jobs
+
+# Third party.
+import numpy as np
 
 # Panda3d.
-from panda3d.core import Filename, ClockObject
+from panda3d.core import ClockObject
 from panda3d.core import LVector3d, LVector3f
 
 # Local.
-from etc.settings import _path, _sim, _phys
-from etc.util import Throttle, TimeIt
+from etc.settings import _sim, _phys
+from etc.util import Tick_Scheduler, Tick_Timer
+from solex.state import State_Block, Snapshot_Ring, Event_Ring, FIELD_SLICES, STATE_KEYS, PROX_COL
+from solex.state import STATE_WIDTH, state_array, field_columns
+from solex.events import Event_Detector, EVENT_NAMES
+from solex.kepler import Kepler_Orbits
+from solex.ephemeris import Ephemeris
+from solex.rotation import Spin_Model
+from solex.octree import barnes_hut_accel
+from solex.checkpoint import Checkpointer, load_checkpoint
+from solex.spatial import Prox_Grid
+from solex.predict import predict_paths
+from solex.physics import Sys_Arrays, Step_Clock, Free_Step_Clock, Block_Stepper, leapfrog_step
+from solex.physics import hierarchical_accel, pairwise_accel, field_accel
 
 
 class Simulator:
     
     # Public.
-    def init_system(self, sys_recipe):
+    def init_system(self, sys_recipe, checkpoint=None):
+        # The state block and ring are reused from system to system.
         self.stop()
         self.sys_recipe = sys_recipe
-        self.BODIES = self.__init_Bodies(sys_recipe)
-    def start(self, mode="python"):
-        self.alive = Value("i", 1)
-        if mode == "python":
-            self.__sim_proc = Process(target=self._physics_, args=(self.alive, self.BODIES))
-            self.__sim_proc.start()
+        self.RING.reset()
+        self.EVENTS.reset()
+        self.__event_cursor = 0
+        self.BODIES, arrs = self.__init_Bodies(sys_recipe)
+        self.ORBITS = Kepler_Orbits(arrs)
+        self.SPIN = Spin_Model(arrs)
+        self.EPHEM = None
+        self.ephem_path = None
+        self.BODY_NAMES[:] = arrs.NAMES + [None]*(self.max_bodies-arrs.count)
+        self.PARENT[:] = -1
+        self.PARENT[:arrs.count] = arrs.PARENT
+        self.MASS[:] = 0.0
+        self.MASS[:arrs.count] = arrs.MASS
+        self.DYNAMIC.clear()
+        self.__free = list(range(self.max_bodies-1, arrs.count-1, -1))
+        self.__drain_Commands(self.__cmd_Q)
+        self.__prox_index = None
+        self.__paths = {}
+        for job, job_key in self.__pending.values():
+            job.cancel()
+        self.__pending = {}
+        if checkpoint:
+            self.__restore_Checkpoint(checkpoint)
+    def start(self, mode="python", gravity=_sim.GRAVITY, throttle=True):
+        # 'throttle' False runs one step per tick back to back, timing
+        # each tick, for benchmarks; 'run_stats' has the ticks once stopped.
+        if mode not in ("python", "numpy", "kepler", "ephemeris"):
+            raise ValueError("Unknown simulator mode '{}'.".format(mode))
+        if not (self.__worker and self.__worker.is_alive()):
+            self.__start_Worker()
+        self.alive.value = 1
+        self.__conn.send(("run", self.sys_recipe, self.BODIES, self.STATE.count,
+                          mode, gravity, dict(self.DYNAMIC), self.ephem_path, throttle))
     def stop(self):
+        if self.__checkpointer:
+            self.__checkpointer.stop()
+            self.__checkpointer = None
         if self.alive.value == 1:
             self.alive.value = 0
-            self.__sim_proc.join()
+            self.__wait_Worker()
+    def shutdown(self):
+        # Stop the worker process for good and free the shared memory.
+        self.stop()
+        if self.__worker:
+            self.__conn.send(("quit",))
+            self.__worker.join()
+            self.__worker = None
+        if self.__pool:
+            self.__pool.shutdown(cancel_futures=True)
+            self.__pool = None
+        self.STATE.unlink()
+        self.RING.unlink()
+        self.EVENTS.unlink()
+    def add_body(self, name, mass, radius, sys_pos, sys_vec, parent=None, far_horizon=_sim.FAR_HORIZON):
+        return self.__add_Body(name, mass, radius, sys_pos, sys_vec, parent, far_horizon)
+    def remove_body(self, name):
+        self.__remove_Body(name)
     def get_state(self, sys_pos):
-        return self.__get_State(sys_pos)
-    def get_object_state(self, obj_id, fields=[]):
-        return self.__get_Object_State(obj_id, fields)
+        return self.__get_States([tuple(sys_pos)])[0]
+    def get_states(self, sys_positions):
+        return self.__get_States([tuple(sp) for sp in sys_positions])
+    def get_state_changes(self, sys_pos, since=0):
+        return self.__get_State_Changes(tuple(sys_pos), since)
+    def get_object_state(self, obj_id, fields=[], sim_time=None):
+        return self.__get_Object_State(obj_id, fields, sim_time)
+    def get_object_states(self, obj_ids, fields=[], out=None):
+        return self.__get_Object_States(obj_ids, fields, out)
+    def body_rows(self, obj_ids):
+        return np.array([self.BODIES[obj_id] for obj_id in obj_ids], dtype=np.int64)
+    def load_ephemeris(self, path):
+        self.__load_Ephemeris(path)
+    def get_events(self):
+        return self.__get_Events()
+    def predict(self, body_ids, horizon, samples, wait=False):
+        return self.__predict(list(body_ids), float(horizon), int(samples), wait)
+    def save_checkpoint(self, path):
+        Checkpointer(path, self.STATE, self.BODY_NAMES, 0, self.DYNAMIC).save()
+    def start_checkpoints(self, path, interval=_sim.CHECKPOINT_SECS):
+        if self.__checkpointer:
+            self.__checkpointer.stop()
+        self.__checkpointer = Checkpointer(path, self.STATE, self.BODY_NAMES, interval, self.DYNAMIC)
+        self.__checkpointer.start()
+    def render_time(self):
+        return self.RING.render_time(_sim.INTERP_DELAY)
+    def sample(self, obj_ids, sim_time=None):
+        return self.__sample(obj_ids, sim_time)
+    def sample_hpr(self, obj_ids, sim_time=None):
+        return self.__sample_Hpr(obj_ids, sim_time)
         
     # Setup.
     def __init__(self, max_bodies):
         self.max_bodies = max_bodies
         self.alive = Value("i", 0)
         self.BODIES = None
+        self.STATE = State_Block(max_bodies)
+        self.RING = Snapshot_Ring(_sim.RING_SLOTS, max_bodies)
+        self.EVENTS = Event_Ring(_sim.EVENT_SLOTS)
+        self.ORBITS = None
+        self.SPIN = None
+        self.EPHEM = None
+        self.ephem_path = None
+        self.BODY_NAMES = []
+        self.PARENT = np.full(max_bodies, -1, dtype=np.int64)
+        self.MASS = np.zeros(max_bodies)
+        self.DYNAMIC = {}
         self.sys_recipe = None
-        self.__sim_proc = None
+        self.run_stats = None
+        self.__rows_buf = np.zeros((max_bodies, STATE_WIDTH))
+        self.__columns = {}
+        self.__worker = None
+        self.__conn = None
+        self.__cmd_Q = Queue()
+        self.__free = []
+        self.__prox_index = None
+        self.__checkpointer = None
+        self.__pool = None
+        self.__paths = {}
+        self.__pending = {}
+        self.__event_cursor = 0
+
+    def __start_Worker(self):
+        self.__conn, worker_conn = Pipe()
+        args = (self.alive, self.STATE, self.RING, self.EVENTS, self.__cmd_Q, worker_conn)
+        self.__worker = Process(target=self._worker_, args=args, daemon=True)
+        self.__worker.start()
+        worker_conn.close()
+
+    def __wait_Worker(self):
+        # Each run ends with a "stopped" reply carrying the tick stats; EOF
+        # means the worker died.
+        try:
+            msg, self.run_stats = self.__conn.recv()
+        except EOFError:
+            self.__worker = None
 
 
-    def _physics_(self, alive, sys):
-        sim_throttle = Throttle(_sim.HZ)
-        sys_root = self.__init_Sim_System(self.sys_recipe)
+    def _worker_(self, alive, state, ring, events, cmd_Q, conn):
+        # Long lived: started once and handed one system at a time, so a
+        # system switch costs a message rather than a process spawn.
+        while True:
+            msg = conn.recv()
+            if msg[0] == "quit": break
+            cmd, self.sys_recipe, self.BODIES, state.count, mode, gravity, dynamic, ephem_path, throttle = msg
+            sim_throttle, step_clock = self.__tick_Clocks(state, throttle)
+            args = (alive, state, ring, events, cmd_Q, dynamic, sim_throttle, step_clock)
+            if mode == "python":
+                self._physics_(*args)
+            elif mode == "numpy":
+                self._np_physics_(*args, gravity)
+            elif mode == "kepler":
+                self._kepler_physics_(*args)
+            else:
+                self._kepler_physics_(*args, ephem_path)
+            conn.send(("stopped", sim_throttle.stats()))
+        conn.close()
+
+    def __tick_Clocks(self, state, throttle):
+        if throttle:
+            return (Tick_Scheduler(_sim.HZ),
+                    Step_Clock(_sim.HZ, _sim.MAX_CATCH_UP, state.sim_time))
+        return Tick_Timer(), Free_Step_Clock(_sim.HZ, 1, state.sim_time)
+
+    def _physics_(self, alive, state, ring, events, cmd_Q, dynamic, sim_throttle, step_clock):
+        sys_root = self.__init_Sim_System(self.sys_recipe, state.DATA)
+        spin = Spin_Model(Sys_Arrays(self.sys_recipe))
+        n_spin = spin.count
         dir_vec = LVector3d(0,0,0)
         clock = ClockObject.getGlobalClock()
         G = _phys.G
+        data = state.DATA
+        n = state.count
+        h = step_clock.step / _sim.SUB_STEPS
+        detector = Event_Detector()
+        radii = np.zeros(state.rows)
         
-        def apply_physics(body, parent, dt):
+        # Index of every body dict, for attaching and detaching bodies.
+        body_dicts = {}
+        def index_body(body):
+            body_dicts[body['idx']] = body
+            for sat in body['bodies']:
+                index_body(sat)
+        index_body(sys_root)
+        
+        def add_dynamic(idx, spec, pos=None, vec=None):
+            nonlocal n
+            parent, mass, radius, far_horizon = spec
+            if pos is None:
+                pos, vec = data[idx, 0:3], data[idx, 3:6]
+            body = {'name':idx, 'idx':idx, 'mass':mass, 'radius':radius,
+                    'POS':LVector3d(*pos), 'VEC':LVector3d(*vec),
+                    'HPR':LVector3f(0,0,0), 'ROT':LVector3f(0,0,0),
+                    'ACC':LVector3d(0,0,0), 'bodies':[]}
+            body_dicts[idx] = body
+            body_dicts[parent]['bodies'].append(body)
+            body['parent'] = body_dicts[parent]
+            radii[idx] = radius
+            n = max(n, idx+1)
+            return body
+        def remove_dynamic(idx):
+            body = body_dicts.pop(idx)
+            body['parent']['bodies'].remove(body)
+            radii[idx] = 0.0
+        for idx, spec in dynamic.items():
+            add_dynamic(idx, spec)
+        for idx, body in body_dicts.items():
+            radii[idx] = body['radius']
+        
+        def get_accel(body, parent):
             if parent:
                 # Find distance and direction from body to its parent.
                 dir_vec.set(*body['POS']-parent['POS'])
                 dist = dir_vec.length()
                 dir_vec.normalize()
                 
-                # Apply parent's gravity.
+                # Parent's gravity (two body form), carried along with
+                # the parent's own acceleration.
                 F = (G*(parent['mass']+body['mass'])) / (dist**2)
-                body['delta_vec'] = -dir_vec * F * dt
-                body['VEC'] += body['delta_vec'] + parent['delta_vec']
-                body['POS'] += body['VEC'] * dt
+                body['ACC'] = parent['ACC'] - dir_vec * F
                 
-                # Update self.BODIES.
-                b = self.BODIES[body['name']]
-                pos, vec, hpr, rot = body['POS'], body['VEC'], body['HPR'], body['ROT']
-                b['x'].value, b['y'].value, b['z'].value = pos.x, pos.y, pos.z
-                b['vx'].value, b['vy'].value, b['vz'].value = vec.x, vec.y, vec.z
-                b['h'].value, b['p'].value, b['r'].value = hpr.x, hpr.y, hpr.z
-                b['rh'].value, b['rp'].value, b['rr'].value = rot.x, rot.y, rot.z
+            for sat in body['bodies']:
+                get_accel(sat, body)
+        
+        def kick_drift(body, dt):
+            body['VEC'] += body['ACC'] * (dt*.5)
+            body['POS'] += body['VEC'] * dt
+            for sat in body['bodies']:
+                kick_drift(sat, dt)
+        
+        def kick(body, dt):
+            body['VEC'] += body['ACC'] * (dt*.5)
+            for sat in body['bodies']:
+                kick(sat, dt)
+        
+        def apply_physics(body, dt):
+            # Kick-drift-kick leapfrog, as 'leapfrog_step' in numpy mode.
+            kick_drift(body, dt)
+            get_accel(body, None)
+            kick(body, dt)
+        
+        get_accel(sys_root, None)
                 
+        def write_state(body):
+            # Update body's row of the state block.
+            pos, vec, hpr, rot = body['POS'], body['VEC'], body['HPR'], body['ROT']
+            data[body['idx'], :12] = (pos.x, pos.y, pos.z, vec.x, vec.y, vec.z,
+                                      hpr.x, hpr.y, hpr.z, rot.x, rot.y, rot.z)
             for sat in body['bodies']:
-                apply_physics(sat, body, dt)
+                write_state(sat)
 
-        p_time = 0
-        dt = 0
         while alive.value:
             with sim_throttle:
                 ## with TimeIt() as tt:
-                c_time = clock.getRealTime()
-                dt = c_time - p_time
-                apply_physics(sys_root, None, dt)
-                p_time = c_time
+                cmds = self.__drain_Commands(cmd_Q)
+                steps = step_clock(clock.getRealTime())
+                if not steps and not cmds: continue
+                for i in range(steps*_sim.SUB_STEPS):
+                    apply_physics(sys_root, h)
+                with state:
+                    for cmd in cmds:
+                        if cmd[0] == "add":
+                            add_dynamic(*cmd[1:])
+                            self.__write_Dynamic_Row(data, *cmd[1:])
+                        else:
+                            remove_dynamic(cmd[1])
+                            data[cmd[1]] = 0.0
+                    if cmds: get_accel(sys_root, None)
+                    write_state(sys_root)
+                    spin.evaluate(step_clock.sim_time, data[:n_spin, 6:9], data[:n_spin, 9:12])
+                    state.TIME[0] = step_clock.sim_time
+                    state.mark_dirty(n, _sim.DIRTY_DIST, _sim.DIRTY_ANGLE)
+                ring.publish(step_clock.sim_time, data[:n, 0:3], data[:n, 3:6])
+                for event in detector.detect(data[:n, 0:3], data[:n, PROX_COL], radii[:n], step_clock.sim_time):
+                    events.push(*event)
                 ## print(tt.dur/dt)
                     
-    def __init_Bodies(self, sys_recipe):
-        sys = {}
-        
-        def add_body(body, p_mass=0, pv=0, x=0):
-            x += body['aphelion']
-            v = 0
-            if x:
-                v = sqrt((_phys.G*(p_mass+body['mass']))*(2/body['aphelion']-1/body['sm_axis']))
-                ## print(body['name'])
-                ## print(v);print()
+    def _np_physics_(self, alive, state, ring, events, cmd_Q, dynamic, sim_throttle, step_clock, gravity):
+        arrs = Sys_Arrays(self.sys_recipe, self.max_bodies)
+        spin = Spin_Model(arrs)
+        n_spin = spin.count
+        pos, vec, acc, mass = arrs.POS, arrs.VEC, arrs.ACC, arrs.MASS
+        n = arrs.count
+        pos[:n] = state.DATA[:n, 0:3]
+        vec[:n] = state.DATA[:n, 3:6]
+        for idx, (parent, b_mass, radius, far_horizon) in dynamic.items():
+            arrs.add(idx, parent, b_mass, radius, far_horizon, state.DATA[idx, 0:3], state.DATA[idx, 3:6])
+        clock = ClockObject.getGlobalClock()
+        G = _phys.G
+        h = step_clock.step / _sim.SUB_STEPS
+        
+        if gravity == "hierarchical":
+            get_accel = lambda: hierarchical_accel(pos, mass, arrs.PARENT, arrs.LEVELS, G, acc)
+        elif gravity in ("pairwise", "barnes_hut"):
+            # Free slots are left out of the mutual gravity models.
+            def get_accel():
+                act = arrs.ACTIVE_IDX
+                act_acc = np.empty((len(act), 3))
+                if gravity == "pairwise":
+                    pairwise_accel(pos[act], mass[act], G, act_acc)
+                else:
+                    barnes_hut_accel(pos[act], mass[act], G, act_acc, _sim.BH_THETA)
+                acc[act] = act_acc
+        else:
+            raise ValueError("Unknown gravity model '{}'.".format(gravity))
+        get_accel()
+        detector = Event_Detector()
+        # Hierarchical orbits are independent, so each can take its own step.
+        blocks = None
+        if gravity == "hierarchical" and _sim.BLOCK_STEPS:
+            blocks = Block_Stepper(arrs, h)
+        
+        while alive.value:
+            with sim_throttle:
+                cmds = self.__drain_Commands(cmd_Q)
+                steps = step_clock(clock.getRealTime())
+                if not steps and not cmds: continue
+                if blocks:
+                    blocks.step(steps*_sim.SUB_STEPS)
+                    blocks.sync()
+                else:
+                    for i in range(steps*_sim.SUB_STEPS):
+                        leapfrog_step(pos, vec, acc, h, get_accel)
+                with state as data:
+                    for cmd in cmds:
+                        if cmd[0] == "add":
+                            idx, (parent, b_mass, radius, far_horizon), b_pos, b_vec = cmd[1:]
+                            arrs.add(idx, parent, b_mass, radius, far_horizon, b_pos, b_vec)
+                            self.__write_Dynamic_Row(data, *cmd[1:])
+                        else:
+                            arrs.remove(cmd[1])
+                            data[cmd[1]] = 0.0
+                    if cmds:
+                        if blocks: blocks.resync()
+                        else: get_accel()
+                    n = arrs.count
+                    data[:n, 0:3] = pos[:n]
+                    data[:n, 3:6] = vec[:n]
+                    spin.evaluate(step_clock.sim_time, data[:n_spin, 6:9], data[:n_spin, 9:12])
+                    state.TIME[0] = step_clock.sim_time
+                    state.mark_dirty(n, _sim.DIRTY_DIST, _sim.DIRTY_ANGLE)
+                ring.publish(step_clock.sim_time, pos[:n], vec[:n])
+                for event in detector.detect(pos[:n], data[:n, PROX_COL], arrs.RADIUS[:n], step_clock.sim_time):
+                    events.push(*event)
+
+    def _kepler_physics_(self, alive, state, ring, events, cmd_Q, dynamic, sim_throttle, step_clock, ephem_path=None):
+        # Celestial bodies follow their analytic orbits so there is nothing
+        # to integrate for them; each tick just evaluates every orbit at sim
+        # time (from the ephemeris, when given, over the span it covers).
+        # Free (dynamic) bodies are integrated under the pull of all the
+        # bodies on rails.
+        arrs = Sys_Arrays(self.sys_recipe, self.max_bodies)
+        orbits = Kepler_Orbits(arrs)
+        ephem = Ephemeris(ephem_path) if ephem_path else None
+        spin = Spin_Model(arrs)
+        n_rails = orbits.count
+        rails_pos = np.zeros((n_rails, 3))
+        rails_vec = np.zeros((n_rails, 3))
+        rails_mass = arrs.MASS[:n_rails]
+        pos, vec, acc = arrs.POS, arrs.VEC, arrs.ACC
+        for idx, (parent, b_mass, radius, far_horizon) in dynamic.items():
+            arrs.add(idx, parent, b_mass, radius, far_horizon, state.DATA[idx, 0:3], state.DATA[idx, 3:6])
+        clock = ClockObject.getGlobalClock()
+        G = _phys.G
+        h = step_clock.step / _sim.SUB_STEPS
+        
+        detector = Event_Detector()
+        
+        def eval_rails(t):
+            rails = ephem if ephem and ephem.covers(t) else orbits
+            rails.evaluate(t, rails_pos, rails_vec)
+        
+        def get_accel():
+            free = arrs.ACTIVE_IDX[n_rails:]
+            if len(free):
+                free_acc = np.empty((len(free), 3))
+                acc[free] = field_accel(pos[free], rails_pos, rails_mass, G, free_acc)
+        
+        eval_rails(step_clock.sim_time)
+        get_accel()
+        while alive.value:
+            with sim_throttle:
+                cmds = self.__drain_Commands(cmd_Q)
+                steps = step_clock(clock.getRealTime())
+                if not steps and not cmds: continue
                 
-            sys[body['name']] = {
-                '_prox':body['radius']*body['far_horizon'],
-                'x':Value("d", x),
-                'y':Value("d", 0.0),
-                'z':Value("d", 0.0),
-                'vx':Value("f", 0.0),
-                'vy':Value("f", v+pv),
-                'vz':Value("f", 0.0),
-                'h':Value("f", 0.0),
-                'p':Value("f", 0.0),
-                'r':Value("f", 0.0),
-                'rh':Value("f", 0.0),
-                'rp':Value("f", 0.0),
-                'rr':Value("f", 0.0)}
-                              
-            for sat in body['sats']:
-                add_body(sat, body['mass'], v, x)
-            x -= body['aphelion']
-            
-        add_body(sys_recipe)
-        return sys
+                # Sub-step the free bodies with the rails moving under them.
+                t = step_clock.sim_time
+                t0 = t - step_clock.step*steps
+                free = arrs.ACTIVE_IDX[n_rails:]
+                if len(free):
+                    for i in range(steps*_sim.SUB_STEPS):
+                        vec[free] += acc[free] * (h*.5)
+                        pos[free] += vec[free] * h
+                        eval_rails(t0+(i+1)*h)
+                        get_accel()
+                        vec[free] += acc[free] * (h*.5)
+                eval_rails(t)
+                with state as data:
+                    for cmd in cmds:
+                        if cmd[0] == "add":
+                            idx, (parent, b_mass, radius, far_horizon), b_pos, b_vec = cmd[1:]
+                            arrs.add(idx, parent, b_mass, radius, far_horizon, b_pos, b_vec)
+                            self.__write_Dynamic_Row(data, *cmd[1:])
+                        else:
+                            arrs.remove(cmd[1])
+                            data[cmd[1]] = 0.0
+                    if cmds: get_accel()
+                    n = arrs.count
+                    pos[:n_rails] = rails_pos
+                    vec[:n_rails] = rails_vec
+                    data[:n, 0:3] = pos[:n]
+                    data[:n, 3:6] = vec[:n]
+                    spin.evaluate(t, data[:n_rails, 6:9], data[:n_rails, 9:12])
+                    state.TIME[0] = t
+                    state.mark_dirty(n, _sim.DIRTY_DIST, _sim.DIRTY_ANGLE)
+                ring.publish(t, pos[:n], vec[:n])
+                for event in detector.detect(pos[:n], data[:n, PROX_COL], arrs.RADIUS[:n], t):
+                    events.push(*event)
+
+    def __init_Bodies(self, sys_recipe):
+        arrs = Sys_Arrays(sys_recipe)
+        if arrs.count > self.max_bodies:
+            raise ValueError("System exceeds max_bodies ({}).".format(self.max_bodies))
+        sys = {name:idx for idx, name in enumerate(arrs.NAMES)}
+        state = self.STATE
+        state.reset()
+        n = arrs.count
+        data = state.DATA
+        data[:n, 0:3] = arrs.POS
+        data[:n, 3:6] = arrs.VEC
+        data[:n, PROX_COL] = arrs.RADIUS * arrs.FAR_HORIZON
+        state.count = n
+        return sys, arrs
 
-    def __init_Sim_System(self, sys_recipe):
+    def __init_Sim_System(self, sys_recipe, data):
+        # Body tree for the python engine, starting from the state block.
         
-        def add_body(body, p_mass=0, pv=0, x=0):
-            x += body['aphelion']
-            v = 0
-            if x:
-                v = sqrt((_phys.G*(p_mass+body['mass']))*(2/body['aphelion']-1/body['sm_axis']))
+        def add_body(body):
+            idx = self.BODIES[body['name']]
             bodies = []
             for sat in body['sats']:
-                bodies.append(add_body(sat, body['mass'], v, x))
+                bodies.append(add_body(sat))
             
             body_dict = {'name':body['name'],
+                         'idx':idx,
                          'mass':body['mass'],
                          'radius':body['radius'],
-                         'POS':LVector3d(x,0,0),
-                         'VEC':LVector3d(0,v+pv,0),
-                         'HPR':LVector3f(0,0,0),
-                         'ROT':LVector3f(0,0,0),
-                         'delta_vec':LVector3d(0,0,0),
+                         'POS':LVector3d(*data[idx, 0:3]),
+                         'VEC':LVector3d(*data[idx, 3:6]),
+                         'HPR':LVector3f(*data[idx, 6:9]),
+                         'ROT':LVector3f(*data[idx, 9:12]),
+                         'ACC':LVector3d(0,0,0),
                          'bodies':bodies}
-                              
-            x -= body['aphelion']
             return body_dict
             
         sys_root = add_body(sys_recipe)
         return sys_root
 
-    def __get_State(self, sys_pos, obj_vec=LVector3d(0,0,0)):
+    def __get_States(self, sys_positions):
+        # One snapshot and spatial index serve every observer position.
+        snap, grid = self.__get_Prox_Index()
+        names = self.BODY_NAMES
+        states = []
+        for hits in grid.query_many(sys_positions):
+            state = {}
+            for idx in hits.tolist():
+                if names[idx] is None: continue
+                row = snap[idx].tolist()
+                state[names[idx]] = {'sys_pos':tuple(row[0:3]),
+                                     'sys_vec':tuple(row[3:6]),
+                                     'sys_hpr':tuple(row[6:9]),
+                                     'sys_rot':tuple(row[9:12])}
+            states.append(state)
+        return states
+
+    def __get_State_Changes(self, sys_pos, since):
+        # Returns (version, ids in range, states of those in range that
+        # changed after version 'since'). Pass the returned version back
+        # as 'since' on the next call.
+        snap, grid = self.__get_Prox_Index()
+        version, row_versions = self.__prox_index[3:]
+        hits = grid.query(sys_pos)
+        names = self.BODY_NAMES
+        # A body removed while running keeps its row until the worker
+        # clears it, so rows without a name are skipped.
+        in_range = [names[idx] for idx in hits.tolist() if names[idx] is not None]
         state = {}
-        for obj_id, o in self.BODIES.items():
-            obj_vec.set(o['x'].value, o['y'].value, o['z'].value)
-            dist = (sys_pos-obj_vec).length()
-            if dist < o['_prox']:
-                state[obj_id] = {'sys_pos':(o['x'].value, o['y'].value, o['z'].value),
-                                 'sys_vec':(o['vx'].value, o['vy'].value, o['vz'].value),
-                                 'sys_hpr':(o['h'].value, o['p'].value, o['r'].value),
-                                 'sys_rot':(o['rh'].value, o['rp'].value, o['rr'].value)}
-        return state
-
-    def __get_Object_State(self, obj_id, fields=[]):
+        for idx in hits[row_versions[hits] > since].tolist():
+            if names[idx] is None: continue
+            row = snap[idx].tolist()
+            state[names[idx]] = {'sys_pos':tuple(row[0:3]),
+                                 'sys_vec':tuple(row[3:6]),
+                                 'sys_hpr':tuple(row[6:9]),
+                                 'sys_rot':tuple(row[9:12])}
+        return version, in_range, state
+
+    def __get_Prox_Index(self):
+        # Rebuilt only when the physics loop has published a new step.
+        sim_time = self.STATE.sim_time
+        if self.__prox_index and self.__prox_index[0] == sim_time:
+            return self.__prox_index[1:3]
+        version, snap, row_versions = self.STATE.read_versioned(slice(0, self.STATE.count))
+        grid = Prox_Grid(snap[:,:3], snap[:,PROX_COL])
+        self.__prox_index = (sim_time, snap, grid, version, row_versions)
+        return snap, grid
+
+    def __get_Object_State(self, obj_id, fields=[], sim_time=None):
         if not fields:
-            fields = ["sys_pos", "sys_vec", "sys_hpr", "sys_rot"]
-        o = self.BODIES[obj_id]
+            fields = STATE_KEYS
+        idx = self.BODIES[obj_id]
+        row = self.STATE.read_rows(idx).tolist()
+        if sim_time is not None and idx < self.ORBITS.count:
+            # Position and velocity from the ephemeris or the analytic orbit.
+            if self.EPHEM and self.EPHEM.covers(sim_time):
+                pos, vec = self.EPHEM.evaluate(sim_time)
+                pos, vec = pos[idx], vec[idx]
+            else:
+                pos, vec = self.ORBITS.evaluate_body(idx, sim_time)
+            row[0:6] = pos.tolist() + vec.tolist()
         obj_state = {}
-        if "sys_pos" in fields:
-            obj_state['sys_pos'] = (o['x'].value, o['y'].value, o['z'].value)
-        if "sys_vec" in fields:
-            obj_state['sys_vec'] = (o['vx'].value, o['vy'].value, o['vz'].value)
-        if "sys_hpr" in fields:
-            obj_state['sys_hpr'] = (o['h'].value, o['p'].value, o['r'].value)
-        if "sys_rot" in fields:
-            obj_state['sys_rot'] = (o['rh'].value, o['rp'].value, o['rr'].value)
+        for field in fields:
+            fs = FIELD_SLICES[field]
+            obj_state[field] = tuple(row[fs])
         
         return obj_state
 
+    def __get_Object_States(self, obj_ids, fields, out):
+        # Many bodies in one seqlock read. 'obj_ids' is a list of ids or a
+        # row array from 'body_rows' (callers polling the same bodies can
+        # keep one). 'out' is a structured array from 'state_array' or a
+        # C-contiguous float64 array of len(obj_ids) x field widths; it is
+        # filled in place and returned, so repeated calls allocate nothing.
+        rows = obj_ids if isinstance(obj_ids, np.ndarray) else self.body_rows(obj_ids)
+        fields = tuple(fields) or STATE_KEYS
+        if out is None:
+            out = state_array(len(rows), fields)
+        cols = self.__columns.get(fields)
+        if cols is None:
+            cols = self.__columns[fields] = field_columns(fields)
+        if not out.flags.c_contiguous or out.nbytes != len(rows)*len(cols)*8:
+            raise ValueError("'out' must be C-contiguous with {} x {} float64 values.".format(len(rows), len(cols)))
+        flat = out.view(np.float64).reshape(len(rows), len(cols))
+        buf = self.STATE.read_rows(rows, self.__rows_buf[:len(rows)])
+        np.take(buf, cols, axis=1, out=flat)
+        return out
+
+    def __sample(self, obj_ids, sim_time):
+        # Interpolated (pos, vec) arrays for 'obj_ids' at 'sim_time'
+        # (default: now, less the interpolation delay).
+        if sim_time is None:
+            sim_time = self.render_time()
+        rows = [self.BODIES[obj_id] for obj_id in obj_ids]
+        return self.RING.sample(sim_time, rows)
+
+    def __sample_Hpr(self, obj_ids, sim_time):
+        # Spin is analytic, so recipe bodies are oriented exactly at
+        # 'sim_time'; added bodies keep whatever their state row holds.
+        if sim_time is None:
+            sim_time = self.render_time()
+        rows = np.array([self.BODIES[obj_id] for obj_id in obj_ids], dtype=np.int64)
+        hpr = self.STATE.read_rows(rows)[:, 6:9]
+        spin_hpr, spin_rot = self.SPIN.evaluate(sim_time)
+        rails = rows < self.SPIN.count
+        hpr[rails] = spin_hpr[rows[rails]]
+        return hpr
+
+    def __predict(self, body_ids, horizon, samples, wait):
+        # Paths are cached per (body, horizon, samples) with the body's row
+        # version; stale bodies are recomputed together as one job in the
+        # process pool. At most one job per (body, horizon, samples) is in
+        # flight, so polling every frame doesn't pile jobs up: bodies whose
+        # job is still running just return their last path. Without 'wait'
+        # this never blocks.
+        self.__collect_Paths()
+        n = self.STATE.count
+        version, state, row_versions = self.STATE.read_versioned(slice(0, n))
+        keys = {obj_id:(obj_id, horizon, samples) for obj_id in body_ids}
+        if wait:
+            # Jobs already in flight finish first, then anything still
+            # older than the versions read above is recomputed.
+            wait_jobs({self.__pending[key][0] for key in keys.values() if key in self.__pending})
+            self.__collect_Paths()
+        stale = []
+        for obj_id, key in keys.items():
+            if key in self.__pending: continue
+            row_version = int(row_versions[self.BODIES[obj_id]])
+            cached = self.__paths.get(key)
+            if not cached or cached[0] != row_version:
+                stale.append((obj_id, row_version))
+        if stale:
+            ids, versions = tuple(zip(*stale))
+            job_key = (horizon, samples, ids, versions)
+            if not self.__pool:
+                self.__pool = ProcessPoolExecutor(_sim.PREDICT_WORKERS or None)
+            job = self.__pool.submit(
+                predict_paths, self.PARENT[:n].copy(), self.MASS[:n].copy(), state[:, 0:6],
+                [self.BODIES[obj_id] for obj_id in ids], horizon, samples)
+            for obj_id in ids:
+                self.__pending[keys[obj_id]] = (job, job_key)
+            if wait:
+                job.result()
+                self.__collect_Paths()
+
+        paths = {}
+        for obj_id, key in keys.items():
+            cached = self.__paths.get(key)
+            if cached: paths[obj_id] = cached[1]
+        return paths
+
+    def __collect_Paths(self):
+        # Store the paths of finished jobs; a job covers several bodies.
+        done = {}
+        for key, (job, job_key) in list(self.__pending.items()):
+            if job.done():
+                self.__pending.pop(key)
+                done[job] = job_key
+        for job, job_key in done.items():
+            self.__store_Paths(job_key, job)
+
+    def __get_Events(self):
+        # New (kind, body a, body b, sim time) events since the last call;
+        # rows no longer named (removed bodies) are given by index.
+        events, self.__event_cursor, lost = self.EVENTS.read(self.__event_cursor)
+        names = self.BODY_NAMES
+        return [(EVENT_NAMES[kind], names[a] or a, names[b] or b, t) for kind, a, b, t in events]
+
+    def __store_Paths(self, job_key, job):
+        horizon, samples, ids, versions = job_key
+        for obj_id, version, path in zip(ids, versions, job.result()):
+            self.__paths[(obj_id, horizon, samples)] = (version, path)
+
+    def __load_Ephemeris(self, path):
+        ephem = Ephemeris(path)
+        if ephem.NAMES != self.BODY_NAMES[:self.ORBITS.count]:
+            raise ValueError("Ephemeris '{}' does not match system '{}'.".format(path, self.sys_recipe['name']))
+        self.EPHEM = ephem
+        self.ephem_path = path
+
+    def __restore_Checkpoint(self, path):
+        # Bodies are matched by name so a checkpoint survives recipe edits;
+        # bodies missing from it keep their recipe starting state. Bodies
+        # that were added are added again, parents before satellites.
+        sim_time, names, ckpt, dynamic = load_checkpoint(path)
+        while dynamic:
+            ready = [row for row, spec in dynamic.items() if spec[0] not in dynamic]
+            for row in ready:
+                p_row, mass, radius, far_horizon = dynamic.pop(row)
+                parent = names[p_row] if 0 <= p_row < len(names) else None
+                if names[row] in self.BODIES or parent not in self.BODIES: continue
+                self.__add_Body(names[row], mass, radius, ckpt[row, 0:3], ckpt[row, 3:6], parent, far_horizon)
+            if not ready: break
+        with self.STATE as data:
+            for row, name in enumerate(names):
+                idx = self.BODIES.get(name)
+                if idx is not None:
+                    data[idx, :] = ckpt[row]
+            self.STATE.TIME[0] = sim_time
+
+    def __add_Body(self, name, mass, radius, sys_pos, sys_vec, parent, far_horizon):
+        if name in self.BODIES:
+            raise ValueError("Body '{}' already exists.".format(name))
+        if not self.__free:
+            raise ValueError("No free body slots (max_bodies {}).".format(self.max_bodies))
+        p_idx = self.BODIES[parent] if parent else 0
+        idx = self.__free.pop()
+        spec = (p_idx, mass, radius, far_horizon)
+        self.BODIES[name] = idx
+        self.BODY_NAMES[idx] = name
+        self.PARENT[idx] = p_idx
+        self.MASS[idx] = mass
+        self.DYNAMIC[idx] = spec
+        self.STATE.count = max(self.STATE.count, idx+1)
+        self.__prox_index = None
+        if self.alive.value:
+            self.__cmd_Q.put(("add", idx, spec, tuple(sys_pos), tuple(sys_vec)))
+        else:
+            with self.STATE as data:
+                self.__write_Dynamic_Row(data, idx, spec, sys_pos, sys_vec)
+        return idx
+
+    def __remove_Body(self, name):
+        idx = self.BODIES[name]
+        if idx not in self.DYNAMIC:
+            raise ValueError("'{}' is part of the system recipe; use init_system.".format(name))
+        if any(spec[0] == idx for spec in self.DYNAMIC.values()):
+            raise ValueError("'{}' still has satellites.".format(name))
+        self.BODIES.pop(name)
+        self.BODY_NAMES[idx] = None
+        self.PARENT[idx] = -1
+        self.MASS[idx] = 0.0
+        self.DYNAMIC.pop(idx)
+        self.__free.append(idx)
+        self.__prox_index = None
+        if self.alive.value:
+            self.__cmd_Q.put(("remove", idx))
+        else:
+            with self.STATE as data:
+                data[idx] = 0.0
 
+    def __write_Dynamic_Row(self, data, idx, spec, pos, vec):
+        parent, mass, radius, far_horizon = spec
+        data[idx] = 0.0
+        data[idx, 0:3] = pos
+        data[idx, 3:6] = vec
+        data[idx, PROX_COL] = radius * far_horizon
 
+    def __drain_Commands(self, cmd_Q):
+        cmds = []
+        while True:
+            try:
+                cmds.append(cmd_Q.get_nowait())
+            except Empty:
+                return cmds
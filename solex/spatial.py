@@ -0,0 +1,77 @@
+# ==================
+# Solex - spatial.py
+# ==================
+
+# Third party imports.
+import numpy as np
+
+
+# Cell coordinates are packed into one int64 key per cell.
+_KEY_BITS = 21
+_KEY_OFF = 1 << (_KEY_BITS-1)
+_NEIGHBOURS = np.array([(x,y,z) for x in (-1,0,1) for y in (-1,0,1) for z in (-1,0,1)], dtype=np.int64)
+
+
+# Uniform grid over body positions for "which bodies have this point inside
+# their '_prox' radius" queries. Each body is stored in the single cell that
+# holds its position; since every gridded body's prox is no larger than a
+# cell, an observer only has to look at its own cell and the 26 around it.
+# Bodies with a larger prox (stars, gas giants) are few and are kept in a
+# separate list that is tested directly.
+class Prox_Grid:
+
+    # Public.
+    def query(self, obs_pos):
+        return self.query_many(np.asarray(obs_pos, dtype=np.float64).reshape(1,3))[0]
+    def query_many(self, obs_pos):
+        return self.__query_Many(np.asarray(obs_pos, dtype=np.float64))
+
+    # Setup.
+    def __init__(self, pos, prox, cell_size=None):
+        self.count = len(pos)
+        self.POS = pos
+        self.PROX = prox
+        if cell_size is None:
+            live = prox[prox > 0]
+            cell_size = 2*float(np.median(live)) if len(live) else 1.0
+        self.cell_size = cell_size
+
+        big = prox > cell_size
+        self.BIG = np.nonzero(big)[0]
+        small = np.nonzero(~big)[0]
+        keys = self.__cell_Keys(self.__cells(pos[small]))
+        order = np.argsort(keys, kind="stable")
+        self.KEYS = keys[order]
+        self.SMALL = small[order]
+
+    def __cells(self, pts):
+        return np.floor(pts / self.cell_size).astype(np.int64)
+
+    def __cell_Keys(self, cells):
+        c = np.clip(cells + _KEY_OFF, 0, (1 << _KEY_BITS)-1)
+        return (c[...,0] << (2*_KEY_BITS)) | (c[...,1] << _KEY_BITS) | c[...,2]
+
+    def __query_Many(self, obs_pos):
+        pos, prox = self.POS, self.PROX
+        results = []
+
+        # Large prox bodies: one M x B distance test.
+        big = self.BIG
+        if len(big):
+            d = np.linalg.norm(obs_pos[:,None,:]-pos[big][None,:,:], axis=2)
+            big_hits = d < prox[big][None,:]
+
+        # Gridded bodies: candidate ranges from the 27 cells around each observer.
+        n_keys = self.__cell_Keys(self.__cells(obs_pos)[:,None,:] + _NEIGHBOURS[None,:,:])
+        lo = np.searchsorted(self.KEYS, n_keys, side="left")
+        hi = np.searchsorted(self.KEYS, n_keys, side="right")
+
+        for i in range(len(obs_pos)):
+            hits = [big[big_hits[i]]] if len(big) else []
+            spans = [self.SMALL[a:b] for a, b in zip(lo[i], hi[i]) if b > a]
+            if spans:
+                cand = np.concatenate(spans)
+                d = np.linalg.norm(pos[cand]-obs_pos[i], axis=1)
+                hits.append(cand[d < prox[cand]])
+            results.append(np.concatenate(hits) if hits else np.zeros(0, dtype=np.int64))
+        return results
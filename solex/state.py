@@ -0,0 +1,353 @@
+# ================
+# Solex - state.py
+# ================
+
+# System imports.
+from multiprocessing import shared_memory
+from time import monotonic
+
+# Third party imports.
+import numpy as np
+
+
+# State block layout: one float64 row per body.
+STATE_FIELDS = ("x", "y", "z",
+                "vx", "vy", "vz",
+                "h", "p", "r",
+                "rh", "rp", "rr",
+                "prox")
+STATE_WIDTH = len(STATE_FIELDS)
+FIELD_SLICES = {
+    'sys_pos':slice(0,3),
+    'sys_vec':slice(3,6),
+    'sys_hpr':slice(6,9),
+    'sys_rot':slice(9,12),
+}
+STATE_KEYS = ("sys_pos", "sys_vec", "sys_hpr", "sys_rot")
+PROX_COL = 12
+
+
+def state_dtype(fields=STATE_KEYS):
+    # Structured dtype of one body's 'fields', e.g. rec['sys_pos'] -> (3,).
+    return np.dtype([(field, np.float64, (FIELD_SLICES[field].stop-FIELD_SLICES[field].start,))
+                     for field in fields])
+
+def state_array(n, fields=STATE_KEYS):
+    # Zeroed structured array for 'n' bodies, usable as an 'out' buffer.
+    return np.zeros(n, dtype=state_dtype(fields))
+
+def field_columns(fields=STATE_KEYS):
+    # State block columns of 'fields', in order.
+    return np.concatenate([np.arange(FIELD_SLICES[field].start, FIELD_SLICES[field].stop)
+                           for field in fields])
+
+
+# Whole system state as one N x STATE_WIDTH float64 array in shared memory,
+# behind a small header holding the sequence counter, the simulation time
+# and the current version. The single writer (the physics loop) wraps each
+# step in a 'with' block; readers retry until they see an even, unchanged
+# sequence counter (seqlock) so a step is never observed half written.
+# Each row also has a version: the last version at which the body moved
+# by more than the writer's threshold, so readers can skip still bodies.
+class State_Block:
+
+    # Public.
+    def snapshot(self, out=None):
+        return self.__read(slice(0, self.rows), out)
+    def read_rows(self, rows, out=None):
+        return self.__read(rows, out)
+    def read_versioned(self, rows):
+        # (version, row values, row versions) all from the same step.
+        return self.__read_Versioned(rows)
+    def mark_dirty(self, n, dist, angle):
+        # Writer side, inside the 'with' block after the step's writes.
+        self.__mark_Dirty(n, dist, angle)
+    def reset(self):
+        # Clear the block for a new system. The version keeps counting so
+        # every row reads as changed to readers that poll from 0.
+        with self as data:
+            data[:] = 0.0
+            self.TIME[0] = 0.0
+            self.VERSION[0] += 1
+            self.ROW_VERSIONS[:] = self.VERSION[0]
+        self.count = 0
+    @property
+    def sim_time(self):
+        return float(self.TIME[0])
+    def close(self):
+        self.__release(unlink=False)
+    def unlink(self):
+        self.__release(unlink=True)
+
+    # Setup.
+    def __init__(self, rows, name=None, count=0):
+        self.rows = rows
+        self.count = count
+        size = 32 + rows*STATE_WIDTH*8 + rows*8
+        if name:
+            self.__shm = shared_memory.SharedMemory(name=name)
+            self.__owner = False
+        else:
+            self.__shm = shared_memory.SharedMemory(create=True, size=size)
+            self.__owner = True
+        self.name = self.__shm.name
+        buf = self.__shm.buf
+        self.SEQ = np.ndarray((1,), dtype=np.int64, buffer=buf)
+        self.TIME = np.ndarray((1,), dtype=np.float64, buffer=buf, offset=8)
+        self.VERSION = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=16)
+        self.DATA = np.ndarray((rows, STATE_WIDTH), dtype=np.float64, buffer=buf, offset=32)
+        self.ROW_VERSIONS = np.ndarray((rows,), dtype=np.int64, buffer=buf, offset=32+rows*STATE_WIDTH*8)
+        if self.__owner:
+            self.SEQ[0] = 0
+            self.TIME[0] = 0.0
+            self.VERSION[0] = 0
+            self.DATA[:] = 0.0
+            self.ROW_VERSIONS[:] = 0
+        self.__last = None
+
+    def __reduce__(self):
+        # Child processes re-attach to the same block by name.
+        return (State_Block, (self.rows, self.name, self.count))
+
+    # Writer side (seqlock).
+    def __enter__(self):
+        self.SEQ[0] += 1
+        return self.DATA
+    def __exit__(self, *e_info):
+        self.SEQ[0] += 1
+
+    def __mark_Dirty(self, n, dist, angle):
+        # Rows are compared with the values they had when last marked.
+        data = self.DATA
+        if self.__last is None:
+            self.__last = data[:,:12].copy()
+        last = self.__last
+        d_pos = data[:n,0:3] - last[:n,0:3]
+        moved = np.einsum("ij,ij->i", d_pos, d_pos) > dist*dist
+        moved |= np.abs(data[:n,6:12]-last[:n,6:12]).max(axis=1) > angle
+        if moved.any():
+            self.VERSION[0] += 1
+            self.ROW_VERSIONS[:n][moved] = self.VERSION[0]
+            last[:n][moved] = data[:n,:12][moved]
+
+    def __read_Versioned(self, rows):
+        seq = self.SEQ
+        while True:
+            s1 = int(seq[0])
+            if s1 & 1: continue
+            version = int(self.VERSION[0])
+            vals = self.DATA[rows].copy()
+            row_versions = self.ROW_VERSIONS[rows].copy()
+            if int(seq[0]) == s1:
+                return version, vals, row_versions
+
+    def __read(self, rows, out):
+        seq, data = self.SEQ, self.DATA
+        while True:
+            s1 = int(seq[0])
+            if s1 & 1: continue
+            if out is None:
+                vals = data[rows].copy()
+            elif isinstance(rows, slice):
+                vals = out
+                np.copyto(vals, data[rows])
+            else:
+                vals = out
+                np.take(data, rows, axis=0, out=vals)
+            if int(seq[0]) == s1:
+                return vals
+
+    def __release(self, unlink):
+        if self.__shm is None: return
+        self.SEQ = self.TIME = self.VERSION = self.DATA = self.ROW_VERSIONS = None
+        self.__shm.close()
+        if unlink and self.__owner:
+            self.__shm.unlink()
+        self.__shm = None
+
+
+# Ring of the last 'slots' published steps (sim time, wall time, position
+# and velocity of every body) in shared memory. Readers interpolate between
+# the two snapshots around any requested sim time with a cubic Hermite
+# spline, so callers can poll rarely and still place bodies smoothly.
+class Snapshot_Ring:
+
+    # Public.
+    def publish(self, sim_time, pos, vec):
+        self.__publish(sim_time, pos, vec)
+    def latest_time(self):
+        # (sim_time, wall_time) of the newest snapshot.
+        c = int(self.COUNT[0])
+        if not c: return None
+        slot = (c-1) % self.slots
+        return float(self.TIMES[slot,0]), float(self.TIMES[slot,1])
+    def render_time(self, delay=0.0):
+        # Sim time that corresponds to "now" on the wall clock, less 'delay'.
+        latest = self.latest_time()
+        if latest is None: return 0.0
+        sim_time, wall = latest
+        return sim_time + (monotonic()-wall) - delay
+    def sample(self, sim_time, rows=slice(None)):
+        return self.__sample(sim_time, rows)
+    def reset(self):
+        self.COUNT[0] = 0
+    def close(self):
+        self.__release(unlink=False)
+    def unlink(self):
+        self.__release(unlink=True)
+
+    # Setup.
+    def __init__(self, slots, rows, name=None):
+        self.slots = slots
+        self.rows = rows
+        size = 8 + slots*8 + slots*2*8 + slots*rows*6*8
+        if name:
+            self.__shm = shared_memory.SharedMemory(name=name)
+            self.__owner = False
+        else:
+            self.__shm = shared_memory.SharedMemory(create=True, size=size)
+            self.__owner = True
+        self.name = self.__shm.name
+        buf = self.__shm.buf
+        off = 0
+        self.COUNT = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=off)
+        off += 8
+        self.SLOT_SEQ = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=off)
+        off += slots*8
+        self.TIMES = np.ndarray((slots, 2), dtype=np.float64, buffer=buf, offset=off)
+        off += slots*2*8
+        self.DATA = np.ndarray((slots, rows, 6), dtype=np.float64, buffer=buf, offset=off)
+        if self.__owner:
+            self.COUNT[0] = 0
+            self.SLOT_SEQ[:] = 0
+
+    def __reduce__(self):
+        return (Snapshot_Ring, (self.slots, self.rows, self.name))
+
+    def __publish(self, sim_time, pos, vec):
+        c = int(self.COUNT[0])
+        slot = c % self.slots
+        n = len(pos)
+        self.SLOT_SEQ[slot] += 1
+        self.TIMES[slot] = (sim_time, monotonic())
+        self.DATA[slot,:n,0:3] = pos
+        self.DATA[slot,:n,3:6] = vec
+        self.SLOT_SEQ[slot] += 1
+        self.COUNT[0] = c+1
+
+    def __read_Slot(self, slot, rows):
+        seq = self.SLOT_SEQ
+        s1 = int(seq[slot])
+        if s1 & 1: return None
+        t = float(self.TIMES[slot,0])
+        vals = self.DATA[slot][rows].copy()
+        if int(seq[slot]) != s1: return None
+        return t, vals
+
+    def __sample(self, sim_time, rows):
+        # Walk back from the newest snapshot to the pair around 'sim_time'.
+        c = int(self.COUNT[0])
+        if not c: return None
+        newer = None
+        for back in range(1, min(c, self.slots)+1):
+            snap = self.__read_Slot((c-back) % self.slots, rows)
+            if snap is None: continue
+            if snap[0] <= sim_time: break
+            newer = snap
+        else:
+            # Older than the whole ring: use the oldest snapshot as is.
+            if newer is None: return None
+            return newer[1][...,0:3], newer[1][...,3:6]
+        t0, s0 = snap
+        if newer is None:
+            # Past the newest snapshot: extrapolate along velocity.
+            dt = sim_time - t0
+            return s0[...,0:3] + s0[...,3:6]*dt, s0[...,3:6]
+        t1, s1 = newer
+        h = t1 - t0
+        if h <= 0: return s1[...,0:3], s1[...,3:6]
+        return hermite(s0[...,0:3], s0[...,3:6], s1[...,0:3], s1[...,3:6], h, (sim_time-t0)/h)
+
+    def __release(self, unlink):
+        if self.__shm is None: return
+        self.COUNT = self.SLOT_SEQ = self.TIMES = self.DATA = None
+        self.__shm.close()
+        if unlink and self.__owner:
+            self.__shm.unlink()
+        self.__shm = None
+
+
+# Single producer / single consumer event queue in shared memory. The
+# physics loop appends fixed size records (kind, a, b, sim time) and then
+# advances HEAD; a reader keeps its own cursor and never writes, so no
+# lock is needed. Each slot also holds the number it was written as,
+# which lets a reader that fell more than 'slots' behind detect and skip
+# records that were overwritten.
+class Event_Ring:
+
+    # Public.
+    def push(self, kind, a, b, sim_time):
+        h = int(self.HEAD[0])
+        self.RECORDS[h % self.slots] = (h, kind, a, b, sim_time)
+        self.HEAD[0] = h+1
+    def read(self, cursor):
+        # Returns (events, new cursor, records lost).
+        return self.__read(cursor)
+    def reset(self):
+        self.HEAD[0] = 0
+    def close(self):
+        self.__release(unlink=False)
+    def unlink(self):
+        self.__release(unlink=True)
+
+    # Setup.
+    def __init__(self, slots, name=None):
+        self.slots = slots
+        size = 64 + slots*5*8
+        if name:
+            self.__shm = shared_memory.SharedMemory(name=name)
+            self.__owner = False
+        else:
+            self.__shm = shared_memory.SharedMemory(create=True, size=size)
+            self.__owner = True
+        self.name = self.__shm.name
+        buf = self.__shm.buf
+        self.HEAD = np.ndarray((1,), dtype=np.int64, buffer=buf)
+        self.RECORDS = np.ndarray((slots, 5), dtype=np.float64, buffer=buf, offset=64)
+        if self.__owner:
+            self.HEAD[0] = 0
+            self.RECORDS[:] = -1
+
+    def __reduce__(self):
+        return (Event_Ring, (self.slots, self.name))
+
+    def __read(self, cursor):
+        head = int(self.HEAD[0])
+        if cursor > head:
+            cursor = 0
+        lost = max(0, head-cursor-self.slots)
+        cursor += lost
+        events = []
+        for i in range(cursor, head):
+            seq, kind, a, b, t = self.RECORDS[i % self.slots].tolist()
+            if int(seq) != i:
+                lost += 1
+                continue
+            events.append((int(kind), int(a), int(b), t))
+        return events, head, lost
+
+    def __release(self, unlink):
+        if self.__shm is None: return
+        self.HEAD = self.RECORDS = None
+        self.__shm.close()
+        if unlink and self.__owner:
+            self.__shm.unlink()
+        self.__shm = None
+
+
+def hermite(p0, v0, p1, v1, h, u):
+    # Cubic Hermite position and velocity at 'u' (0..1) across a span of 'h'.
+    u2, u3 = u*u, u*u*u
+    pos = (2*u3-3*u2+1)*p0 + (u3-2*u2+u)*h*v0 + (-2*u3+3*u2)*p1 + (u3-u2)*h*v1
+    vec = ((6*u2-6*u)*p0 + (3*u2-4*u+1)*h*v0 + (-6*u2+6*u)*p1 + (3*u2-2*u)*h*v1) / h
+    return pos, vec
@@ -0,0 +1,38 @@
+# =======================
+# Solex - test_physics.py
+# =======================
+
+# Third party imports.
+import numpy as np
+
+# Local imports.
+from etc.settings import _path, _phys, _sim
+from etc.shiva import Shiva_Compiler as SC
+from solex.physics import Sys_Arrays, Block_Stepper, leapfrog_step, hierarchical_accel
+
+STEPS = 20000       # Base steps of 1/HZ sim secs.
+
+
+def test_block_steps_on_sol():
+    # The block stepper keeps within its drift target of leapfrog at the
+    # base step (whose own drift is far smaller), with a tenth of its
+    # force evaluations or fewer.
+    recipe = SC.compile_sys_recipe("{}/sol.shv".format(_path.SYSTEMS))
+    h = 1.0/_sim.HZ
+
+    lf = Sys_Arrays(recipe)
+    n = lf.count
+    get_accel = lambda: hierarchical_accel(lf.POS, lf.MASS, lf.PARENT, lf.LEVELS, _phys.G, lf.ACC)
+    get_accel()
+    for i in range(STEPS):
+        leapfrog_step(lf.POS, lf.VEC, lf.ACC, h, get_accel)
+
+    bs = Sys_Arrays(recipe)
+    blocks = Block_Stepper(bs, h)
+    for i in range(STEPS):
+        blocks.step(1)
+        blocks.sync()
+
+    block_err = np.linalg.norm(bs.POS[:n]-lf.POS[:n], axis=1).max()
+    assert block_err <= _sim.BLOCK_DRIFT*STEPS*h
+    assert blocks.evals < STEPS*n/10